@@ -24,7 +24,7 @@ from datetime import datetime
 
 from .proxylist import ProxyList, parse_proxyline
 from .tools.html import find_refresh_url, find_base_url
-from .response import Response
+from .response import Response, CHARSET_MEMO
 from . import error
 from .upload import UploadContent, UploadFile
 from .tools.http import normalize_http_values, normalize_url
@@ -163,6 +163,11 @@ def default_config():
         # into unicode, by default it is detected automatically
         document_charset = None,
 
+        # Remember charsets of hosts and do not scan the body of
+        # response to detect its charset if the charset of the host
+        # is already known
+        charset_memo = False,
+
         # Conent type control how DOM are built
         # For html type HTML DOM builder is used
         # For xml type XML DOM builder is used
@@ -184,6 +189,17 @@ def default_config():
         # It does not affect `response.body`
         strip_null_bytes = True,
 
+        # Build lXML tree only from the first `tree_maxsize` bytes of
+        # document body, the rest of the document is ignored
+        # It does not affect `response.body`
+        tree_maxsize = None,
+
+        # Remove scripts, styles and comments from document body
+        # before building lXML tree. Could be True or list of
+        # targets: "script", "style", "comment", "svg"
+        # It does not affect `response.body`
+        simplify_html = False,
+
         # Obsolete options, will be removed in future versions
         # Strip XML declaration before building unicode body
         strip_xml_declaration = True,
@@ -489,6 +505,9 @@ class Grab(LXMLExtension, FormExtension, PyqueryExtension,
 
         self.response.done_time = now
 
+        if (self.config['charset_memo'] and
+            self.config['document_charset'] is None):
+            self.response.detect_charset(memo=CHARSET_MEMO)
         self.config['charset'] = self.response.charset
 
         if self.config['reuse_cookies']:
@@ -10,31 +10,88 @@ import re
 import time
 import logging
 import traceback
+import threading
+import codecs
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import BytesIO as StringIO
 
 from ..error import DataNotFound, GrabMisuseError
 from ..base import GLOBAL_STATE
 from ..tools.text import normalize_space as normalize_space_func, find_number
-from ..tools.lxml_tools import get_node_text
+from ..tools.lxml_tools import get_node_text, iterxml
 from ..response import RE_XML_DECLARATION
+from ..tools.encoding import fix_special_entities
+from ..tools.html import simplify_html, SIMPLIFY_TARGETS
 from ..tools.internal import deprecated
+from ..selector.query import QUERY_REGISTRY
 
 logger = logging.getLogger('grab.ext.lxml')
 
 NULL = object()
 NULL_BYTE = chr(0)
+# Size of the body chunk which is decoded at once
+# to check that the body is valid in its charset
+CHECK_CHUNK_SIZE = 65536
+THREAD_STORAGE = threading.local()
+
+
+def get_html_parser(charset):
+    """
+    Return lxml HTML parser which decodes documents with the given charset.
+
+    Parsers are created once for each thread because the parser object
+    could not be used by several threads at once. Returns None if the
+    charset is not compatible with ASCII (like utf-16) or if libxml2
+    does not know it.
+    """
+
+    try:
+        parsers = THREAD_STORAGE.html_parsers
+    except AttributeError:
+        parsers = THREAD_STORAGE.html_parsers = {}
+    try:
+        return parsers[charset]
+    except KeyError:
+        from lxml.html import HTMLParser
+
+        parser = None
+        try:
+            if u'<html>'.encode(charset) == '<html>':
+                parser = HTMLParser(encoding=charset)
+        except LookupError:
+            pass
+        parsers[charset] = parser
+        return parser
+
+
+def find_valid_size(body, charset):
+    """
+    Check that the byte string could be decoded with the given charset.
+
+    The body is decoded by chunks so the full unicode copy of the body
+    is not created. Returns size of the body without incomplete
+    character at its end (the body could be truncated in the middle
+    of multibyte character) or None if the body contains bytes which
+    are invalid in the charset.
+    """
+
+    decoder = codecs.getincrementaldecoder(charset)('strict')
+    try:
+        for pos in xrange(0, len(body), CHECK_CHUNK_SIZE):
+            decoder.decode(body[pos:pos + CHECK_CHUNK_SIZE])
+        if isinstance(decoder, codecs.BufferedIncrementalDecoder):
+            pending = len(decoder.getstate()[0])
+        else:
+            # Decoders of multibyte CJK codecs do not expose their state
+            decoder.decode('', True)
+            pending = 0
+    except UnicodeDecodeError:
+        return None
+    else:
+        return len(body) - pending
 
-#rex_script = re.compile(r'<script[^>]*>.+?</script>', re.S)
-#rex_style = re.compile(r'<style[^>]*>.+?<?style>', re.S)
-#rex_comment = re.compile(r'<!--(?:.(?!-->))-->', re.S)
-
-#def simplify_html(html, targets=['script', 'style', 'comment']):
-    #if 'script' in targets:
-        #html = rex_script.sub(' ', html)
-    #if 'style' in targets:
-        #html = rex_style.sub(' ', html)
-    #if 'comment' in targets:
-        #html = rex_comment.sub(' ', html)
-    #return html
 
 class LXMLExtension(object):
     def extra_reset(self):
@@ -57,26 +114,11 @@ class LXMLExtension(object):
         from lxml.etree import ParserError
 
         if self._lxml_tree is None:
-            body = self.response.unicode_body(
-                fix_special_entities=self.config['fix_special_entities']
-            ).strip()
-            #if self.config['tidy']:
-                #from tidylib import tidy_document
-                #body, errors = tidy_document(body)
-            if self.config['lowercased_tree']:
-                body = body.lower()
-            if self.config['strip_null_bytes']:
-                body = body.replace(NULL_BYTE, '')
-            body = RE_XML_DECLARATION.sub('', body)
-            if not body:
-                # Generate minimal empty content
-                # which will not break lxml parser
-                body = '<html></html>'
+            body, parser = self.build_html_tree_body()
             start = time.time()
 
-            #body = simplify_html(body)
             try:
-                self._lxml_tree = fromstring(body)
+                self._lxml_tree = fromstring(body, parser=parser)
             except Exception, ex:
                 if (isinstance(ex, ParserError)
                     and 'Document is empty' in str(ex)
@@ -84,7 +126,7 @@ class LXMLExtension(object):
 
                     # Fix for "just a string" body
                     body = '<html>%s</html>'.format(body)
-                    self._lxml_tree = fromstring(body)
+                    self._lxml_tree = fromstring(body, parser=parser)
 
                 elif (isinstance(ex, TypeError)
                       and "object of type 'NoneType' has no len" in str(ex)
@@ -92,13 +134,87 @@ class LXMLExtension(object):
 
                     # Fix for smth like "<frameset></frameset>"
                     body = '<html>%s</html>'.format(body)
-                    self._lxml_tree = fromstring(body)
+                    self._lxml_tree = fromstring(body, parser=parser)
                 else:
                     raise
 
             GLOBAL_STATE['dom_build_time'] += (time.time() - start)
         return self._lxml_tree
 
+    def build_html_tree_body(self):
+        """
+        Prepare the body of the document to build the HTML DOM tree.
+
+        Returns pair of the body and lxml parser. If it is possible
+        the body is the byte string which is decoded by the parser
+        with the charset of the document, so the unicode copy of the
+        body is not created. Otherwise the unicode body is returned
+        and the parser is None.
+
+        If `tree_maxsize` option is set then only the beginning of
+        the document is returned. lxml closes the tags which are left
+        open, so the tree of that part could be queried as usual.
+        """
+
+        charset = self.response.charset
+        parser = None
+        if not self.config['lowercased_tree']:
+            parser = get_html_parser(charset)
+        if parser is not None:
+            body = self.response.body or ''
+            if self.response.bom:
+                body = body[len(self.response.bom):]
+            if self.config['tree_maxsize'] is not None:
+                body = body[:self.config['tree_maxsize']]
+            if self.config['fix_special_entities']:
+                body = fix_special_entities(body)
+            body = self.simplify_tree_body(body)
+            size = find_valid_size(body, charset)
+            if size is None:
+                # Python ignores broken bytes, libxml2 does not
+                parser = None
+            elif size < len(body):
+                body = body[:size]
+        if parser is not None:
+            if self.config['strip_null_bytes']:
+                body = body.replace(NULL_BYTE, '')
+            body = RE_XML_DECLARATION.sub('', body)
+        else:
+            body = self.response.unicode_body(
+                fix_special_entities=self.config['fix_special_entities']
+            )
+            if self.config['tree_maxsize'] is not None:
+                # Approximate limit, characters are counted instead
+                # of bytes
+                body = body[:self.config['tree_maxsize']]
+            body = self.simplify_tree_body(body)
+            #if self.config['tidy']:
+                #from tidylib import tidy_document
+                #body, errors = tidy_document(body)
+            if self.config['lowercased_tree']:
+                body = body.lower()
+            if self.config['strip_null_bytes']:
+                body = body.replace(NULL_BYTE, '')
+            body = RE_XML_DECLARATION.sub('', body)
+        if not body or body.isspace():
+            # Generate minimal empty content
+            # which will not break lxml parser
+            body = '<html></html>'
+        return body, parser
+
+    def simplify_tree_body(self, body):
+        """
+        Remove scripts, styles, etc from the body according to
+        `simplify_html` option.
+        """
+
+        targets = self.config['simplify_html']
+        if not targets:
+            return body
+        if targets is True:
+            targets = SIMPLIFY_TARGETS
+        return simplify_html(body, targets)
+
     @property
     def xml_tree(self):
         """
@@ -116,6 +232,27 @@ class LXMLExtension(object):
             self._strict_lxml_tree = fromstring(self.response.body)
         return self._strict_lxml_tree
 
+    def iterxml(self, tag):
+        """
+        Iterate over elements of XML document without building the full
+        DOM tree.
+
+        Arguments:
+        * tag - name of the elements to yield (or list of names), like
+            "item" or "{*}loc" for the element with any namespace
+
+        Elements are removed from the tree after they are processed,
+        so huge XML documents could be processed in constant memory.
+        If the body of the response is saved into the file
+        (see `body_inmemory` option) then it is read from that file.
+        """
+
+        if self.response.body_path:
+            source = self.response.body_path
+        else:
+            source = StringIO(self.response.body or '')
+        return iterxml(source, tag=tag)
+
     def find_link(self, href_pattern, make_absolute=True):
         """
         Find link in response body which href value matches ``href_pattern``.
@@ -280,7 +417,11 @@ class LXMLExtension(object):
         Find all elements which match given css path.
         """
 
-        return self.tree.cssselect(path)
+        if self.config['content_type'] == 'xml':
+            translator = 'xml'
+        else:
+            translator = 'html'
+        return QUERY_REGISTRY.css(path, translator=translator)(self.tree)
 
     def css_text(self, path, default=NULL, smart=False, normalize_space=True):
         """
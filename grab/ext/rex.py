@@ -7,7 +7,7 @@ from contextlib import contextmanager
 from ..error import DataNotFound, GrabError, GrabMisuseError
 from ..tools.text import normalize_space
 from ..tools.html import decode_entities
-from ..tools.rex import rex_cache
+from ..tools.rex import rex_cache, RexScanner
 
 NULL = object()
 
@@ -60,6 +60,25 @@ class RegexpExtension(object):
             else:
                 return default
 
+    def rex_scan(self, patterns, flags=0, byte=False):
+        """
+        Search many regular expressions in response body.
+
+        :param patterns: :class:`grab.tools.rex.RexScanner` object or dict
+            of named regular expressions
+        :param byte: if False then search is performed in `response.unicode_body()`
+            else the rexes are searched in `response.body` which is not decoded.
+
+        Return dict with list of found match objects for each regular expression.
+        """
+
+        if not isinstance(patterns, RexScanner):
+            patterns = RexScanner(patterns, flags=flags)
+        if byte:
+            return patterns.scan(self.response.body)
+        else:
+            return patterns.scan(self.response.unicode_body())
+
     def normalize_regexp(self, regexp, flags=0):
         """
         Accept string or compiled regular expression object.
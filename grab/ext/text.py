@@ -8,6 +8,7 @@ import logging
 from ..error import DataNotFound, GrabError, GrabMisuseError
 from ..tools.text import normalize_space
 from ..tools.html import decode_entities
+from ..tools.encoding import is_byte_searchable
 
 class TextExtension(object):
     def search(self, anchor, byte=False):
@@ -21,13 +22,20 @@ class TextExtension(object):
             search will be performed in `resonse.body`
         
         If substring is found return True else False.
+
+        If the charset of the response allows, the unicode anchor is encoded
+        and searched in `response.body`, so the body is not decoded.
         """
 
         if isinstance(anchor, unicode):
             if byte:
                 raise GrabMisuseError('The anchor should be bytes string in byte mode')
             else:
-                return anchor in self.response.unicode_body()
+                byte_anchor = self.encode_anchor(anchor)
+                if byte_anchor is None:
+                    return anchor in self.response.unicode_body()
+                else:
+                    return byte_anchor in self.response.body
 
         if not isinstance(anchor, unicode):
             if byte:
@@ -35,6 +43,26 @@ class TextExtension(object):
             else:
                 raise GrabMisuseError('The anchor should be byte string in non-byte mode')
 
+    def encode_anchor(self, anchor):
+        """
+        Encode the unicode anchor with the charset of the response.
+
+        Return None if the anchor could not be searched in `response.body`
+        with the same result as in `response.unicode_body()`.
+        """
+
+        # Some numeric entities are changed in the unicode body,
+        # see `grab.tools.encoding.fix_special_entities`
+        if u'&#' in anchor:
+            return None
+        charset = self.response.charset
+        if not is_byte_searchable(charset):
+            return None
+        try:
+            return anchor.encode(charset)
+        except UnicodeEncodeError:
+            return None
+
     def assert_substring(self, anchor, byte=False):
         """
         If `anchor` is not found then raise `DataNotFound` exception.
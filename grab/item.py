@@ -29,8 +29,11 @@ from datetime import datetime
 import logging
 
 from .tools.lxml_tools import get_node_text
-from .error import DataNotFound
+from .error import DataNotFound, GrabMisuseError
 from .selector import Selector
+from .selector.query import QUERY_REGISTRY
+from .selector.schema import (Schema, Group, Value, parse_indexed_query,
+                              iter_indexed)
 
 NULL = object()
 
@@ -61,6 +64,60 @@ class Field(object):
         else:
             return value
 
+    def get_text(self, item):
+        """
+        Return the text of the node found by the query of the field.
+
+        The text of the node is saved in the memo of the item, so it is
+        extracted only once if several fields use the same node.
+        """
+
+        node = item._selector.select(self.xpath_exp).node()
+        return get_node_text(node, memo=item._text_memo)
+
+    def schema_field(self):
+        """
+        Return field of extraction schema which finds the text of
+        the field or None if the field could not be extracted eagerly.
+        """
+
+        if self.xpath_exp is None:
+            return None
+        # Schema returns NULL if the node is not found
+        return Value(self.xpath_exp, default=NULL)
+
+    def from_text(self, text):
+        """
+        Build the value of the field from the extracted text.
+        """
+
+        return self.process(text)
+
+    def eager_value(self, text):
+        """
+        Build the value of the field like it is done by the decorators
+        of `__get__` method.
+        """
+
+        try:
+            if self.xpath_exp is None:
+                value = None if self.default is NULL else self.default
+            elif text is NULL:
+                raise DataNotFound('Field %s not found: %s' % (
+                    self.attr_name, self.xpath_exp))
+            else:
+                value = self.from_text(text)
+        except DataNotFound:
+            if self.default is not NULL:
+                value = self.default
+            else:
+                raise
+        else:
+            if self.empty_default is not NULL:
+                if not value:
+                    value = self.empty_default
+        return value
+
 
 def cached(func):
     def internal(self, item, itemtype):
@@ -120,6 +177,9 @@ class NullField(Field):
     def __get__(self, item, itemtype):
         return self.process(None)
 
+    def from_text(self, text):
+        return self.process(None)
+
 
 class ItemListField(Field):
     def __init__(self, xpath, item_cls, *args, **kwargs):
@@ -137,13 +197,39 @@ class ItemListField(Field):
             subitems.append(subitem)
         return self.process(subitems)
 
+    def schema_field(self):
+        if self.xpath_exp is None:
+            return None
+        return ItemGroup(self.xpath_exp, self.item_cls._get_schema().fields)
+
+    def from_text(self, rows):
+        return self.process([self.item_cls._build_eager(node, data, None, {})
+                             for node, data in rows])
+
+
+class ItemGroup(Group):
+    """
+    Group which returns (node, values) pairs, so nested eager items
+    are built with their nodes.
+    """
+
+    def extract(self, node, name, as_tuple, found):
+        if self.index_key is None:
+            nodes = self.xpath(node)
+        else:
+            nodes = found.get(self.index_key, [])
+        return [(x, self.schema.extract_node(x, as_tuple)) for x in nodes]
+
 
 class IntegerField(Field):
     @cached
     @default
     @empty
     def __get__(self, item, itemtype):
-        value = item._selector.select(self.xpath_exp).text()
+        value = self.get_text(item)
+        return self.from_text(value)
+
+    def from_text(self, value):
         if self.empty_default is not NULL:
             if value == "":
                 return self.empty_default
@@ -155,7 +241,7 @@ class StringField(Field):
     @default
     @empty
     def __get__(self, item, itemtype):
-        value = item._selector.select(self.xpath_exp).text()
+        value = self.get_text(item)
         return self.process(value)
 
 
@@ -167,7 +253,10 @@ class RegexField(Field):
     @cached
     @default
     def __get__(self, item, itemtype):
-        value = item._selector.select(self.xpath_exp).text()
+        value = self.get_text(item)
+        return self.from_text(value)
+
+    def from_text(self, value):
         match = self.regex.search(value)
         if match:
             return self.process(match.group(1))
@@ -183,7 +272,10 @@ class DateTimeField(Field):
     @cached
     @default
     def __get__(self, item, itemtype):
-        value = item._selector.select(self.xpath_exp).text()
+        value = self.get_text(item)
+        return self.from_text(value)
+
+    def from_text(self, value):
         return datetime.strptime(self.process(value),
                                  self.datetime_format)
 
@@ -203,6 +295,10 @@ class FuncField(Field):
             val = self.func(item._selector)
         return self.process(val)
 
+    def schema_field(self):
+        raise GrabMisuseError('Function field %s could not be extracted '
+                              'eagerly' % self.attr_name)
+
 
 def func_field(pass_item=False, *args, **kwargs):
     def inner(func):
@@ -219,6 +315,9 @@ def func_field(pass_item=False, *args, **kwargs):
 class ItemBuilder(type):
     def __new__(cls, name, base, namespace):
         fields = {}
+        # Fields of base item classes are inherited
+        for base_cls in reversed(base):
+            fields.update(getattr(base_cls, '_fields', {}))
         for attr in namespace:
             if isinstance(namespace[attr], Field):
                 field = namespace[attr]
@@ -235,21 +334,100 @@ class Item(object):
     def __init__(self, tree, grab=None):
         self._tree = tree
         self._cache = {}
+        self._text_memo = {}
         self._grab = grab
         self._selector = Selector(self._tree)
 
     @classmethod
     def find(cls, root, **kwargs):
-        for count, sel in enumerate(root.select(cls.Meta.find_selector)):
-            item = cls(sel.node)
-            item._parse(**kwargs)
-            item._position = count
-            yield item
-
+        """
+        Find items in the document.
+
+        Arguments:
+        * root - `Selector` object
+        * kwargs - arguments for `_parse` method
+
+        Nodes of items are found with `Meta.find_selector` query. If
+        `Meta.eager` is True then all fields of each item are extracted
+        at once with compiled queries and values are stored in slots,
+        see `find_eager`.
+        """
+
+        meta = getattr(cls, 'Meta', None)
+        if getattr(meta, 'eager', False):
+            for item in cls.find_eager(root, **kwargs):
+                yield item
+        else:
+            for count, sel in enumerate(root.select(cls.Meta.find_selector)):
+                item = cls(sel.node)
+                item._parse(**kwargs)
+                item._position = count
+                yield item
 
     @classmethod
     def find_one(cls, *args, **kwargs):
-        return list(cls.find(*args, **kwargs))[0]
+        for item in cls.find(*args, **kwargs):
+            return item
+        raise DataNotFound('Could not find item %s' % cls.__name__)
+
+    @classmethod
+    def find_eager(cls, root, **kwargs):
+        """
+        Find items and extract all their fields at once.
+
+        Queries of all fields are compiled once for each item class
+        (function fields are not supported). Items are instances of
+        the subclass of the item class which stores values of fields in
+        slots, the slots replace the fields of the item class. Item
+        classes do not define `__slots__`, so items still have `__dict__`
+        and `_parse` could set other attributes. `_tree`, `_selector` and
+        `_grab` attributes are available in `_parse` like in lazy items.
+        Unlike lazy items, the item is not created if the field without
+        default value is not found: `DataNotFound` is raised.
+        """
+
+        schema = cls._get_schema()
+        root = getattr(root, 'node', root)
+        key = parse_indexed_query(cls.Meta.find_selector)
+        if key is None:
+            nodes = QUERY_REGISTRY.xpath(cls.Meta.find_selector)(root)
+        else:
+            # Nodes are found lazily, so `find_one` stops at first item
+            nodes = iter_indexed(root, key)
+        for count, node in enumerate(nodes):
+            yield cls._build_eager(node, schema.extract_node(node, False),
+                                   count, kwargs)
+
+    @classmethod
+    def _get_schema(cls):
+        if '_eager_schema' not in cls.__dict__:
+            fields = []
+            for name, field in cls._fields.items():
+                schema_field = field.schema_field()
+                if schema_field is not None:
+                    fields.append((name, schema_field))
+            cls._eager_schema = Schema(fields)
+            slots = tuple(cls._fields.keys()) + ('_position', '_tree',
+                                                 '_grab')
+            cls._eager_cls = type(cls.__name__, (cls,),
+                                  {'__slots__': slots,
+                                   '__module__': cls.__module__,
+                                   # Selector is created only if it is used
+                                   '_selector': property(
+                                       lambda self: Selector(self._tree))})
+        return cls._eager_schema
+
+    @classmethod
+    def _build_eager(cls, node, data, position, kwargs):
+        cls._get_schema()
+        item = cls._eager_cls.__new__(cls._eager_cls)
+        for name, field in cls._fields.iteritems():
+            setattr(item, name, field.eager_value(data.get(name, NULL)))
+        item._position = position
+        item._tree = node
+        item._grab = None
+        item._parse(**kwargs)
+        return item
 
     def _parse(self, url=None, **kwargs):
         pass
@@ -4,7 +4,6 @@ The Response class is the result of network request maden with Grab instance.
 import re
 from copy import copy
 import logging
-import email
 #from cookielib import CookieJar
 try:
     from urllib2 import Request
@@ -18,40 +17,182 @@ except ImportError:
     from urllib.parse import urlsplit, parse_qs
 import tempfile
 import webbrowser
-import codecs
 from grab.tools import encoding as encoding_tools
+from grab.tools.w3lib_encoding import (read_bom, find_declared_encoding,
+                                       resolve_encoding)
 
 from .tools.files import hashed_path
 
 RE_XML_DECLARATION = re.compile(r'^[^<]{,100}<\?xml[^>]+\?>', re.I)
-RE_DECLARATION_ENCODING = re.compile(r'encoding\s*=\s*["\']([^"\']+)["\']')
-RE_META_CHARSET = re.compile(r'<meta[^>]+content\s*=\s*[^>]+charset=([-\w]+)',
-                             re.I)
-
-# Bom processing logic was copied from
-# https://github.com/scrapy/w3lib/blob/master/w3lib/encoding.py
-_BOM_TABLE = [
-    (codecs.BOM_UTF32_BE, 'utf-32-be'),
-    (codecs.BOM_UTF32_LE, 'utf-32-le'),
-    (codecs.BOM_UTF16_BE, 'utf-16-be'),
-    (codecs.BOM_UTF16_LE, 'utf-16-le'),
-    (codecs.BOM_UTF8, 'utf-8')
-]
-
-_FIRST_CHARS = set(char[0] for (char, name) in _BOM_TABLE)
-
-def read_bom(data):
-    """Read the byte order mark in the text, if present, and 
-    return the encoding represented by the BOM and the BOM.
-
-    If no BOM can be detected, (None, None) is returned.
+RE_CONTENT_TYPE = re.compile(r'^content-type:[ \t]*([^\r\n]*)', re.I | re.M)
+# Number of responses with the same charset after which the charset
+# of the host is remembered
+CHARSET_MEMO_THRESHOLD = 5
+
+
+class CharsetMemo(object):
+    """
+    Remember charsets of hosts.
+
+    The charset is remembered when `threshold` responses of the host in
+    a row have the same charset. Response with different charset resets
+    the counter of the host.
+    """
+
+    def __init__(self, threshold=CHARSET_MEMO_THRESHOLD):
+        self.threshold = threshold
+        self.hosts = {}
+
+    def get(self, host):
+        try:
+            charset, count = self.hosts[host]
+        except KeyError:
+            return None
+        if count >= self.threshold:
+            return charset
+        else:
+            return None
+
+    def learn(self, host, charset):
+        try:
+            old_charset, count = self.hosts[host]
+        except KeyError:
+            old_charset, count = None, 0
+        if old_charset == charset:
+            self.hosts[host] = (charset, count + 1)
+        else:
+            self.hosts[host] = (charset, 1)
+
+
+# Charsets of hosts learned by all Grab instances
+# which have `charset_memo` option enabled
+CHARSET_MEMO = CharsetMemo()
+
+
+class ResponseHeaders(object):
     """
-    # common case is no BOM, so this is fast
-    if data and data[0] in _FIRST_CHARS:
-        for bom, encoding in _BOM_TABLE:
-            if data.startswith(bom):
-                return encoding, bom
-    return None, None
+    Headers of HTTP response.
+
+    The raw text of headers is split into lines only when some header
+    is accessed. Names of headers are case-insensitive. If the header
+    occurs multiple times then its first value is returned, use
+    `get_all` method to get all values.
+
+    The interface is compatible with `email.message.Message` object
+    which was used for response headers before.
+    """
+
+    def __init__(self, raw=''):
+        self.raw = raw
+        self._items = None
+        self._index = None
+
+    def _parse(self):
+        items = []
+        for line in self.raw.split('\n'):
+            line = line.rstrip('\r')
+            if not line:
+                continue
+            if line[0] in ' \t':
+                # Continuation of the previous header
+                if items:
+                    items[-1] = (items[-1][0],
+                                 items[-1][1] + ' ' + line.strip())
+            elif ':' in line:
+                name, value = line.split(':', 1)
+                items.append((name.strip(), value.strip()))
+        index = {}
+        for name, value in items:
+            index.setdefault(name.lower(), []).append(value)
+        self._items = items
+        self._index = index
+
+    @property
+    def content_type(self):
+        """
+        Value of Content-Type header or None.
+
+        The header is found without parsing of all headers.
+        """
+
+        if self._index is None:
+            match = RE_CONTENT_TYPE.search(self.raw)
+            return match.group(1).strip() if match else None
+        else:
+            return self.get('Content-Type')
+
+    def get_all(self, name, failobj=None):
+        if self._index is None:
+            self._parse()
+        return self._index.get(name.lower(), failobj)
+
+    def getheaders(self, name):
+        return self.get_all(name, [])
+
+    def get(self, name, failobj=None):
+        values = self.get_all(name)
+        return values[0] if values else failobj
+
+    getheader = get
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def __contains__(self, name):
+        return self.get_all(name) is not None
+
+    has_key = __contains__
+
+    def keys(self):
+        if self._items is None:
+            self._parse()
+        return [x[0] for x in self._items]
+
+    def values(self):
+        if self._items is None:
+            self._parse()
+        return [x[1] for x in self._items]
+
+    def items(self):
+        if self._items is None:
+            self._parse()
+        return list(self._items)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        if self._items is None:
+            self._parse()
+        return len(self._items)
+
+    def __str__(self):
+        if self._items is None:
+            self._parse()
+        return ''.join('%s: %s\n' % x for x in self._items)
+
+
+def find_last_response(head):
+    """
+    Return (status, headers) pair of the last response in the `head`.
+
+    The head could contain multiple responses, for example, when
+    301/302 redirect was processed automatically.
+    """
+
+    if head.startswith('HTTP'):
+        start = 0
+    else:
+        start = -1
+    pos = head.rfind('\nHTTP')
+    if pos > -1:
+        start = pos + 1
+    if start == -1:
+        return None, head
+    end = head.find('\n', start)
+    if end == -1:
+        return head[start:].rstrip('\r'), ''
+    return head[start:end].rstrip('\r'), head[end + 1:]
 
 
 class Response(object):
@@ -70,7 +211,8 @@ class Response(object):
         self.url = None
         self.cookies = {}
         #self.cookiejar = None
-        self.charset = 'utf-8'
+        # Charset is detected when it is accessed first time
+        self._charset = None
         self._unicode_body = None
         self.bom = None
         self.done_time = None
@@ -82,34 +224,23 @@ class Response(object):
         This method is called after Grab instance performes network request.
         """
 
-        # Extract only valid lines which contain ":" character
-        valid_lines = []
-        for line in self.head.split('\n'):
-            line = line.rstrip('\r')
-            if line:
-                # Each HTTP line meand the start of new response
-                # self.head could contains info about multiple responses
-                # For example, then 301/302 redirect was processed automatically
-                # Maybe it is a bug and should be fixed
-                # Anyway, we handle this issue here and save headers
-                # only from last response
-                if line.startswith('HTTP'):
-                    self.status = line
-                    valid_lines = []
-                else:
-                    if ':' in line:
-                        valid_lines.append(line)
-
-        self.headers = email.message_from_string('\n'.join(valid_lines))
+        # self.head could contains info about multiple responses
+        # For example, then 301/302 redirect was processed automatically
+        # Headers are saved only from last response
+        status, raw_headers = find_last_response(self.head)
+        if status is not None:
+            self.status = status
+        # Headers are parsed only when they are accessed
+        self.headers = ResponseHeaders(raw_headers)
         #self.cookiejar = CookieJar()
         #self.cookiejar._extract_cookies(self, Request(self.url))
         #for cookie in self.cookiejar:
             #self.cookies[cookie.name] = cookie.value
 
-        if charset is None:
-            self.detect_charset()
-        else:
-            self.charset = charset
+        self.bom = None
+        # If charset is not given then it is detected when it is
+        # accessed first time
+        self._charset = charset
 
         self._unicode_body = None
 
@@ -122,18 +253,25 @@ class Response(object):
         return self.headers
 
 
-    def detect_charset(self):
+    def detect_charset(self, memo=None):
         """
         Detect charset of the response.
 
         Try following methods:
-        * meta[name="Http-Equiv"]
-        * XML declaration
+        * byte order mark
+        * <meta> tag with charset (in any form) or XML declaration,
+            the beginning of the body is scanned once and the first
+            of them is used
         * HTTP Content-Type header
 
         Ignore unknown charsets.
 
         Use utf-8 as fallback charset.
+
+        Arguments:
+        * memo - `CharsetMemo` instance, if the charset of the response
+            host is already known and the response has neither BOM nor
+            charset in Content-Type header then the body is not scanned
         """
 
         charset = None
@@ -146,42 +284,63 @@ class Response(object):
             body_chunk = self._body[:4096]
 
         if body_chunk:
-            # Try to extract charset from http-equiv meta tag
-            try:
-                charset = RE_META_CHARSET.search(body_chunk).group(1)
-            except AttributeError:
-                pass
-
-            # TODO: <meta charset="utf-8" />
             bom_enc, bom = read_bom(body_chunk)
             if bom_enc:
                 charset = bom_enc
                 self.bom = bom
 
-            # Try to process XML declaration
-            if not charset:
-                if body_chunk.startswith('<?xml'):
-                    match = RE_XML_DECLARATION.search(body_chunk)
-                    if match:
-                        enc_match = RE_DECLARATION_ENCODING.search(match.group(0))
-                        if enc_match:
-                            charset = enc_match.group(1)
+        header_charset = None
+        if not charset and self.headers is not None:
+            if isinstance(self.headers, ResponseHeaders):
+                content_type = self.headers.content_type
+            else:
+                content_type = self.headers.get('Content-Type')
+            if content_type:
+                pos = content_type.find('charset=')
+                if pos > -1:
+                    header_charset = content_type[(pos + 8):].split(';')[0]\
+                                     .strip(' "\'')
+
+        host = None
+        if memo is not None and not charset:
+            host = urlsplit(self.url or '').hostname
+            # The memo is used only if nothing else declares the charset,
+            # responses with declared charset are used to update the memo
+            if not header_charset:
+                charset = memo.get(host)
+                if charset:
+                    self._charset = charset
+                    return
+
+        if body_chunk and not charset:
+            charset = find_declared_encoding(body_chunk)
 
         if not charset:
-            if 'Content-Type' in self.headers:
-                pos = self.headers['Content-Type'].find('charset=')
-                if pos > -1:
-                    charset = self.headers['Content-Type'][(pos + 8):]
+            charset = header_charset
 
         if charset:
             # Check that python knows such charset
-            try:
-                codecs.lookup(charset)
-            except LookupError:
+            resolved_charset = resolve_encoding(charset)
+            if resolved_charset is None:
                 logging.error('Unknown charset found: %s' % charset)
-                self.charset = 'utf-8'
+                charset = 'utf-8'
             else:
-                self.charset = charset
+                charset = resolved_charset
+        else:
+            charset = 'utf-8'
+        self._charset = charset
+        if host is not None:
+            memo.learn(host, charset)
+
+    def _get_charset(self):
+        if self._charset is None:
+            self.detect_charset()
+        return self._charset
+
+    def _set_charset(self, charset):
+        self._charset = charset
+
+    charset = property(_get_charset, _set_charset)
 
     def unicode_body(self, ignore_errors=True, fix_special_entities=True):
         """
@@ -193,13 +352,15 @@ class Response(object):
                 errors = 'ignore'
             else:
                 errors = 'strict'
+            # Charset detection also finds the byte order mark
+            charset = self.charset
             if self.bom:
                 body = self.body[len(self.bom):]
             else:
                 body = self.body
             if fix_special_entities:
                 body = encoding_tools.fix_special_entities(body)
-            ubody = body.decode(self.charset, errors).strip()
+            ubody = body.decode(charset, errors).strip()
             self._unicode_body = ubody
         return self._unicode_body
 
@@ -211,7 +372,7 @@ class Response(object):
         obj = Response()
 
         copy_keys = ('status', 'code', 'head', 'body', 'time',
-                     'url', 'charset', '_unicode_body')
+                     'url', 'charset', 'bom', '_unicode_body')
         for key in copy_keys:
             setattr(obj, key, getattr(self, key))
 
@@ -0,0 +1,121 @@
+"""
+Registry of compiled XPath and CSS queries.
+
+Compilation of XPath expression and translation of CSS expression into
+XPath take more time than evaluation of simple query on small document.
+The registry keeps compiled queries, the number of them is limited, so
+the memory is not leaked when queries are built dynamically.
+"""
+from __future__ import absolute_import
+from collections import deque
+import threading
+
+from lxml.etree import XPath
+
+__all__ = ('QueryRegistry', 'QUERY_REGISTRY')
+QUERY_CACHE_SIZE = 1000
+
+
+class QueryRegistry(object):
+    """
+    LRU cache of compiled queries.
+
+    Arguments:
+    * maxsize - maximum number of compiled queries in the registry
+    """
+
+    def __init__(self, maxsize=QUERY_CACHE_SIZE):
+        self.maxsize = maxsize
+        # Maps key to [tick, query], the tick is the time of last use
+        self.cache = {}
+        # (tick, key) pairs in order of use, the pair is outdated if
+        # the key was used again later
+        self.queue = deque()
+        self.tick = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def touch(self, key, record):
+        self.tick += 1
+        record[0] = self.tick
+        self.queue.append((self.tick, key))
+
+    def get(self, key, builder):
+        with self.lock:
+            try:
+                record = self.cache[key]
+            except KeyError:
+                self.misses += 1
+            else:
+                # Move the query to the end of the queue
+                self.touch(key, record)
+                self.hits += 1
+                self.compact_queue()
+                return record[1]
+        obj = builder()
+        with self.lock:
+            record = self.cache.get(key)
+            if record is None:
+                record = [0, obj]
+                self.cache[key] = record
+            self.touch(key, record)
+            while len(self.cache) > self.maxsize:
+                tick, old_key = self.queue.popleft()
+                if self.cache[old_key][0] == tick:
+                    del self.cache[old_key]
+            self.compact_queue()
+        return record[1]
+
+    def compact_queue(self):
+        """
+        Remove outdated pairs from the queue if there are many of them.
+        """
+
+        if len(self.queue) > 2 * len(self.cache) + 100:
+            self.queue = deque(sorted((tick, key) for key, (tick, obj)
+                                      in self.cache.iteritems()))
+
+    def xpath(self, query):
+        """
+        Return compiled XPath object.
+        """
+
+        return self.get(('xpath', query), lambda: XPath(query))
+
+    def css(self, query, translator='html'):
+        """
+        Return XPath object built from CSS expression.
+
+        Arguments:
+        * translator - "html" for HTML documents or "xml"
+        """
+
+        from lxml.cssselect import CSSSelector
+
+        return self.get(('css', translator, query),
+                        lambda: CSSSelector(query, translator=translator))
+
+    def stats(self):
+        """
+        Return dict with size of the registry, numbers of hits, misses
+        and the hit ratio.
+        """
+
+        total = self.hits + self.misses
+        return {
+            'size': len(self.cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'ratio': float(self.hits) / total if total else 0,
+        }
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.queue.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+QUERY_REGISTRY = QueryRegistry()
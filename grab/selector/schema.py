@@ -0,0 +1,251 @@
+"""
+Extraction schemas: extract many fields from the document in one call.
+
+Schema is a set of named queries which are compiled once and then are
+applied to the DOM tree of each document. Extracted values are returned
+as plain dict (or tuple), the selector objects are not created for found
+nodes.
+
+Queries like `//div[@class="price"]` or `.//a[@rel="tag"]` are the most
+common ones. XPath engine scans the whole tree for each of them, so the
+schema finds nodes for all such queries in one pass over the tree.
+
+Example::
+
+    >>> from grab.selector.schema import Schema, Group, Value
+    >>> schema = Schema({
+    ...     'title': '//h1',
+    ...     'price': ('//span[@class="price"]', find_number),
+    ...     'tags': Value('//a[@rel="tag"]', multiple=True),
+    ...     'offers': Group('//div[@class="offer"]', {
+    ...         'name': './/b',
+    ...         'url': './/a/@href',
+    ...     }),
+    ... })
+    >>> schema.extract(grab.tree)
+    {'title': u'...', 'price': 100, 'tags': [...], 'offers': [{...}, ...]}
+"""
+from __future__ import absolute_import
+import time
+import re
+
+from ..tools.lxml_tools import get_node_text
+from ..tools.text import normalize_space as normalize_space_func
+from ..error import DataNotFound
+from ..base import GLOBAL_STATE
+from .query import QUERY_REGISTRY
+
+__all__ = ('Schema', 'Group', 'Value')
+NULL = object()
+RE_INDEXED_QUERY = re.compile(r'''
+    ^(\.?)//([a-zA-Z][\w-]*)
+    \[@([\w-]+)\s*=\s*(?:"([^"]*)"|'([^']*)')\]$
+''', re.X)
+
+
+def parse_indexed_query(query):
+    """
+    Return (scope, tag, attribute, value) tuple if the query is like
+    `//tag[@attribute="value"]`, scope is "doc" for search in whole
+    document and "node" for `.//` queries. Otherwise return None.
+    """
+
+    match = RE_INDEXED_QUERY.match(query)
+    if not match:
+        return None
+    relative, tag, attr, value1, value2 = match.groups()
+    value = value1 if value1 is not None else value2
+    if isinstance(value, str):
+        value = value.decode('utf-8')
+    return ('node' if relative else 'doc', tag, attr, value)
+
+
+def iter_indexed(node, key):
+    """
+    Iterate over nodes which match the query parsed with
+    `parse_indexed_query`. Unlike XPath query the nodes are found
+    lazily, so the search could be stopped at the first node.
+    """
+
+    scope, tag, attr, value = key
+    if scope == 'doc':
+        elements = node.getroottree().iter(tag)
+    else:
+        elements = node.iterdescendants(tag)
+    for elem in elements:
+        if elem.get(attr) == value:
+            yield elem
+
+
+class Value(object):
+    """
+    Text of the node found by XPath query.
+
+    Arguments:
+    * query - XPath expression
+    * processor - function which is applied to the text
+    * default - value which is returned if nothing is found,
+        by default `DataNotFound` is raised
+    * multiple - if True then list of values of all found nodes
+        is returned
+    * smart, normalize_space - see `get_node_text`
+    """
+
+    def __init__(self, query, processor=None, default=NULL, multiple=False,
+                 smart=False, normalize_space=True):
+        self.query = query
+        self.xpath = QUERY_REGISTRY.xpath(query)
+        self.index_key = parse_indexed_query(query)
+        self.processor = processor
+        self.default = default
+        self.multiple = multiple
+        self.smart = smart
+        self.normalize_space = normalize_space
+
+    def extract(self, node, name, as_tuple, found):
+        if self.index_key is None:
+            result = self.xpath(node)
+        else:
+            result = found.get(self.index_key, [])
+        if not isinstance(result, list):
+            # Query like "count(//a)" returns the value
+            return self.process(result)
+        if self.multiple:
+            return [self.process(x) for x in result]
+        if not result:
+            if self.default is NULL:
+                raise DataNotFound('Field %s not found: %s' % (name,
+                                                               self.query))
+            return self.default
+        return self.process(result[0])
+
+    def process(self, item):
+        if isinstance(item, basestring):
+            if self.normalize_space:
+                item = normalize_space_func(item)
+        elif not isinstance(item, (float, bool)):
+            item = get_node_text(item, smart=self.smart,
+                                 normalize_space=self.normalize_space)
+        if self.processor is None:
+            return item
+        else:
+            return self.processor(item)
+
+
+class Schema(object):
+    """
+    Set of named fields.
+
+    Arguments:
+    * fields - dict or list of (name, field) pairs, the field could be:
+        - XPath expression: text of the first found node
+        - tuple (XPath expression, processor)
+        - `Value` or `Group` object
+
+    If fields are given as the dict then `extract_tuple` returns values
+    in the order of sorted field names (see `names` attribute).
+    """
+
+    def __init__(self, fields):
+        if isinstance(fields, dict):
+            fields = sorted(fields.items())
+        self.fields = [(name, self.compile_field(spec))
+                       for name, spec in fields]
+        self.names = tuple(name for name, field in self.fields)
+
+        # Queries which are processed in one pass over the tree
+        # {scope: {tag: {attribute: {value: key}}}}
+        self.index = {}
+        for name, field in self.fields:
+            if field.index_key is not None:
+                scope, tag, attr, value = field.index_key
+                self.index.setdefault(scope, {}).setdefault(tag, {})\
+                          .setdefault(attr, {})[value] = field.index_key
+
+    def compile_field(self, spec):
+        if isinstance(spec, (Value, Group)):
+            return spec
+        elif isinstance(spec, basestring):
+            return Value(spec)
+        elif isinstance(spec, tuple):
+            return Value(*spec)
+        else:
+            raise TypeError('Invalid schema field: %r' % (spec,))
+
+    def extract(self, node):
+        """
+        Return dict with values of all fields.
+
+        The node could be lxml element or `Selector` object.
+        """
+
+        start = time.time()
+        result = self.extract_node(getattr(node, 'node', node), False)
+        GLOBAL_STATE['selector_time'] += time.time() - start
+        return result
+
+    def extract_tuple(self, node):
+        """
+        Return tuple with values of all fields.
+        """
+
+        start = time.time()
+        result = self.extract_node(getattr(node, 'node', node), True)
+        GLOBAL_STATE['selector_time'] += time.time() - start
+        return result
+
+    def extract_node(self, node, as_tuple):
+        if self.index:
+            found = self.find_indexed(node)
+        else:
+            found = None
+        if as_tuple:
+            return tuple(field.extract(node, name, True, found)
+                         for name, field in self.fields)
+        else:
+            return dict((name, field.extract(node, name, False, found))
+                        for name, field in self.fields)
+
+    def find_indexed(self, node):
+        """
+        Find nodes for all indexed queries in one pass over the tree.
+        """
+
+        found = {}
+        for scope, tags in self.index.iteritems():
+            if scope == 'doc':
+                elements = node.getroottree().iter(*tags.keys())
+            else:
+                elements = node.iterdescendants(*tags.keys())
+            for elem in elements:
+                for attr, values in tags[elem.tag].iteritems():
+                    key = values.get(elem.get(attr))
+                    if key is not None:
+                        found.setdefault(key, []).append(elem)
+        return found
+
+
+class Group(object):
+    """
+    Repeated group of fields.
+
+    Arguments:
+    * query - XPath expression which finds nodes of the group
+    * fields - fields of the group (see `Schema`), their queries
+        are evaluated relative to the node of the group
+
+    The value of the group is the list of dicts (or tuples).
+    """
+
+    def __init__(self, query, fields):
+        self.query = query
+        self.xpath = QUERY_REGISTRY.xpath(query)
+        self.index_key = parse_indexed_query(query)
+        self.schema = Schema(fields)
+
+    def extract(self, node, name, as_tuple, found):
+        if self.index_key is None:
+            nodes = self.xpath(node)
+        else:
+            nodes = found.get(self.index_key, [])
+        return [self.schema.extract_node(x, as_tuple) for x in nodes]
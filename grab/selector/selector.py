@@ -33,12 +33,14 @@ Example of usage::
 from __future__ import absolute_import
 import logging
 import time
-from lxml.etree import XPath
+import re
 try:
     from pyquery import PyQuery
 except ImportError:
     pass
 
+from lxml.etree import XPathSyntaxError
+
 from ..tools.lxml_tools import get_node_text, render_html
 from ..tools.text import find_number, normalize_space as normalize_space_func
 from ..error import GrabMisuseError, DataNotFound
@@ -46,32 +48,75 @@ from ..tools import rex as rex_tools
 from ..tools.text import normalize_space
 from ..tools.html import decode_entities
 from ..base import GLOBAL_STATE
+from .query import QUERY_REGISTRY
 
 __all__ = ['Selector', 'TextSelector']
 NULL = object()
 DEBUG_LOGGING = False
-XPATH_CACHE = {}
 logger = logging.getLogger('grab.selector.selector')
+# Location path which is evaluated relative to the context node
+RE_RELATIVE_XPATH = re.compile(r'^\s*(?:\.|@|[a-zA-Z_*])')
+# Parts of XPath query which could select the same node from different
+# context nodes: descendant and parent steps, other axes, union
+NOT_COMBINABLE_XPATH = ('//', '..', '::', '|')
+
+
+def wrap_node(node):
+    """
+    Return `Selector` or `TextSelector` object for the node.
+    """
+
+    if isinstance(node, basestring):
+        return TextSelector(node)
+    else:
+        return Selector(node)
 
 
 class SelectorList(object):
-    def __init__(self, items, query_type, query_exp):
-        self.items = items
+    """
+    List of nodes found by the query.
+
+    The nodes are wrapped into `Selector` objects only when they are
+    accessed, so methods like `one`, `exists` or `text` do not create
+    selectors for all found nodes.
+
+    Arguments:
+    * nodes - list of lxml elements or strings
+    * query_type - "xpath" or "pyquery"
+    * query_exp - the query
+    * context - the node on which the XPath query was evaluated, it
+        allows to run the chained `select` as one XPath query
+    """
+
+    def __init__(self, nodes, query_type, query_exp, context=None):
+        self.nodes = nodes
         self.query_type = query_type
         self.query_exp = query_exp
+        self.context = context
+
+    @property
+    def items(self):
+        return [wrap_node(x) for x in self.nodes]
 
     def __getitem__(self, x):
-        return self.items[x]
+        if isinstance(x, slice):
+            return [wrap_node(node) for node in self.nodes[x]]
+        else:
+            return wrap_node(self.nodes[x])
+
+    def __iter__(self):
+        for node in self.nodes:
+            yield wrap_node(node)
 
     def __len__(self):
         return self.count()
 
     def count(self):
-        return len(self.items)
+        return len(self.nodes)
 
     def one(self, default=NULL):
         try:
-            return self.items[0]
+            return wrap_node(self.nodes[0])
         except IndexError:
             if default is NULL:
                 raise DataNotFound('Could not get first item for %s: %s' % (
@@ -95,7 +140,7 @@ class SelectorList(object):
 
     def text_list(self, smart=False, normalize_space=True):
         result_list = []
-        for item in self.items:
+        for item in self:
             result_list.append(item.text())
         return result_list
 
@@ -121,7 +166,7 @@ class SelectorList(object):
         Return True if selctor list is not empty.
         """
 
-        return len(self.items) > 0
+        return len(self.nodes) > 0
 
     def attr(self, key, default=NULL):
         try:
@@ -136,7 +181,7 @@ class SelectorList(object):
 
     def attr_list(self, key, default=NULL):
         result_list = []
-        for item in self.items:
+        for item in self:
             result_list.append(item.attr(key, default=default))
         return result_list
 
@@ -152,32 +197,81 @@ class SelectorList(object):
             return self.one().rex(regexp, flags=flags, byte=byte)
 
     def node_list(self):
-        return [x.node for x in self.items]
-
-    def node(self):
-        return self.one().node
+        return list(self.nodes)
 
     def select(self, xpath=None, pyquery=None):
+        """
+        Run the query for each node of the list and return all found
+        nodes.
+
+        Relative XPath query which consists of child and attribute
+        steps like "./a" or "a/@href" is combined with the query of
+        the list into one XPath query, e.g. "(//div)/./a". The result
+        is the same as the result of separate queries, so queries are
+        not combined if one node of the list contains another one.
+        """
+
+        if xpath is not None:
+            query_type = 'xpath'
+            query_exp = xpath
+        else:
+            query_type = 'pyquery'
+            query_exp = pyquery
+        if not self.nodes:
+            return SelectorList([], query_type=query_type, query_exp=query_exp)
+        if (pyquery is None and self.is_combinable(xpath)):
+            try:
+                return self.select_combined(xpath)
+            except XPathSyntaxError:
+                pass
         result_list = None
-        for count, item in enumerate(self.items):
+        for count, item in enumerate(self):
             item_result_list = item.select(xpath=xpath, pyquery=pyquery)
             if count == 0:
                 result_list = item_result_list
+                result_list.context = None
             else:
-                result_list.items.extend(item_result_list.items)
-        if result_list is None:
-            # TODO: refactor
-            if xpath is not None:
-                query_type = 'xpath'
-                query_exp = xpath
-            else:
-                query_type = 'pyquery'
-                query_exp = pyquery
-            return SelectorList([], query_type=query_type, query_exp=query_exp)
+                result_list.nodes.extend(item_result_list.nodes)
         return result_list
 
+    def is_combinable(self, xpath):
+        if (self.query_type != 'xpath' or self.context is None
+                or xpath is None or isinstance(self.nodes[0], basestring)
+                or RE_RELATIVE_XPATH.match(xpath) is None):
+            return False
+        for part in NOT_COMBINABLE_XPATH:
+            if part in xpath:
+                return False
+        return not self.has_nested_nodes()
+
+    def has_nested_nodes(self):
+        """
+        Return True if some node of the list is the descendant
+        of another node of the list.
+        """
+
+        nodes = set(self.nodes)
+        # Only elements with tags of the list nodes are checked
+        tags = set(x.tag for x in self.nodes if isinstance(x.tag, basestring))
+        for node in self.nodes:
+            for parent in node.iterancestors(*tags):
+                if parent in nodes:
+                    return True
+        return False
+
+    def select_combined(self, xpath):
+        start = time.time()
+        query_exp = '(%s)/%s' % (self.query_exp, xpath.strip())
+        xpath_obj = QUERY_REGISTRY.xpath(query_exp)
+        val = SelectorList(xpath_obj(self.context), 'xpath', query_exp,
+                           context=self.context)
+        GLOBAL_STATE['selector_time'] += time.time() - start
+        return val
+
 
 class Selector(object):
+    __slots__ = ('node',)
+
     def __init__(self, node):
         self.node = node
 
@@ -194,12 +288,10 @@ class Selector(object):
             raise Exception('Both xpath and pyquery option are not None')
 
         if xpath is not None:
-            if not xpath in XPATH_CACHE:
-                obj = XPath(xpath)
-                XPATH_CACHE[xpath] = obj
-            xpath_obj = XPATH_CACHE[xpath]
+            xpath_obj = QUERY_REGISTRY.xpath(xpath)
 
-            val = self.wrap_list(xpath_obj(self.node), 'xpath', xpath)
+            val = SelectorList(xpath_obj(self.node), 'xpath', xpath,
+                               context=self.node)
             query_exp = xpath
         else:
             val = self.wrap_list(self.pyquery_node().find(pyquery), 'pyquery', pyquery)
@@ -213,13 +305,8 @@ class Selector(object):
         return val
 
     def wrap_list(self, items, query_type, query_exp):
-        selectors = []
-        for x in items:
-            if isinstance(x, basestring):
-                selectors.append(TextSelector(x))
-            else:
-                selectors.append(Selector(x))
-        return SelectorList(selectors, query_type=query_type, query_exp=query_exp)
+        return SelectorList(list(items), query_type=query_type,
+                            query_exp=query_exp)
 
     def html(self, encoding='unicode'):
         return render_html(self.node, encoding=encoding)
@@ -276,6 +363,8 @@ class RexResultList(object):
 
 
 class TextSelector(Selector):
+    __slots__ = ()
+
     def select(self, xpath=None):
         raise GrabMisuseError('TextSelector does not allow select method') 
 
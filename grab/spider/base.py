@@ -8,7 +8,7 @@ import signal
 import inspect
 import traceback
 import logging
-from collections import defaultdict
+from collections import defaultdict, deque
 import os
 import time
 import json
@@ -16,6 +16,7 @@ import cPickle as pickle
 import anydbm
 import multiprocessing
 import zlib
+import re
 from hashlib import sha1
 from urlparse import urljoin
 from random import randint
@@ -28,12 +29,17 @@ from .task import Task, NullTask
 from .data import Data
 from .pattern import SpiderPattern
 from .stat  import SpiderStat
+from .cache_writer import CacheWriter
+from .replay import replay_cache
+from grab.tools.warc import WarcWriter, WARC_MAX_SIZE
 from .transport.multicurl import MulticurlTransport
 from ..proxylist import ProxyList
 
 DEFAULT_TASK_PRIORITY = 100
 RANDOM_TASK_PRIORITY_RANGE = (50, 100)
 TASK_QUEUE_TIMEOUT = 0.01
+# Number of responses saved into the cache between evictions
+CACHE_EVICT_INTERVAL = 10000
 NULL = object()
 
 logger = logging.getLogger('grab.spider.base')
@@ -136,6 +142,18 @@ class Spider(SpiderPattern, SpiderStat):
         # Initial cache-subsystem values
         self.cache_enabled = False
         self.cache = None
+        self.cache_ttl = None
+        self.cache_task_ttl = {}
+        self.cache_url_ttl = []
+        self.cache_max_size = None
+        self.cache_evict_interval = CACHE_EVICT_INTERVAL
+        self.cache_save_count = 0
+        self.cache_async_write = False
+        self.cache_writer = None
+        self.cache_prefetch = None
+        self.cache_prefetch_buffer = deque()
+        self.cache_prefetched = {}
+        self.warc_writer = None
 
         self.work_allowed = True
         if request_pause is not NULL:
@@ -156,14 +174,73 @@ class Spider(SpiderPattern, SpiderStat):
             if hasattr(mid, 'process_response'):
                 self.middleware_points['response'].append(mid)
 
-    def setup_cache(self, backend='mongo', database=None, use_compression=True, **kwargs):
+    def setup_cache(self, backend='mongo', database=None, use_compression=True,
+                    ttl=None, task_ttl=None, url_ttl=None, max_size=None,
+                    evict_interval=CACHE_EVICT_INTERVAL, async_write=False,
+                    prefetch=None, **kwargs):
+        """
+        Arguments:
+        * use_compression - compress bodies with zlib, if the value is
+            "dict" then bodies are compressed with dictionaries trained
+            for each host
+        * ttl - max. age of cache item in seconds, older items are
+            ignored and the document is fetched again. None means
+            that cache items never expire.
+        * task_ttl - dict which maps task name to TTL of its documents
+        * url_ttl - list of (regexp, ttl) pairs, TTL of the first
+            regexp which matches the task URL is used
+        * max_size - max. total size of cache in bytes, oldest items
+            are removed from the cache after each `evict_interval` saved
+            responses and after the spider has done its work
+        * evict_interval - number of responses saved into the cache
+            between evictions
+        * async_write - compress and save responses into the cache
+            in separate thread
+        * prefetch - number of tasks which are taken from the task queue
+            at once and looked up in the cache with one query
+        """
+
         if database is None:
             raise SpiderMisuseError('setup_cache method requires database option')
         self.cache_enabled = True
-        mod = __import__('grab.spider.cache_backend.%s' % backend,
+        self.cache_ttl = ttl
+        self.cache_task_ttl = task_ttl or {}
+        self.cache_url_ttl = [(re.compile(x), y) for x, y in (url_ttl or [])]
+        self.cache_max_size = max_size
+        self.cache_evict_interval = evict_interval
+        self.cache_async_write = async_write
+        self.cache_prefetch = prefetch
+        self.cache_backend_config = dict(kwargs, backend=backend,
+                                         database=database,
+                                         use_compression=use_compression)
+        self.cache = self.create_cache_backend()
+
+    def create_cache_backend(self):
+        """
+        Create new instance of the cache backend configured
+        with `setup_cache` method.
+        """
+
+        kwargs = dict(self.cache_backend_config)
+        mod = __import__('grab.spider.cache_backend.%s' % kwargs.pop('backend'),
                          globals(), locals(), ['foo'])
-        self.cache = mod.CacheBackend(database=database, use_compression=use_compression,
-                                      spider=self, **kwargs)
+        return mod.CacheBackend(spider=self, **kwargs)
+
+    def setup_warc(self, path, prefix='grab', max_size=WARC_MAX_SIZE):
+        """
+        Save all network requests and responses into WARC files.
+
+        Arguments:
+        * path - directory where WARC files are saved
+        * prefix - prefix of names of WARC files
+        * max_size - new file is started when the size of current file
+            exceeds this number of bytes
+
+        Saved files could be used as read-only cache with
+        `setup_cache(backend='warc', database=path)`.
+        """
+
+        self.warc_writer = WarcWriter(path, prefix=prefix, max_size=max_size)
 
     def setup_queue(self, backend='memory', **kwargs):
         logger.debug('Using %s backend for task queue' % backend)
@@ -360,6 +437,55 @@ class Spider(SpiderPattern, SpiderStat):
         self.process_task_generator()
 
     def load_new_task(self):
+        if self.cache_prefetch_buffer:
+            return self.cache_prefetch_buffer.popleft()
+        task = self.load_task_from_queue()
+        if task is not None and self.cache_enabled and self.cache_prefetch:
+            task = self.prefetch_cache_items(task)
+        return task
+
+    def is_task_prefetchable(self, task):
+        if (isinstance(task, NullTask)
+            or task.get('refresh_cache', False)
+            or task.get('disable_cache', False)):
+            return False
+        if task.grab_config and (task.grab_config['post'] or
+                                 task.grab_config['multipart_post']):
+            return False
+        return True
+
+    def prefetch_cache_items(self, task):
+        """
+        Take next tasks from the task queue and look up
+        all of them in the cache with one query.
+
+        Returns the `task`, other tasks are placed into the prefetch buffer
+        and are returned by next calls of `load_new_task`.
+        """
+
+        tasks = [task]
+        while len(tasks) < self.cache_prefetch:
+            try:
+                tasks.append(self.taskq.get(0))
+            except Queue.Empty:
+                break
+
+        # All tasks from previous prefetch call are already processed
+        self.cache_prefetched = {}
+        urls = [x.url for x in tasks if self.is_task_prefetchable(x)]
+        if urls:
+            with self.save_timer('cache'):
+                with self.save_timer('cache.prefetch'):
+                    items = self.cache.get_items(urls)
+            for url in urls:
+                self.cache_prefetched[url] = items.get(url)
+            self.inc_count('cache-prefetch')
+            self.inc_count('cache-prefetch-hit', count=len(items))
+
+        self.cache_prefetch_buffer.extend(tasks[1:])
+        return task
+
+    def load_task_from_queue(self):
         start = time.time()
         while True:
             try:
@@ -419,10 +545,55 @@ class Spider(SpiderPattern, SpiderStat):
         else:
             return True
 
+    def get_cache_ttl(self, task):
+        """
+        Find TTL of cache item for the given task.
+
+        Check in following order:
+        * `cache_ttl` attribute of the task
+        * TTL configured for the task name
+        * TTL of the first URL pattern which matches the task URL
+        * default TTL
+
+        Return None if cache item never expires.
+        """
+
+        ttl = task.get('cache_ttl')
+        if ttl is not None:
+            return ttl
+        if task.name in self.cache_task_ttl:
+            return self.cache_task_ttl[task.name]
+        for rex, ttl in self.cache_url_ttl:
+            if rex.search(task.url):
+                return ttl
+        return self.cache_ttl
+
+    def is_cache_item_expired(self, task, cache_item):
+        ttl = self.get_cache_ttl(task)
+        if ttl is None:
+            return False
+        # Items saved by old versions of grab do not have timestamp
+        timestamp = cache_item.get('timestamp')
+        if timestamp is None:
+            return True
+        return time.time() - timestamp > ttl
+
     def load_task_from_cache(self, transport, task, grab, grab_config_backup):
-        cache_item = self.cache.get_item(grab.config['url'])
+        url = grab.config['url']
+        # Missing items are also saved in the prefetch dict
+        # so there is no need to query the cache again
+        if url in self.cache_prefetched:
+            cache_item = self.cache_prefetched.pop(url)
+        else:
+            cache_item = self.cache.get_item(url)
         if cache_item is None:
             return None
+        # In `only_cache` mode there is no way to refresh expired item
+        # so any cached data is better than nothing
+        elif (not self.only_cache and
+              self.is_cache_item_expired(task, cache_item)):
+            self.inc_count('request-cache-expired')
+            return None
         else:
             with self.save_timer('cache.read.repair_grab'):
                 transport.repair_grab(grab)
@@ -685,6 +856,35 @@ class Spider(SpiderPattern, SpiderStat):
                             return True
         return False
 
+    def save_response_to_cache(self, url, grab):
+        if self.cache_writer is not None:
+            self.cache_writer.put(self.cache.build_item(url, grab))
+        else:
+            self.cache.save_response(url, grab)
+            if self.cache_max_size is not None:
+                self.cache_save_count += 1
+                if self.cache_save_count % self.cache_evict_interval == 0:
+                    self.evict_cache()
+
+    def start_cache_writer(self):
+        # Writer thread removes old items itself, so the eviction
+        # does not block the spider
+        self.cache_writer = CacheWriter(self.cache,
+                                        max_size=self.cache_max_size,
+                                        evict_interval=self.cache_evict_interval)
+        self.cache_writer.start()
+
+    def stop_cache_writer(self):
+        """
+        Wait until all queued responses are saved into the cache.
+        """
+
+        with self.save_timer('cache.write_flush'):
+            self.cache_writer.stop()
+        self.inc_count('cache-write-error', count=self.cache_writer.error_count)
+        self.inc_count('cache-evicted', count=self.cache_writer.evicted_count)
+        self.cache_writer = None
+
     def stop(self):
         """
         This method set internal flag which signal spider
@@ -706,6 +906,9 @@ class Spider(SpiderPattern, SpiderStat):
             self.setup_default_queue()
             self.prepare()
 
+            if self.cache_enabled and self.cache_async_write:
+                self.start_cache_writer()
+
             self.start_timer('task_generator')
             if not self.slave:
                 self.init_task_generators()
@@ -761,6 +964,13 @@ class Spider(SpiderPattern, SpiderStat):
                         else:
                             self.process_new_task(task)
 
+                        if (self.cache_prefetch_buffer and
+                            self.transport.ready_for_task()):
+                            # Do not wait for network activity while there
+                            # are prefetched tasks which could be processed
+                            # immediately
+                            continue
+
                 with self.save_timer('network_transport'):
                     logger_verbose.debug('Asking transport layer to do something')
                     # Process active handlers
@@ -775,7 +985,17 @@ class Spider(SpiderPattern, SpiderStat):
                     if self.is_valid_for_cache(result):
                         with self.save_timer('cache'):
                             with self.save_timer('cache.write'):
-                                self.cache.save_response(result['task'].url, result['grab'])
+                                self.save_response_to_cache(result['task'].url,
+                                                            result['grab'])
+                    if self.warc_writer is not None and result['ok']:
+                        with self.save_timer('warc'):
+                            try:
+                                self.warc_writer.write_response(
+                                    result['task'].url, result['grab'])
+                            except Exception, ex:
+                                logger.error('Could not write WARC record',
+                                             exc_info=ex)
+                                self.inc_count('warc-error')
                     self.process_network_result(result)
                     self.inc_count('request')
 
@@ -786,8 +1006,40 @@ class Spider(SpiderPattern, SpiderStat):
         finally:
             # This code is executed when main cycles is breaked
             self.stop_timer('total')
+            if self.cache_writer is not None:
+                self.stop_cache_writer()
+            if self.cache_enabled and self.cache_max_size is not None:
+                self.evict_cache()
+            if self.cache_enabled and hasattr(self.cache, 'flush'):
+                self.cache.flush()
+            if self.warc_writer is not None:
+                self.warc_writer.close()
             self.shutdown()
 
+    def run_replay(self, process_number=None):
+        """
+        Process tasks with documents from the cache in multiple processes.
+
+        Arguments:
+        * process_number - number of worker processes, by default
+            the number of CPUs is used
+
+        See `grab.spider.replay` module for details.
+        """
+
+        replay_cache(self, process_number=process_number)
+
+    def evict_cache(self):
+        """
+        Remove oldest items from the cache to fit it into `max_size`
+        option of `setup_cache` method.
+        """
+
+        with self.save_timer('cache.evict'):
+            count = self.cache.evict(self.cache_max_size)
+        self.inc_count('cache-evicted', count=count)
+        logger.debug('Removed %d items from the cache' % count)
+
     def load_proxylist(self, source, source_type, proxy_type='http',
                        auto_init=True, auto_change=True,
                        **kwargs):
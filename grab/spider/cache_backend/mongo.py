@@ -7,6 +7,36 @@ CacheItem interface:
 'head': string,
 'response_code': int,
 'cookies': None,#grab.response.cookies,
+'timestamp': int, # time when the document was fetched
+'size': int, # number of bytes the item takes in the storage
+
+The body is not stored in the cache item. Identical bodies are saved only
+once into `cache_body` collection and cache items refer to them with
+`body_hash` key:
+
+'_id': string, # sha1 hash of the body
+'body': string,
+'refs': int, # number of cache items which refer to the body
+'size': int, # size of the body in the storage
+'dict_id': string, # id of compression dictionary or None
+'chunks': int, # number of chunks if the body is stored in chunks
+
+Bodies larger than `CHUNK_SIZE` are split into chunks which are stored
+in `cache_chunk` collection, so the size of the body is not limited
+by max. size of mongo document:
+
+'_id': string, # body hash and number of the chunk
+'body_hash': string,
+'n': int, # number of the chunk
+'data': string,
+
+If `use_compression` is "dict" then bodies are compressed with
+dictionaries trained for each host (see `grab.spider.cache_compression`).
+Dictionaries are stored in `cache_dict` collection:
+
+'_id': string, # sha1 hash of the dictionary
+'host': string,
+'data': string,
 
 TODO: WTF with cookies???
 """
@@ -14,6 +44,7 @@ from __future__ import absolute_import
 from hashlib import sha1
 import zlib
 import logging
+import time
 import pymongo
 try:
     from bson import Binary
@@ -21,8 +52,11 @@ except ImportError:
     from pymongo.binary import Binary
 
 from grab.response import Response
+from grab.spider.cache_compression import DictionaryCompressor
 
 logger = logging.getLogger('grab.spider.cache_backend.mongo')
+# Max. size of body stored in one document
+CHUNK_SIZE = 1024 * 1024
 
 
 class CacheBackend(object):
@@ -30,6 +64,10 @@ class CacheBackend(object):
         self.spider = spider
         self.db = pymongo.Connection()[database]
         self.use_compression = use_compression
+        self.db.cache.ensure_index('timestamp')
+        self.db.cache_dict.ensure_index('host')
+        self.db.cache_chunk.ensure_index('body_hash')
+        self.compressor = DictionaryCompressor(self)
 
     def get_item(self, url):
         """
@@ -37,7 +75,59 @@ class CacheBackend(object):
         """
 
         _hash = self.build_hash(url)
-        return self.db.cache.find_one({'_id': _hash})
+        item = self.db.cache.find_one({'_id': _hash})
+        if item is None:
+            return None
+        return self.attach_bodies([item]).get(item['_id'])
+
+    def get_items(self, urls):
+        """
+        Load multiple items with one query.
+
+        Returns dict which maps URL to the item. URLs which are not found
+        in the cache are not in the dict.
+        """
+
+        hashes = dict((self.build_hash(x), x) for x in urls)
+        docs = list(self.db.cache.find({'_id': {'$in': hashes.keys()}}))
+        items = {}
+        for _id, item in self.attach_bodies(docs).items():
+            items[hashes[_id]] = item
+        return items
+
+    def attach_bodies(self, items):
+        """
+        Load bodies of cache items from `cache_body` collection.
+
+        Returns dict which maps `_id` to the item. Items which body
+        could not be found are not in the dict.
+        """
+
+        body_hashes = list(set(x['body_hash'] for x in items
+                               if 'body_hash' in x))
+        bodies = {}
+        if body_hashes:
+            query = {'_id': {'$in': body_hashes}}
+            fields = {'body': 1, 'dict_id': 1, 'chunks': 1}
+            for doc in self.db.cache_body.find(query, fields):
+                bodies[doc['_id']] = doc
+        result = {}
+        for item in items:
+            # Items saved in old data format contain the body
+            if 'body_hash' in item:
+                try:
+                    body_doc = bodies[item['body_hash']]
+                    # Chunked body is loaded in `load_response` method
+                    item['body'] = body_doc.get('body')
+                    item['dict_id'] = body_doc.get('dict_id')
+                    if body_doc.get('chunks'):
+                        item['chunks'] = body_doc['chunks']
+                except KeyError:
+                    logger.error('Body of cache item not found. Url: %s'\
+                                 % item['url'])
+                    continue
+            result[item['_id']] = item
+        return result
 
     def build_hash(self, url):
         if isinstance(url, unicode):
@@ -46,16 +136,59 @@ class CacheBackend(object):
             utf_url = url
         return sha1(utf_url).hexdigest()
 
+    def build_body_hash(self, body):
+        return sha1(body).hexdigest()
+
     def remove_cache_item(self, url):
         _hash = self.build_hash(url)
-        self.db.cache.remove({'_id': _hash})
+        item = self.db.cache.find_one({'_id': _hash}, {'body_hash': 1})
+        if item is not None:
+            self.db.cache.remove({'_id': _hash})
+            if 'body_hash' in item:
+                self.release_bodies([item['body_hash']])
 
-    def load_response(self, grab, cache_item):
-        grab.fake_response(cache_item['body'])
+    def read_chunked_body(self, cache_item):
+        """
+        Load chunks of the body one by one and decompress them
+        as they arrive.
+        """
+
+        if cache_item.get('dict_id') is not None:
+            decompressor = self.compressor.decompressobj(cache_item['dict_id'])
+        elif self.use_compression:
+            decompressor = zlib.decompressobj()
+        else:
+            decompressor = None
+        parts = []
+        query = {'body_hash': cache_item['body_hash'],
+                 'n': {'$lt': cache_item['chunks']}}
+        for chunk in self.db.cache_chunk.find(query).sort('n'):
+            if decompressor is None:
+                parts.append(chunk['data'])
+            else:
+                parts.append(decompressor.decompress(chunk['data']))
+        if decompressor is not None:
+            parts.append(decompressor.flush())
+        return ''.join(parts)
+
+    def read_body(self, cache_item):
+        """
+        Return uncompressed body of the cache item.
+        """
 
+        if cache_item.get('chunks'):
+            return self.read_chunked_body(cache_item)
         body = cache_item['body']
-        if self.use_compression:
-            body = zlib.decompress(body)
+        if cache_item.get('dict_id') is not None:
+            return self.compressor.decompress(cache_item['dict_id'], body)
+        elif self.use_compression:
+            return zlib.decompress(body)
+        else:
+            return body
+
+    def load_response(self, grab, cache_item):
+        body = self.read_body(cache_item)
+        grab.fake_response(body)
 
         def custom_prepare_response_func(transport, g):
             response = Response()
@@ -77,26 +210,276 @@ class CacheBackend(object):
 
         grab.process_request_result(custom_prepare_response_func)
 
-    def save_response(self, url, grab):
-        body = grab.response.body
-        if self.use_compression:
-            body = zlib.compress(body)
+    def iter_batches(self, start_key=None, batch_size=1000):
+        """
+        Iterate over all items of the cache in the order of their ids.
 
-        _hash = self.build_hash(url)
-        item = {
-            '_id': _hash,
+        Yields (key, items) pairs, `key` could be passed as `start_key`
+        argument to continue iteration after the last item of the batch.
+        Bodies of items are uncompressed.
+        """
+
+        while True:
+            query = {} if start_key is None else {'_id': {'$gt': start_key}}
+            docs = list(self.db.cache.find(query).sort('_id', pymongo.ASCENDING)
+                                                 .limit(batch_size))
+            if not docs:
+                break
+            items = []
+            for doc in self.attach_bodies(docs).values():
+                item = dict((x, doc.get(x)) for x in ('url', 'response_url',
+                            'head', 'response_code', 'cookies', 'timestamp'))
+                item['head'] = str(item['head'])
+                item['body'] = self.read_body(doc)
+                items.append(item)
+            start_key = docs[-1]['_id']
+            yield start_key, items
+
+    def count_items(self):
+        return self.db.cache.count()
+
+    def build_item(self, url, grab):
+        """
+        Build cache item from the response of `grab` instance.
+
+        The item is not compressed yet. It is done in `save_items` method
+        which could be called from separate thread.
+        """
+
+        return {
             'url': url,
             'response_url': grab.response.url,
-            'body': Binary(body),
-            'head': Binary(grab.response.head),
+            'body': grab.response.body,
+            'head': grab.response.head,
             'response_code': grab.response.code,
             'cookies': None,
+            'timestamp': int(time.time()),
         }
-        try:
-            self.db.cache.save(item, safe=True)
-        except Exception, ex:
-            if 'document too large' in unicode(ex):
-                logging.error('Document too large. It was not saved into mongo '\
-                              'cache. Url: %s' % url)
+
+    def pack_item(self, item):
+        """
+        Convert cache item into a pair of mongo documents: the cache item
+        and its body.
+        """
+
+        body = item['body']
+        body_hash = self.build_body_hash(body)
+        dict_id = None
+        if self.use_compression == 'dict':
+            dict_id, body = self.compressor.compress(item['url'], body)
+        elif self.use_compression:
+            body = zlib.compress(body)
+        doc = item.copy()
+        del doc['body']
+        doc.update({
+            '_id': self.build_hash(item['url']),
+            'head': Binary(item['head']),
+            'body_hash': body_hash,
+            'body_size': len(body),
+            'size': len(item['head']),
+        })
+        body_doc = {
+            '_id': body_hash,
+            'body': Binary(body),
+            'size': len(body),
+            'dict_id': dict_id,
+        }
+        return doc, body_doc
+
+    def save_response(self, url, grab):
+        self.save_items([self.build_item(url, grab)])
+
+    def save_items(self, items):
+        """
+        Save multiple cache items with bulk requests.
+
+        Body which is already in the cache is not saved again, only
+        its reference counter is incremented.
+        """
+
+        # Reserve some space for keys and other fields of the document
+        max_size = self.db.connection.max_bson_size - 4096
+        docs = []
+        body_docs = {}
+        for item in items:
+            doc, body_doc = self.pack_item(item)
+            # Large body is stored in chunks so only the size of
+            # headers is limited
+            if doc['size'] + len(doc['url']) > max_size:
+                logger.error('Document too large. It was not saved into mongo '\
+                             'cache. Url: %s' % item['url'])
+            else:
+                docs.append(doc)
+                body_docs[body_doc['_id']] = body_doc
+        if not docs:
+            return
+
+        # Find bodies which are referenced by the items being replaced
+        query = {'_id': {'$in': [x['_id'] for x in docs]}}
+        old_hashes = {}
+        for item in self.db.cache.find(query, {'body_hash': 1}):
+            old_hashes[item['_id']] = item.get('body_hash')
+        new_refs = {}
+        released = []
+        for doc in docs:
+            old_hash = old_hashes.get(doc['_id'])
+            if old_hash != doc['body_hash']:
+                new_refs[doc['body_hash']] = new_refs.get(doc['body_hash'], 0) + 1
+                if old_hash is not None:
+                    released.append(old_hash)
+            old_hashes[doc['_id']] = doc['body_hash']
+
+        # Bodies are saved before the items which refer to them
+        for body_hash, refs in new_refs.items():
+            body_doc = body_docs[body_hash]
+            fields = {'size': body_doc['size'], 'dict_id': body_doc['dict_id']}
+            if body_doc['size'] > CHUNK_SIZE:
+                fields['chunks'] = self.save_chunks(body_hash, body_doc['body'])
+                fields['body'] = None
             else:
-                raise
+                fields['chunks'] = 0
+                fields['body'] = body_doc['body']
+            self.db.cache_body.update(
+                {'_id': body_hash},
+                {'$inc': {'refs': refs}, '$set': fields},
+                upsert=True)
+        # Bulk API is available since pymongo 2.7
+        if hasattr(self.db.cache, 'initialize_unordered_bulk_op'):
+            bulk = self.db.cache.initialize_unordered_bulk_op()
+            for doc in docs:
+                bulk.find({'_id': doc['_id']}).upsert().replace_one(doc)
+            bulk.execute()
+        else:
+            for doc in docs:
+                self.db.cache.save(doc, safe=True)
+        if released:
+            self.release_bodies(released)
+
+    def save_chunks(self, body_hash, body):
+        """
+        Split the body into chunks and save them.
+
+        Returns number of chunks.
+        """
+
+        count = 0
+        for pos in xrange(0, len(body), CHUNK_SIZE):
+            self.db.cache_chunk.save({
+                '_id': '%s:%d' % (body_hash, count),
+                'body_hash': body_hash,
+                'n': count,
+                'data': Binary(body[pos:pos + CHUNK_SIZE]),
+            })
+            count += 1
+        return count
+
+    def release_bodies(self, body_hashes):
+        """
+        Decrement reference counters of bodies and remove bodies
+        which are not referenced anymore.
+
+        :param body_hashes: list of body hashes, the hash is repeated
+            as many times as many references should be released
+        """
+
+        counts = {}
+        for body_hash in body_hashes:
+            counts[body_hash] = counts.get(body_hash, 0) + 1
+        for body_hash, count in counts.items():
+            self.db.cache_body.update({'_id': body_hash},
+                                      {'$inc': {'refs': -count}})
+        unique_hashes = counts.keys()
+        for pos in xrange(0, len(unique_hashes), 1000):
+            query = {
+                '_id': {'$in': unique_hashes[pos:pos + 1000]},
+                'refs': {'$lte': 0},
+            }
+            chunked = [x['_id'] for x in self.db.cache_body.find(query,
+                                                                 {'chunks': 1})
+                       if x.get('chunks')]
+            self.db.cache_body.remove(query)
+            if chunked:
+                self.db.cache_chunk.remove({'body_hash': {'$in': chunked}})
+
+    def load_dictionary(self, dict_id):
+        doc = self.db.cache_dict.find_one({'_id': dict_id})
+        return None if doc is None else str(doc['data'])
+
+    def find_dictionary(self, host):
+        doc = self.db.cache_dict.find_one({'host': host})
+        return None if doc is None else (doc['_id'], str(doc['data']))
+
+    def save_dictionary(self, dict_id, host, data):
+        self.db.cache_dict.save({'_id': dict_id, 'host': host,
+                                 'data': Binary(data)})
+
+    def get_dedup_stats(self):
+        """
+        Calculate how much space is saved by storing identical bodies once.
+        The whole cache is scanned, so the method is slow on large caches.
+
+        Returns dict with keys:
+        * items - number of cache items
+        * bodies - number of stored bodies
+        * size - total size of bodies of all cache items
+        * stored_size - total size of stored bodies
+        * ratio - size / stored_size
+        """
+
+        size = 0
+        stored_size = 0
+        items = 0
+        for item in self.db.cache.find({}, {'body_size': 1, 'size': 1}):
+            items += 1
+            if 'body_size' in item:
+                size += item['body_size']
+            else:
+                # Old data format, the body is stored in the item
+                size += item.get('size', 0)
+                stored_size += item.get('size', 0)
+        bodies = 0
+        for doc in self.db.cache_body.find({}, {'size': 1}):
+            bodies += 1
+            stored_size += doc['size']
+        return {
+            'items': items,
+            'bodies': bodies,
+            'size': size,
+            'stored_size': stored_size,
+            'ratio': float(size) / stored_size if stored_size else 1.0,
+        }
+
+    def evict(self, max_size):
+        """
+        Remove oldest items until total size of cache fits into
+        `max_size` bytes.
+
+        Size of the body shared by multiple items is counted once.
+
+        Returns number of removed items.
+        """
+
+        total_size = 0
+        remove_ids = []
+        released = []
+        seen_bodies = set()
+        cursor = self.db.cache.find({}, {'size': 1, 'body_hash': 1,
+                                         'body_size': 1})\
+                              .sort('timestamp', pymongo.DESCENDING)
+        for item in cursor:
+            # Items saved in old data format do not have `size` key
+            # and they are always removed
+            total_size += item.get('size', max_size + 1)
+            body_hash = item.get('body_hash')
+            if body_hash is not None and not body_hash in seen_bodies:
+                seen_bodies.add(body_hash)
+                total_size += item['body_size']
+            if total_size > max_size:
+                remove_ids.append(item['_id'])
+                if body_hash is not None:
+                    released.append(body_hash)
+        for pos in xrange(0, len(remove_ids), 1000):
+            self.db.cache.remove({'_id': {'$in': remove_ids[pos:pos + 1000]}})
+        if released:
+            self.release_bodies(released)
+        return len(remove_ids)
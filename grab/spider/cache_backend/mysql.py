@@ -7,6 +7,22 @@ CacheItem interface:
 'head': string,
 'response_code': int,
 'cookies': None,#grab.response.cookies,
+'timestamp': int, # time when the document was fetched
+
+Fields `url`, `response_url`, `response_code`, `head` and `timestamp` are
+stored in separate columns of `cache` table so the item could be built
+without unpacking. Items saved by previous versions of grab are stored
+as compressed marshal dump in `data` column.
+
+The body is not stored in the cache item. Identical bodies are saved only
+once into `cache_body` table and cache items refer to them with `body_id`
+column. The `refs` column of `cache_body` table contains number of
+cache items which refer to the body.
+
+If `use_compression` is "dict" then bodies are compressed with
+dictionaries trained for each host (see `grab.spider.cache_compression`).
+Dictionaries are stored in `cache_dict` table, the `dict_id` column of
+`cache_body` table refers to the dictionary.
 
 TODO: WTF with cookies???
 """
@@ -14,81 +30,375 @@ from __future__ import absolute_import
 from hashlib import sha1
 import zlib
 import logging
+import time
+import sys
+import threading
 import MySQLdb
 import marshal
+import Queue
+from contextlib import contextmanager
 
 from grab.response import Response
+from grab.spider.cache_compression import DictionaryCompressor
 
 logger = logging.getLogger('grab.spider.cache_backend.mysql')
+# Max. size of data sent in one multi-row insert query
+# It should be less than `max_allowed_packet` setting of MySQL server
+MAX_INSERT_SIZE = 1024 * 1024 * 4
+# Max. number of database connections
+POOL_SIZE = 4
+# Columns of cache table which are loaded to build the cache item
+ITEM_COLUMNS = '''
+    cache.data, cache.url, cache.response_url, cache.response_code,
+    cache.head, cache.timestamp, cache.body_id, cache_body.data,
+    hex(cache_body.dict_id)
+'''
+
+
+class ConnectionPool(object):
+    """
+    Pool of database connections.
+
+    MySQLdb connection could not be shared between threads so each
+    thread which works with the cache (the spider and the cache writer)
+    takes the connection from the pool. New connections are created
+    on demand, if there are `size` connections in use then the thread
+    waits for a free one.
+    """
+
+    def __init__(self, connect, size=POOL_SIZE):
+        self.connect = connect
+        self.size = size
+        self.created = 0
+        self.free = Queue.Queue()
+        self.lock = threading.Lock()
+
+    def get_connection(self):
+        while True:
+            try:
+                return self.free.get(False)
+            except Queue.Empty:
+                pass
+            with self.lock:
+                create = self.created < self.size
+                if create:
+                    self.created += 1
+            if create:
+                try:
+                    return self.connect()
+                except Exception:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+            try:
+                return self.free.get(timeout=1)
+            except Queue.Empty:
+                # Discarded connection is not returned to the pool,
+                # new connection could be created instead of it
+                pass
+
+    def discard(self, conn):
+        """
+        Close the connection which is not returned to the pool.
+        """
+
+        with self.lock:
+            self.created -= 1
+        try:
+            conn.close()
+        except Exception, ex:
+            logger.error('Could not close database connection', exc_info=ex)
+
+    @contextmanager
+    def cursor(self):
+        conn = self.get_connection()
+        try:
+            yield conn.cursor()
+        except Exception:
+            exc_info = sys.exc_info()
+            # Do not return connection with broken transaction to the pool
+            try:
+                conn.rollback()
+            except Exception, ex:
+                logger.error('Could not rollback transaction', exc_info=ex)
+                self.discard(conn)
+            else:
+                self.free.put(conn)
+            # Error of rollback should not hide the original error
+            raise exc_info[0], exc_info[1], exc_info[2]
+        else:
+            self.free.put(conn)
 
 
 class CacheBackend(object):
     def __init__(self, database, use_compression=True,
-                 mysql_engine='innodb', spider=None, **kwargs):
+                 mysql_engine='innodb', spider=None, pool_size=POOL_SIZE,
+                 **kwargs):
         self.spider = spider
-        self.conn = MySQLdb.connect(**kwargs)
+        self.database = database
+        self.connection_kwargs = kwargs
         self.mysql_engine = mysql_engine
-        self.conn.select_db(database)
-        self.cursor = self.conn.cursor()
-        self.cursor.execute('SET TRANSACTION ISOLATION LEVEL READ COMMITTED')
-        res = self.cursor.execute('show tables')
-        found = False
-        for row in self.cursor:
-            if row[0] == 'cache':
-                found = True
-                break
-        if not found:
-            self.create_cache_table(self.mysql_engine)
+        self.use_compression = use_compression
+        self.compressor = DictionaryCompressor(self)
+        self.pool = ConnectionPool(self.connect, pool_size)
+        with self.pool.cursor() as cursor:
+            cursor.execute('show tables')
+            if not 'cache' in [x[0] for x in cursor]:
+                self.create_cache_table(cursor, self.mysql_engine)
+            else:
+                self.upgrade_cache_table(cursor)
+
+    def connect(self):
+        conn = MySQLdb.connect(**self.connection_kwargs)
+        conn.select_db(self.database)
+        # Read queries consist of one select statement and do not need
+        # explicit transaction. Write queries start transaction with
+        # `begin` statement.
+        conn.autocommit(True)
+        cursor = conn.cursor()
+        cursor.execute('SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED')
+        return conn
 
-    def create_cache_table(self, engine):
-        self.cursor.execute('begin')
-        self.cursor.execute('''
+    def create_cache_table(self, cursor, engine):
+        cursor.execute('begin')
+        cursor.execute('''
             create table cache (
                 id binary(20) not null,
                 data mediumblob not null,
+                timestamp int not null default 0,
+                size int not null default 0,
+                body_id binary(20) null,
+                url text null,
+                response_url text null,
+                response_code int null,
+                head mediumblob null,
+                primary key (id),
+                key timestamp (timestamp)
+            ) engine = %s
+        ''' % engine)
+        self.create_cache_body_table(cursor, engine)
+        self.create_cache_dict_table(cursor, engine)
+        cursor.execute('commit')
+
+    def create_cache_body_table(self, cursor, engine):
+        cursor.execute('''
+            create table cache_body (
+                id binary(20) not null,
+                data mediumblob not null,
+                refs int not null default 0,
+                size int not null default 0,
+                dict_id binary(20) null,
                 primary key (id)
             ) engine = %s
         ''' % engine)
-        self.cursor.execute('commit')
+
+    def create_cache_dict_table(self, cursor, engine):
+        cursor.execute('''
+            create table cache_dict (
+                id binary(20) not null,
+                host varchar(255) not null,
+                data mediumblob not null,
+                primary key (id),
+                key host (host)
+            ) engine = %s
+        ''' % engine)
+
+    def upgrade_cache_table(self, cursor):
+        """
+        Add columns to the cache table and tables for bodies and
+        dictionaries which are not created by previous versions of grab.
+        """
+
+        cursor.execute('show columns from cache')
+        columns = [x[0] for x in cursor]
+        if not 'timestamp' in columns:
+            logger.debug('Adding timestamp and size columns to cache table')
+            cursor.execute('''
+                alter table cache
+                add column timestamp int not null default 0,
+                add column size int not null default 0,
+                add key timestamp (timestamp)
+            ''')
+            cursor.execute('begin')
+            cursor.execute('update cache set size = length(data)')
+            cursor.execute('commit')
+        if not 'body_id' in columns:
+            logger.debug('Adding body_id column to cache table')
+            cursor.execute('''
+                alter table cache add column body_id binary(20) null
+            ''')
+            cursor.execute('begin')
+            self.create_cache_body_table(cursor, self.mysql_engine)
+            cursor.execute('commit')
+        if not 'response_code' in columns:
+            logger.debug('Adding columns for item fields to cache table')
+            cursor.execute('''
+                alter table cache
+                add column url text null,
+                add column response_url text null,
+                add column response_code int null,
+                add column head mediumblob null
+            ''')
+        # cache_body table which is created above already has the column
+        cursor.execute('show columns from cache_body')
+        if not 'dict_id' in [x[0] for x in cursor]:
+            logger.debug('Adding dict_id column to cache_body table')
+            cursor.execute('''
+                alter table cache_body add column dict_id binary(20) null
+            ''')
+        cursor.execute('show tables')
+        if not 'cache_dict' in [x[0] for x in cursor]:
+            logger.debug('Adding cache_dict table')
+            cursor.execute('begin')
+            self.create_cache_dict_table(cursor, self.mysql_engine)
+            cursor.execute('commit')
 
     def get_item(self, url):
         """
         Returned item should have specific interface. See module docstring.
         """
 
-        _hash = self.build_hash(url)
+        with self.spider.save_timer('cache.read.build_hash'):
+            _hash = self.build_hash(url)
         with self.spider.save_timer('cache.read.mysql_query'):
-            self.cursor.execute('begin')
-            res = self.cursor.execute('''
-                select data from cache where id = x%s
-            ''', (_hash,))
-            row = self.cursor.fetchone()
-            self.cursor.execute('commit')
+            with self.pool.cursor() as cursor:
+                cursor.execute('''
+                    select %s
+                    from cache left join cache_body
+                        on cache_body.id = cache.body_id
+                    where cache.id = x%%s
+                ''' % ITEM_COLUMNS, (_hash,))
+                row = cursor.fetchone()
         if row:
-            return self.unpack_database_value(row[0])
+            with self.spider.save_timer('cache.read.unpack_data'):
+                return self.unpack_row(*row)
         else:
             return None
 
-    def unpack_database_value(self, val):
+    def get_items(self, urls):
+        """
+        Load multiple items with one query.
+
+        Returns dict which maps URL to the item. URLs which are not found
+        in the cache are not in the dict.
+        """
+
+        hashes = dict((self.build_hash(x), x) for x in urls)
+        if not hashes:
+            return {}
+        with self.spider.save_timer('cache.read.mysql_query'):
+            with self.pool.cursor() as cursor:
+                cursor.execute('''
+                    select hex(cache.id), %s
+                    from cache left join cache_body
+                        on cache_body.id = cache.body_id
+                    where cache.id in (%s)
+                ''' % (ITEM_COLUMNS, ', '.join(['x%s'] * len(hashes))),
+                    hashes.keys())
+                rows = cursor.fetchall()
+        items = {}
         with self.spider.save_timer('cache.read.unpack_data'):
-            dump = zlib.decompress(val)
-            return marshal.loads(dump)
+            for row in rows:
+                item = self.unpack_row(*row[1:])
+                if item is not None:
+                    items[hashes[row[0].lower()]] = item
+        return items
+
+    def iter_batches(self, start_key=None, batch_size=1000):
+        """
+        Iterate over all items of the cache in the order of their ids.
+
+        Yields (key, items) pairs, `key` could be passed as `start_key`
+        argument to continue iteration after the last item of the batch.
+        """
+
+        while True:
+            with self.pool.cursor() as cursor:
+                if start_key is None:
+                    cursor.execute('''
+                        select hex(cache.id), %s
+                        from cache left join cache_body
+                            on cache_body.id = cache.body_id
+                        order by cache.id limit %%s
+                    ''' % ITEM_COLUMNS, (batch_size,))
+                else:
+                    cursor.execute('''
+                        select hex(cache.id), %s
+                        from cache left join cache_body
+                            on cache_body.id = cache.body_id
+                        where cache.id > x%%s
+                        order by cache.id limit %%s
+                    ''' % ITEM_COLUMNS, (start_key, batch_size))
+                rows = cursor.fetchall()
+            if not rows:
+                break
+            items = [self.unpack_row(*x[1:]) for x in rows]
+            start_key = rows[-1][0].lower()
+            yield start_key, [x for x in items if x is not None]
+
+    def count_items(self):
+        with self.pool.cursor() as cursor:
+            cursor.execute('select count(*) from cache')
+            return int(cursor.fetchone()[0])
+
+    def unpack_row(self, data, url, response_url, response_code, head,
+                   timestamp, body_id, body_data, dict_id):
+        """
+        Build cache item from the row of cache table joined with
+        the row of cache_body table.
+        """
+
+        if data:
+            # Old data format
+            item = self.unpack_database_value(data)
+        else:
+            item = {
+                'url': url,
+                'response_url': response_url,
+                'head': head,
+                'response_code': response_code,
+                'cookies': None,
+                'timestamp': timestamp,
+            }
+        # Items saved in old data format contain the body
+        if body_id is not None:
+            if body_data is None:
+                logger.error('Body of cache item not found. Url: %s'\
+                             % item['url'])
+                return None
+            if dict_id is not None:
+                dict_id = dict_id.lower()
+            item['body'] = self.compressor.decompress(dict_id, body_data)
+        return item
+
+    def unpack_database_value(self, val):
+        dump = zlib.decompress(val)
+        return marshal.loads(dump)
 
     def build_hash(self, url):
-        with self.spider.save_timer('cache.read.build_hash'):
-            if isinstance(url, unicode):
-                utf_url = url.encode('utf-8')
-            else:
-                utf_url = url
-            return sha1(utf_url).hexdigest()
+        if isinstance(url, unicode):
+            utf_url = url.encode('utf-8')
+        else:
+            utf_url = url
+        return sha1(utf_url).hexdigest()
+
+    def build_body_hash(self, body):
+        return sha1(body).hexdigest()
 
     def remove_cache_item(self, url):
         _hash = self.build_hash(url)
-        self.cursor.execute('begin')
-        self.cursor.execute('''
-            delete from cache where id = x%s
-        ''', (_hash,))
-        self.cursor.execute('commit')
+        with self.pool.cursor() as cursor:
+            cursor.execute('begin')
+            cursor.execute('''
+                select hex(body_id) from cache where id = x%s for update
+            ''', (_hash,))
+            row = cursor.fetchone()
+            cursor.execute('''
+                delete from cache where id = x%s
+            ''', (_hash,))
+            if row and row[0] is not None:
+                self.release_bodies(cursor, [row[0].lower()])
+            cursor.execute('commit')
 
     def load_response(self, grab, cache_item):
         grab.fake_response(cache_item['body'])
@@ -115,29 +425,266 @@ class CacheBackend(object):
 
         grab.process_request_result(custom_prepare_response_func)
 
-    def save_response(self, url, grab):
-        body = grab.response.body
+    def build_item(self, url, grab):
+        """
+        Build cache item from the response of `grab` instance.
+        """
 
-        item = {
+        return {
             'url': url,
             'response_url': grab.response.url,
-            'body': body,
+            'body': grab.response.body,
             'head': grab.response.head,
             'response_code': grab.response.code,
             'cookies': None,
+            'timestamp': int(time.time()),
         }
-        self.set_item(url, item)
+
+    def save_response(self, url, grab):
+        self.save_items([self.build_item(url, grab)])
+
+    def save_items(self, items):
+        self.set_items([(x['url'], x) for x in items])
 
     def set_item(self, url, item):
-        _hash = self.build_hash(url)
-        data = self.pack_database_value(item)
-        self.cursor.execute('begin')
-        res = self.cursor.execute('''
-            insert into cache (id, data) values(x%s, %s)
-            on duplicate key update data = %s
-        ''', (_hash, data, data))
-        self.cursor.execute('commit')
-
-    def pack_database_value(self, val):
-        dump = marshal.dumps(val)
-        return zlib.compress(dump)
+        self.set_items([(url, item)])
+
+    def set_items(self, items):
+        """
+        Save multiple items with multi-row insert queries.
+
+        Body which is already in the cache is not saved again, only
+        its reference counter is incremented.
+
+        :param items: list of (url, item) pairs
+        """
+
+        rows = []
+        size = 0
+        for url, item in items:
+            body = item['body']
+            if self.use_compression == 'dict':
+                dict_id, body_data = self.compressor.compress(url, body)
+            else:
+                dict_id, body_data = None, zlib.compress(body)
+            row_size = len(url) + len(item['response_url'] or '')\
+                       + len(item['head'])
+            rows.append({
+                'id': self.build_hash(url),
+                'url': url,
+                'response_url': item['response_url'],
+                'response_code': item['response_code'],
+                'head': item['head'],
+                'timestamp': item.get('timestamp') or 0,
+                'size': row_size,
+                'body_id': self.build_body_hash(body),
+                'body_data': body_data,
+                'dict_id': dict_id,
+            })
+            size += row_size + len(body_data)
+            if size > MAX_INSERT_SIZE:
+                self.insert_rows(rows)
+                rows = []
+                size = 0
+        if rows:
+            self.insert_rows(rows)
+
+    def insert_rows(self, rows):
+        with self.pool.cursor() as cursor:
+            self.insert_rows_with_cursor(cursor, rows)
+
+    def insert_rows_with_cursor(self, cursor, rows):
+        cursor.execute('begin')
+        # Find bodies which are referenced by the items being replaced
+        cursor.execute('''
+            select hex(id), hex(body_id) from cache where id in (%s)
+            for update
+        ''' % ', '.join(['x%s'] * len(rows)), [x['id'] for x in rows])
+        old_hashes = {}
+        for _hash, body_hash in cursor.fetchall():
+            old_hashes[_hash.lower()] = body_hash and body_hash.lower()
+        new_refs = {}
+        bodies = {}
+        released = []
+        for row in rows:
+            body_hash = row['body_id']
+            old_hash = old_hashes.get(row['id'])
+            if old_hash != body_hash:
+                new_refs[body_hash] = new_refs.get(body_hash, 0) + 1
+                bodies[body_hash] = (row['body_data'], row['dict_id'])
+                if old_hash is not None:
+                    released.append(old_hash)
+            old_hashes[row['id']] = body_hash
+
+        # Bodies are saved before the items which refer to them
+        if new_refs:
+            params = []
+            for body_hash, refs in new_refs.items():
+                body_data, dict_id = bodies[body_hash]
+                params.extend((body_hash, body_data, refs, len(body_data),
+                               dict_id))
+            cursor.execute('''
+                insert into cache_body (id, data, refs, size, dict_id)
+                values %s
+                on duplicate key update refs = refs + values(refs)
+            ''' % ', '.join(['(x%s, %s, %s, %s, unhex(%s))'] * len(new_refs)),
+                params)
+        params = []
+        for row in rows:
+            params.extend((row['id'], row['url'], row['response_url'],
+                           row['response_code'], row['head'],
+                           row['timestamp'], row['size'], row['body_id']))
+        # Empty `data` column means that item fields are stored
+        # in separate columns
+        cursor.execute('''
+            insert into cache (id, data, url, response_url, response_code,
+                head, timestamp, size, body_id)
+            values %s
+            on duplicate key update data = values(data), url = values(url),
+                response_url = values(response_url),
+                response_code = values(response_code), head = values(head),
+                timestamp = values(timestamp), size = values(size),
+                body_id = values(body_id)
+        ''' % ', '.join(["(x%s, '', %s, %s, %s, %s, %s, %s, x%s)"] * len(rows)),
+            params)
+        if released:
+            self.release_bodies(cursor, released)
+        cursor.execute('commit')
+
+    def release_bodies(self, cursor, body_hashes):
+        """
+        Decrement reference counters of bodies and remove bodies
+        which are not referenced anymore.
+
+        Should be called inside of transaction.
+
+        :param body_hashes: list of body hashes, the hash is repeated
+            as many times as many references should be released
+        """
+
+        counts = {}
+        for body_hash in body_hashes:
+            counts[body_hash] = counts.get(body_hash, 0) + 1
+        # Bodies with equal number of released references
+        # are updated with one query
+        groups = {}
+        for body_hash, count in counts.items():
+            groups.setdefault(count, []).append(body_hash)
+        for count, group in groups.items():
+            for pos in xrange(0, len(group), 1000):
+                chunk = group[pos:pos + 1000]
+                cursor.execute('''
+                    update cache_body set refs = refs - %%s where id in (%s)
+                ''' % ', '.join(['x%s'] * len(chunk)), [count] + chunk)
+        unique_hashes = counts.keys()
+        for pos in xrange(0, len(unique_hashes), 1000):
+            chunk = unique_hashes[pos:pos + 1000]
+            cursor.execute('''
+                delete from cache_body where refs <= 0 and id in (%s)
+            ''' % ', '.join(['x%s'] * len(chunk)), chunk)
+
+    def load_dictionary(self, dict_id):
+        with self.pool.cursor() as cursor:
+            cursor.execute('''
+                select data from cache_dict where id = x%s
+            ''', (dict_id,))
+            row = cursor.fetchone()
+        return None if row is None else row[0]
+
+    def find_dictionary(self, host):
+        with self.pool.cursor() as cursor:
+            cursor.execute('''
+                select hex(id), data from cache_dict where host = %s limit 1
+            ''', (host,))
+            row = cursor.fetchone()
+        return None if row is None else (row[0].lower(), row[1])
+
+    def save_dictionary(self, dict_id, host, data):
+        with self.pool.cursor() as cursor:
+            cursor.execute('''
+                insert ignore into cache_dict (id, host, data)
+                values (x%s, %s, %s)
+            ''', (dict_id, host, data))
+
+    def get_dedup_stats(self):
+        """
+        Calculate how much space is saved by storing identical bodies once.
+        The whole cache is scanned, so the method is slow on large caches.
+
+        Returns dict with keys:
+        * items - number of cache items
+        * bodies - number of stored bodies
+        * size - total size of bodies of all cache items
+        * stored_size - total size of stored bodies
+        * ratio - size / stored_size
+        """
+
+        with self.pool.cursor() as cursor:
+            cursor.execute('''
+                select count(*), coalesce(sum(cache_body.size), 0)
+                from cache join cache_body on cache_body.id = cache.body_id
+            ''')
+            items, size = cursor.fetchone()
+            # Items saved in old data format contain the body
+            cursor.execute('''
+                select count(*), coalesce(sum(size), 0)
+                from cache where body_id is null
+            ''')
+            old_items, old_size = cursor.fetchone()
+            cursor.execute('''
+                select count(*), coalesce(sum(size), 0) from cache_body
+            ''')
+            bodies, stored_size = cursor.fetchone()
+        size = int(size + old_size)
+        stored_size = int(stored_size + old_size)
+        return {
+            'items': int(items + old_items),
+            'bodies': int(bodies),
+            'size': size,
+            'stored_size': stored_size,
+            'ratio': float(size) / stored_size if stored_size else 1.0,
+        }
+
+    def evict(self, max_size):
+        """
+        Remove oldest items until total size of cache fits into
+        `max_size` bytes.
+
+        Size of the body shared by multiple items is counted once.
+
+        Returns number of removed items.
+        """
+
+        with self.pool.cursor() as cursor:
+            cursor.execute('''
+                select hex(cache.id), cache.size, hex(cache.body_id),
+                    cache_body.size
+                from cache left join cache_body
+                    on cache_body.id = cache.body_id
+                order by cache.timestamp desc
+            ''')
+            rows = cursor.fetchall()
+        total_size = 0
+        remove_ids = []
+        released = []
+        seen_bodies = set()
+        for _hash, size, body_hash, body_size in rows:
+            total_size += size
+            if body_hash is not None and not body_hash in seen_bodies:
+                seen_bodies.add(body_hash)
+                total_size += body_size or 0
+            if total_size > max_size:
+                remove_ids.append(_hash)
+                if body_hash is not None:
+                    released.append(body_hash.lower())
+        with self.pool.cursor() as cursor:
+            cursor.execute('begin')
+            for pos in xrange(0, len(remove_ids), 1000):
+                chunk = remove_ids[pos:pos + 1000]
+                cursor.execute('''
+                    delete from cache where id in (%s)
+                ''' % ', '.join(['x%s'] * len(chunk)), chunk)
+            if released:
+                self.release_bodies(cursor, released)
+            cursor.execute('commit')
+        return len(remove_ids)
@@ -0,0 +1,800 @@
+"""
+Log-structured cache backend which stores items in local files.
+
+The `database` argument is the directory of the cache. Items are
+compressed and appended to the end of the current segment file
+(segment-NNNNNN.dat), so writes are sequential. When the segment grows
+larger than `segment_size` the next segment is started. The item which is
+saved again or removed stays in its old segment as garbage, the removal
+is recorded with "deleted" record.
+
+The index maps sha1 of URL to the segment, offset and length of the
+record. Changes of the index are kept in memory, when there are many of
+them or when `flush` method is called (the spider calls it when the work
+is done) they are saved into new index file (index-NNNNNN) as sorted
+array of fixed-size entries, so the size of written data depends only on
+the number of changes. Index files are memory-mapped and searched with
+binary search from the newest to the oldest one, so opening of the cache
+does not read the whole index. Small index files are merged together
+with the compaction of segments, the newer file is merged into the older
+one only when it is not much smaller, so each entry is rewritten only a
+few times. If the process was killed before the index was saved then
+records written after the saved position are read again from the
+segments when the cache is opened.
+
+Segments where less than `compact_ratio` part of data is live are
+compacted in background thread: live records are copied to the current
+segment and the old segment file is removed.
+
+CacheItem interface:
+'url': string,
+'response_url': string,
+'body': string,
+'head': string,
+'response_code': int,
+'cookies': None,
+'timestamp': int, # time when the document was fetched
+'size': int, # size of the item before compression
+
+If `use_compression` is "dict" then bodies are compressed with
+dictionaries trained for each host (see `grab.spider.cache_compression`).
+Dictionaries are stored in "dictionaries" file.
+"""
+from __future__ import absolute_import
+from hashlib import sha1
+import threading
+import heapq
+import logging
+import marshal
+import struct
+import mmap
+import time
+import zlib
+import os
+
+from grab.response import Response
+from grab.spider.cache_compression import DictionaryCompressor
+
+logger = logging.getLogger('grab.spider.cache_backend.segment')
+SEGMENT_SIZE = 256 * 1024 * 1024
+# Segment is compacted when less than this part of its data is live
+COMPACT_RATIO = 0.5
+# Index is saved when this number of items are changed after the last save
+INDEX_FLUSH_NUMBER = 100000
+# Newer index files are merged into the older one when it has no more
+# than this number of entries for each entry of the newer files
+INDEX_MERGE_RATIO = 2
+# Record header: sha1 of URL, flags, length of data, crc32 of data,
+# timestamp, size of item before compression
+RECORD = struct.Struct('>20sBIiII')
+# Index header: magic, number of the oldest index file which is merged
+# into this file, segment and offset up to which records are indexed,
+# number of items, number of segment entries
+INDEX_HEADER = struct.Struct('>4sIIQQI')
+INDEX_MAGIC = 'GSI2'
+# Segment entry: segment number, size of live records
+SEGMENT_INFO = struct.Struct('>IQ')
+# Index entry: sha1 of URL, segment number, offset and length of
+# the record, timestamp, size of item before compression
+ENTRY = struct.Struct('>20sIQIII')
+# Entry of removed item, segments are numbered from 1
+DELETED_ENTRY = (0, 0, 0, 0, 0)
+FLAG_DELETED = 1
+FLAG_COMPRESSED = 2
+
+
+def iter_segment(inp, offset=0):
+    """
+    Iterate over records of segment file starting from `offset`.
+
+    Yields (offset, header, data) tuples. Iteration stops at the
+    record which is not written completely.
+    """
+
+    inp.seek(offset)
+    while True:
+        header = inp.read(RECORD.size)
+        if len(header) < RECORD.size:
+            break
+        header = RECORD.unpack(header)
+        data = inp.read(header[2])
+        if len(data) < header[2] or zlib.crc32(data) != header[3]:
+            break
+        yield offset, header, data
+        offset += RECORD.size + len(data)
+
+
+def write_index(path, first, position, item_count, live_size, entries):
+    """
+    Save sorted (key, entry) pairs into the index file.
+    """
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        segments = sorted(live_size.iteritems())
+        out.write(INDEX_HEADER.pack(INDEX_MAGIC, first, position[0],
+                                    position[1], item_count, len(segments)))
+        for segment in segments:
+            out.write(SEGMENT_INFO.pack(*segment))
+        for key, entry in entries:
+            out.write(ENTRY.pack(key, *entry))
+    os.rename(tmp_path, path)
+
+
+def merge_entries(sources, drop_deleted=False):
+    """
+    Merge sorted iterators of (key, entry) pairs, entry of the key
+    is taken from the last source which contains it.
+    """
+
+    def iter_source(number, source):
+        for key, entry in source:
+            yield key, -number, entry
+
+    last_key = None
+    for key, number, entry in heapq.merge(*[iter_source(number, x)
+                                            for number, x
+                                            in enumerate(sources)]):
+        if key == last_key:
+            continue
+        last_key = key
+        if drop_deleted and entry == DELETED_ENTRY:
+            continue
+        yield key, entry
+
+
+class IndexFile(object):
+    """
+    Memory-mapped index file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.number = int(os.path.basename(path)[6:])
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.first, segment, offset, self.item_count,\
+            segment_number = INDEX_HEADER.unpack_from(self.data)
+        if magic != INDEX_MAGIC:
+            raise ValueError('Invalid cache index: %s' % path)
+        self.position = (segment, offset)
+        self.live_size = {}
+        for x in xrange(segment_number):
+            segment, size = SEGMENT_INFO.unpack_from(
+                self.data, INDEX_HEADER.size + x * SEGMENT_INFO.size)
+            self.live_size[segment] = size
+        self.entries_offset = INDEX_HEADER.size +\
+                              segment_number * SEGMENT_INFO.size
+        self.count = (len(self.data) - self.entries_offset) // ENTRY.size
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def read_entry(self, number):
+        return ENTRY.unpack_from(self.data,
+                                 self.entries_offset + number * ENTRY.size)
+
+    def bisect(self, key):
+        """
+        Return position of the first entry which key is not less
+        than `key`.
+        """
+
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = self.entries_offset + middle * ENTRY.size
+            if self.data[start:start + 20] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, key):
+        """
+        Return the entry of the key or None if the key is not in the file.
+        """
+
+        position = self.bisect(key)
+        if position < self.count:
+            entry = self.read_entry(position)
+            if entry[0] == key:
+                return entry[1:]
+        return None
+
+    def iter_entries(self, start_key=None):
+        """
+        Iterate over (key, entry) pairs which key is greater
+        than `start_key`.
+        """
+
+        position = 0
+        if start_key is not None:
+            position = self.bisect(start_key)
+            if position < self.count and \
+                    self.read_entry(position)[0] == start_key:
+                position += 1
+        while position < self.count:
+            entry = self.read_entry(position)
+            yield entry[0], entry[1:]
+            position += 1
+
+
+class Compactor(threading.Thread):
+    """
+    Thread which compacts segments of the cache when it is notified.
+    """
+
+    def __init__(self, cache):
+        super(Compactor, self).__init__()
+        self.daemon = True
+        self.cache = cache
+        self.event = threading.Event()
+        self.stopped = False
+
+    def notify(self):
+        self.event.set()
+
+    def stop(self):
+        self.stopped = True
+        self.event.set()
+        self.join()
+
+    def run(self):
+        while True:
+            self.event.wait()
+            self.event.clear()
+            if self.stopped:
+                break
+            try:
+                self.cache.compact()
+            except Exception, ex:
+                logger.error('Could not compact cache segments', exc_info=ex)
+
+
+class CacheBackend(object):
+    def __init__(self, database, use_compression=True, spider=None,
+                 segment_size=SEGMENT_SIZE, compact_ratio=COMPACT_RATIO,
+                 background_compaction=True):
+        """
+        Arguments:
+        * segment_size - max. size of segment file in bytes
+        * compact_ratio - segment is compacted when the size of its live
+            records is less than this part of its size
+        * background_compaction - compact segments in separate thread,
+            if it is False then segments are compacted only by
+            explicit call of `compact` method
+        """
+
+        self.spider = spider
+        self.path = database
+        self.use_compression = use_compression
+        self.segment_size = segment_size
+        self.compact_ratio = compact_ratio
+        self.compressor = DictionaryCompressor(self)
+        # Items are saved from separate thread if `async_write`
+        # option is on, and segments are compacted in background
+        self.lock = threading.RLock()
+        if not os.path.exists(database):
+            os.makedirs(database)
+        self.dict_path = os.path.join(database, 'dictionaries')
+        self.dictionaries = self.load_dictionaries()
+
+        # Index files from the oldest to the newest one
+        self.index_files = []
+        self.indexed_position = (0, 0)
+        self.item_count = 0
+        self.live_size = {}
+        # Items changed after the index was saved, removed items
+        # are mapped to None
+        self.changes = {}
+        self.readers = {}
+        self.writer = None
+        self.segments = sorted(int(x[8:-4]) for x in os.listdir(database)
+                               if x.startswith('segment-'))
+        self.open_index()
+        self.recover()
+        self.open_segment(self.segments[-1] if self.segments else 1)
+
+        self.compactor = None
+        if background_compaction:
+            self.compactor = Compactor(self)
+            self.compactor.start()
+            self.compactor.notify()
+
+    # *****
+    # Index
+    # *****
+
+    def index_path(self, number):
+        return os.path.join(self.path, 'index-%06d' % number)
+
+    def open_index(self):
+        numbers = sorted((int(x[6:]) for x in os.listdir(self.path)
+                          if x.startswith('index-') and not x.endswith('.tmp')),
+                         reverse=True)
+        for number in numbers:
+            if self.index_files and number >= self.index_files[0].first:
+                # The process was killed after the file was merged
+                # into the newer one
+                os.unlink(self.index_path(number))
+                continue
+            self.index_files.insert(0, IndexFile(self.index_path(number)))
+        if self.index_files:
+            last = self.index_files[-1]
+            self.indexed_position = last.position
+            self.item_count = last.item_count
+            self.live_size = dict(last.live_size)
+
+    def lookup(self, key):
+        """
+        Return (segment, offset, length, timestamp, size) entry
+        of the item or None.
+        """
+
+        if key in self.changes:
+            return self.changes[key]
+        for index_file in reversed(self.index_files):
+            entry = index_file.find(key)
+            if entry is not None:
+                return None if entry == DELETED_ENTRY else entry
+        return None
+
+    def set_entry(self, key, entry):
+        old_entry = self.lookup(key)
+        if old_entry is not None:
+            self.live_size[old_entry[0]] -= old_entry[2]
+            if entry is None:
+                self.item_count -= 1
+        elif entry is not None:
+            self.item_count += 1
+        if entry is not None:
+            self.live_size[entry[0]] = self.live_size.get(entry[0], 0)\
+                                       + entry[2]
+        self.changes[key] = entry
+
+    def iter_changes(self, start_key=None):
+        for key, entry in sorted(self.changes.iteritems()):
+            if start_key is None or key > start_key:
+                yield key, entry or DELETED_ENTRY
+
+    def iter_entries(self, start_key=None):
+        """
+        Iterate over (key, entry) pairs of all items in order of keys
+        starting after `start_key`.
+        """
+
+        sources = [x.iter_entries(start_key) for x in self.index_files]
+        sources.append(self.iter_changes(start_key))
+        return merge_entries(sources, drop_deleted=True)
+
+    def save_index(self):
+        """
+        Save changed items into new index file.
+        """
+
+        with self.lock:
+            if self.writer is not None:
+                self.writer.flush()
+            if self.index_files:
+                number = self.index_files[-1].number + 1
+            else:
+                number = 1
+            path = self.index_path(number)
+            write_index(path, number, (self.active_segment, self.active_size),
+                        self.item_count, self.live_size, self.iter_changes())
+            self.index_files.append(IndexFile(path))
+            self.changes = {}
+            if self.compactor is not None:
+                self.compactor.notify()
+            else:
+                self.merge_index()
+
+    def find_merge_candidates(self):
+        """
+        Return the newest index files which should be merged together
+        and the flag which is True if the oldest file is among them.
+        """
+
+        with self.lock:
+            start = len(self.index_files) - 1
+            count = 0
+            while start > 0:
+                count += self.index_files[start].count
+                if self.index_files[start - 1].count > count * INDEX_MERGE_RATIO:
+                    break
+                start -= 1
+            if start == len(self.index_files) - 1:
+                return [], False
+            # Removed items are not needed in the oldest file
+            return self.index_files[start:], start == 0
+
+    def merge_index(self):
+        """
+        Merge small index files.
+
+        Returns number of removed files.
+        """
+
+        candidates, drop_deleted = self.find_merge_candidates()
+        if not candidates:
+            return 0
+        # Index files are not changed, so they are read without the lock
+        last = candidates[-1]
+        write_index(last.path, candidates[0].first, last.position,
+                    last.item_count, last.live_size,
+                    merge_entries([x.iter_entries() for x in candidates],
+                                  drop_deleted=drop_deleted))
+        with self.lock:
+            start = self.index_files.index(candidates[0])
+            self.index_files[start:start + len(candidates)] =\
+                [IndexFile(last.path)]
+            for index_file in candidates:
+                index_file.close()
+                if index_file is not last:
+                    os.unlink(index_file.path)
+        logger.debug('Merged %d index files' % len(candidates))
+        return len(candidates) - 1
+
+    def flush(self):
+        """
+        Save the index if there are unsaved changes.
+        """
+
+        with self.lock:
+            if self.changes:
+                self.save_index()
+
+    def recover(self):
+        """
+        Read records which are written after the index was saved.
+        """
+
+        segment, offset = self.indexed_position
+        count = 0
+        for number in self.segments:
+            if number < segment:
+                continue
+            path = self.segment_path(number)
+            end = offset if number == segment else 0
+            with open(path, 'rb') as inp:
+                for end, header, data in iter_segment(inp, end):
+                    self.apply_record(number, end, header)
+                    end += RECORD.size + len(data)
+                    count += 1
+            if end < os.path.getsize(path):
+                logger.error('Segment %s is damaged after offset %d, '
+                             'the rest of file is ignored' % (path, end))
+                if number == self.segments[-1]:
+                    with open(path, 'r+b') as out:
+                        out.truncate(end)
+        if count:
+            logger.debug('Loaded %d records which are not in the index' % count)
+
+    def apply_record(self, segment, offset, header):
+        key, flags, length, crc, timestamp, size = header
+        if flags & FLAG_DELETED:
+            self.set_entry(key, None)
+        else:
+            self.set_entry(key, (segment, offset, RECORD.size + length,
+                                 timestamp, size))
+
+    # ********
+    # Segments
+    # ********
+
+    def segment_path(self, number):
+        return os.path.join(self.path, 'segment-%06d.dat' % number)
+
+    def open_segment(self, number):
+        if self.writer is not None:
+            self.writer.close()
+        path = self.segment_path(number)
+        self.writer = open(path, 'ab')
+        self.active_segment = number
+        self.active_size = os.path.getsize(path)
+        if not number in self.segments:
+            self.segments.append(number)
+
+    def get_reader(self, number):
+        try:
+            return self.readers[number]
+        except KeyError:
+            reader = open(self.segment_path(number), 'rb')
+            self.readers[number] = reader
+            return reader
+
+    def append_record(self, key, flags, data, timestamp, size):
+        if self.active_size >= self.segment_size:
+            self.open_segment(self.active_segment + 1)
+            if self.compactor is not None:
+                self.compactor.notify()
+        offset = self.active_size
+        self.writer.write(RECORD.pack(key, flags, len(data), zlib.crc32(data),
+                                      timestamp, size))
+        self.writer.write(data)
+        self.active_size += RECORD.size + len(data)
+        return (self.active_segment, offset, RECORD.size + len(data),
+                timestamp, size)
+
+    def read_record(self, entry):
+        segment, offset, length = entry[:3]
+        if segment == self.active_segment:
+            self.writer.flush()
+        reader = self.get_reader(segment)
+        reader.seek(offset)
+        data = reader.read(length)
+        return RECORD.unpack_from(data)[1], data[RECORD.size:]
+
+    def find_compaction_candidates(self):
+        with self.lock:
+            candidates = []
+            for number in self.segments:
+                if number == self.active_segment:
+                    continue
+                size = os.path.getsize(self.segment_path(number))
+                if self.live_size.get(number, 0) < size * self.compact_ratio:
+                    candidates.append(number)
+            return candidates
+
+    def compact(self):
+        """
+        Copy live records of sparse segments into the current segment
+        and remove these segments. Also merge small index files.
+
+        Returns number of removed segments.
+        """
+
+        self.merge_index()
+        candidates = self.find_compaction_candidates()
+        for number in candidates:
+            # Old segment is not changed, only the index is locked
+            with open(self.segment_path(number), 'rb') as inp:
+                for offset, header, data in iter_segment(inp):
+                    key, flags, length, crc, timestamp, size = header
+                    if flags & FLAG_DELETED:
+                        continue
+                    with self.lock:
+                        entry = self.lookup(key)
+                        if entry is None or entry[:2] != (number, offset):
+                            continue
+                        self.set_entry(key, self.append_record(
+                            key, flags, data, timestamp, size))
+        if candidates:
+            with self.lock:
+                # Index should not refer to removed segments
+                self.save_index()
+                for number in candidates:
+                    reader = self.readers.pop(number, None)
+                    if reader is not None:
+                        reader.close()
+                    os.unlink(self.segment_path(number))
+                    self.segments.remove(number)
+                    self.live_size.pop(number, None)
+            logger.debug('Compacted %d segments' % len(candidates))
+        return len(candidates)
+
+    def close(self):
+        if self.compactor is not None:
+            self.compactor.stop()
+            self.compactor = None
+        with self.lock:
+            self.flush()
+            self.writer.close()
+            for reader in self.readers.values():
+                reader.close()
+            self.readers = {}
+            for index_file in self.index_files:
+                index_file.close()
+            self.index_files = []
+
+    # *****
+    # Items
+    # *****
+
+    def build_key(self, url):
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        return sha1(url).digest()
+
+    def encode_item(self, item):
+        """
+        Return (flags, data) pair.
+        """
+
+        item = item.copy()
+        if self.use_compression == 'dict':
+            item['dict_id'], item['body'] = self.compressor.compress(
+                item['url'], item['body'])
+            return 0, marshal.dumps(item)
+        elif self.use_compression:
+            return FLAG_COMPRESSED, zlib.compress(marshal.dumps(item))
+        else:
+            return 0, marshal.dumps(item)
+
+    def decode_item(self, flags, data):
+        if flags & FLAG_COMPRESSED:
+            data = zlib.decompress(data)
+        item = marshal.loads(data)
+        if 'dict_id' in item:
+            item['body'] = self.compressor.decompress(item.pop('dict_id'),
+                                                      item['body'])
+        return item
+
+    def get_item(self, url):
+        """
+        Returned item should have specific interface. See module docstring.
+        """
+
+        with self.lock:
+            entry = self.lookup(self.build_key(url))
+            if entry is None:
+                return None
+            flags, data = self.read_record(entry)
+        return self.decode_item(flags, data)
+
+    def get_items(self, urls):
+        """
+        Load multiple items.
+
+        Returns dict which maps URL to the item. URLs which are not found
+        in the cache are not in the dict.
+        """
+
+        # Records are read in the order of their position in files
+        with self.lock:
+            records = []
+            for url in urls:
+                entry = self.lookup(self.build_key(url))
+                if entry is not None:
+                    records.append((entry, url))
+            records.sort()
+            records = [(url, self.read_record(entry))
+                       for entry, url in records]
+        return dict((url, self.decode_item(flags, data))
+                    for url, (flags, data) in records)
+
+    def load_response(self, grab, cache_item):
+        grab.fake_response(cache_item['body'])
+
+        def custom_prepare_response_func(transport, g):
+            response = Response()
+            response.head = cache_item['head']
+            response.body = cache_item['body']
+            response.code = cache_item['response_code']
+            response.time = 0
+            response.url = cache_item['response_url']
+            response.parse()
+            response.cookies = transport.extract_cookies()
+            return response
+
+        grab.process_request_result(custom_prepare_response_func)
+
+    def build_item(self, url, grab):
+        """
+        Build cache item from the response of `grab` instance.
+        """
+
+        body = grab.response.body
+        return {
+            'url': url,
+            'response_url': grab.response.url,
+            'body': body,
+            'head': grab.response.head,
+            'response_code': grab.response.code,
+            'cookies': None,
+            'timestamp': int(time.time()),
+            'size': len(body) + len(grab.response.head),
+        }
+
+    def save_response(self, url, grab):
+        self.save_items([self.build_item(url, grab)])
+
+    def save_items(self, items):
+        """
+        Save multiple cache items.
+        """
+
+        # Compression does not need the lock
+        records = []
+        for item in items:
+            size = item.get('size') or len(item['body']) + len(item['head'])
+            records.append((self.build_key(item['url']),
+                            self.encode_item(item),
+                            item.get('timestamp') or 0, size))
+        with self.lock:
+            for key, (flags, data), timestamp, size in records:
+                self.set_entry(key, self.append_record(key, flags, data,
+                                                       timestamp, size))
+            self.writer.flush()
+            if len(self.changes) >= INDEX_FLUSH_NUMBER:
+                self.save_index()
+
+    def remove_cache_item(self, url):
+        key = self.build_key(url)
+        with self.lock:
+            if self.lookup(key) is not None:
+                self.append_record(key, FLAG_DELETED, '', 0, 0)
+                self.set_entry(key, None)
+                self.writer.flush()
+
+    def iter_batches(self, start_key=None, batch_size=1000):
+        """
+        Iterate over all items in the order of the index.
+
+        Yields (key, items) pairs, `key` could be passed as `start_key`
+        argument to continue iteration after the last item of the batch.
+        """
+
+        self.flush()
+        if start_key is not None:
+            start_key = start_key.decode('hex')
+        while True:
+            with self.lock:
+                records = []
+                for key, entry in self.iter_entries(start_key):
+                    records.append(self.read_record(entry))
+                    start_key = key
+                    if len(records) == batch_size:
+                        break
+            if not records:
+                break
+            yield start_key.encode('hex'), [self.decode_item(*x)
+                                            for x in records]
+
+    def count_items(self):
+        return self.item_count
+
+    def evict(self, max_size):
+        """
+        Remove oldest items until total size of cache fits into
+        `max_size` bytes.
+
+        Returns number of removed items.
+        """
+
+        with self.lock:
+            records = sorted(((entry[3], entry[4], key) for key, entry
+                              in self.iter_entries()), reverse=True)
+            total_size = 0
+            count = 0
+            for timestamp, size, key in records:
+                total_size += size
+                if total_size > max_size:
+                    self.append_record(key, FLAG_DELETED, '', 0, 0)
+                    self.set_entry(key, None)
+                    count += 1
+            self.writer.flush()
+        if count and self.compactor is not None:
+            self.compactor.notify()
+        return count
+
+    # ************
+    # Dictionaries
+    # ************
+
+    def load_dictionaries(self):
+        if os.path.exists(self.dict_path):
+            with open(self.dict_path, 'rb') as inp:
+                return marshal.load(inp)
+        else:
+            return {'dicts': {}, 'hosts': {}}
+
+    def load_dictionary(self, dict_id):
+        return self.dictionaries['dicts'].get(dict_id)
+
+    def find_dictionary(self, host):
+        dict_id = self.dictionaries['hosts'].get(host)
+        if dict_id is None:
+            return None
+        return dict_id, self.dictionaries['dicts'][dict_id]
+
+    def save_dictionary(self, dict_id, host, data):
+        with self.lock:
+            self.dictionaries['dicts'][dict_id] = data
+            self.dictionaries['hosts'][host] = dict_id
+            tmp_path = self.dict_path + '.tmp'
+            with open(tmp_path, 'wb') as out:
+                marshal.dump(self.dictionaries, out)
+            os.rename(tmp_path, self.dict_path)
@@ -6,16 +6,38 @@ CacheItem interface:
 'head': string,
 'response_code': int,
 'cookies': None,#grab.response.cookies,
+'timestamp': int, # time when the document was fetched
+'size': int, # size of the item before compression
+
+The body is not stored in the cache item. Identical bodies are saved only
+once into separate database (its filename is the name of cache database
+plus ".body" suffix) and cache items refer to them with `body_hash` key.
+The body record has keys:
+
+'body': string,
+'refs': int, # number of cache items which refer to the body
+'size': int, # size of the body before compression
+'dict_id': string, # id of compression dictionary or None
+
+If `use_compression` is "dict" then bodies are compressed with
+dictionaries trained for each host (see `grab.spider.cache_compression`).
+Such body records have `dict_id` key. Dictionaries are stored in the
+database with ".dict" suffix.
 
 TODO: WTF with cookies???
 """
 from __future__ import absolute_import
 import tc
 import os
+from hashlib import sha1
 import logging
 import marshal
+import time
+import threading
+from itertools import islice
 
 from grab.response import Response
+from grab.spider.cache_compression import DictionaryCompressor
 
 logger = logging.getLogger('grab.spider.cache_backend.mongo')
 
@@ -25,23 +47,67 @@ class CacheBackend(object):
         # database == filename
         self.spider = spider
         self.db = tc_open(database, compress=use_compression)
+        # Bodies compressed with dictionaries are not compressed again
+        self.body_db = tc_open(database + '.body',
+                               compress=use_compression is True)
+        self.dict_db = tc_open(database + '.dict', compress=False)
+        self.compressor = DictionaryCompressor(self)
         self.use_compression = use_compression
+        # Cache items could be saved from separate thread
+        self.lock = threading.Lock()
 
     def get_item(self, url):
         """
         Returned item should have specific interface. See module docstring.
         """
         try:
-            dump = self.db[self.build_key(url)]
+            with self.lock:
+                item = marshal.loads(self.db[self.build_key(url)])
+                # Items saved in old data format contain the body
+                if 'body_hash' in item:
+                    body = self.load_body(item['body_hash'])
+                    if 'dict_id' in body:
+                        item['body'] = self.compressor.decompress(
+                            body['dict_id'], body['body'])
+                    else:
+                        item['body'] = body['body']
         except KeyError:
             return
-        return marshal.loads(dump)
+        return item
+
+    def get_items(self, urls):
+        """
+        Load multiple items.
+
+        Returns dict which maps URL to the item. URLs which are not found
+        in the cache are not in the dict.
+        """
+
+        # Local database does not have network round trips
+        # so we just load items one by one
+        items = {}
+        for url in urls:
+            item = self.get_item(url)
+            if item is not None:
+                items[url] = item
+        return items
 
     def build_key(self, url):
         return url.encode('utf-8') if isinstance(url, unicode) else url
 
+    def build_body_hash(self, body):
+        return sha1(body).hexdigest()
+
+    def load_body(self, body_hash):
+        return marshal.loads(self.body_db[body_hash])
+
     def remove_cache_item(self, url):
-        del self.db[self.build_key(url)]
+        key = self.build_key(url)
+        with self.lock:
+            item = marshal.loads(self.db[key])
+            del self.db[key]
+            if 'body_hash' in item:
+                self.release_body(item['body_hash'])
 
     def load_response(self, grab, cache_item):
         grab.fake_response(cache_item['body'])
@@ -67,17 +133,208 @@ class CacheBackend(object):
 
         grab.process_request_result(custom_prepare_response_func)
 
-    def save_response(self, url, grab):
+    def iter_batches(self, start_key=None, batch_size=1000):
+        """
+        Iterate over all items of the cache.
+
+        Yields (key, items) pairs, `key` could be passed as `start_key`
+        argument to continue iteration after the last item of the batch.
+        Hash database does not keep items in order, the key is the number
+        of items which are already iterated.
+        """
+
+        position = start_key or 0
+        keys = self.iter_keys(self.db)
+        for x in xrange(position):
+            next(keys)
+        while True:
+            batch_keys = list(islice(keys, batch_size))
+            if not batch_keys:
+                break
+            items = []
+            for key in batch_keys:
+                item = self.get_item(key)
+                if item is not None:
+                    item.pop('body_hash', None)
+                    item.pop('body_size', None)
+                    items.append(item)
+            position += len(batch_keys)
+            yield position, items
+
+    def count_items(self):
+        with self.lock:
+            return self.db.rnum()
+
+    def build_item(self, url, grab):
+        """
+        Build cache item from the response of `grab` instance.
+        """
+
         body = grab.response.body
-        item = {
+        return {
             'url': url,
             'response_url': grab.response.url,
             'body': body,
             'head': grab.response.head,
             'response_code': grab.response.code,
             'cookies': None,
+            'timestamp': int(time.time()),
+            'size': len(body) + len(grab.response.head),
+        }
+
+    def save_response(self, url, grab):
+        self.save_items([self.build_item(url, grab)])
+
+    def save_items(self, items):
+        """
+        Save multiple cache items.
+
+        Body which is already in the cache is not saved again, only
+        its reference counter is incremented.
+        """
+
+        with self.lock:
+            for item in items:
+                key = self.build_key(item['url'])
+                item = item.copy()
+                body = item.pop('body')
+                item['body_hash'] = self.build_body_hash(body)
+                item['body_size'] = len(body)
+                try:
+                    old_hash = marshal.loads(self.db[key]).get('body_hash')
+                except KeyError:
+                    old_hash = None
+                if old_hash != item['body_hash']:
+                    try:
+                        body_record = self.load_body(item['body_hash'])
+                    except KeyError:
+                        body_record = {'body': body, 'refs': 0,
+                                       'size': len(body)}
+                        if self.use_compression == 'dict':
+                            body_record['dict_id'], body_record['body'] =\
+                                self.compressor.compress(item['url'], body)
+                    body_record['refs'] += 1
+                    self.body_db[item['body_hash']] = marshal.dumps(body_record)
+                self.db[key] = marshal.dumps(item)
+                if old_hash is not None and old_hash != item['body_hash']:
+                    self.release_body(old_hash)
+
+    def load_dictionary(self, dict_id):
+        try:
+            return self.dict_db[dict_id]
+        except KeyError:
+            return None
+
+    def find_dictionary(self, host):
+        try:
+            dict_id = self.dict_db['host:%s' % host]
+        except KeyError:
+            return None
+        return dict_id, self.dict_db[dict_id]
+
+    def save_dictionary(self, dict_id, host, data):
+        self.dict_db[dict_id] = data
+        self.dict_db['host:%s' % host] = dict_id
+
+    def release_body(self, body_hash):
+        """
+        Decrement reference counter of the body and remove the body
+        if it is not referenced anymore.
+        """
+
+        try:
+            body_record = self.load_body(body_hash)
+        except KeyError:
+            return
+        body_record['refs'] -= 1
+        if body_record['refs'] <= 0:
+            del self.body_db[body_hash]
+        else:
+            self.body_db[body_hash] = marshal.dumps(body_record)
+
+    def iter_keys(self, db):
+        db.iterinit()
+        while True:
+            try:
+                yield db.iternext()
+            except KeyError:
+                break
+
+    def iter_records(self, db):
+        for key in self.iter_keys(db):
+            yield key, marshal.loads(db[key])
+
+    def get_dedup_stats(self):
+        """
+        Calculate how much space is saved by storing identical bodies once.
+        The whole cache is scanned, so the method is slow on large caches.
+
+        Returns dict with keys:
+        * items - number of cache items
+        * bodies - number of stored bodies
+        * size - total size of bodies of all cache items
+        * stored_size - total size of stored bodies
+        * ratio - size / stored_size
+        """
+
+        with self.lock:
+            body_sizes = {}
+            stored_size = 0
+            for body_hash, body_record in self.iter_records(self.body_db):
+                body_sizes[body_hash] = body_record['size']
+                stored_size += body_record['size']
+            items = 0
+            size = 0
+            for key, item in self.iter_records(self.db):
+                items += 1
+                if 'body_hash' in item:
+                    size += body_sizes.get(item['body_hash'], 0)
+                else:
+                    # Old data format, the body is stored in the item
+                    size += len(item['body'])
+                    stored_size += len(item['body'])
+        return {
+            'items': items,
+            'bodies': len(body_sizes),
+            'size': size,
+            'stored_size': stored_size,
+            'ratio': float(size) / stored_size if stored_size else 1.0,
         }
-        self.db[self.build_key(url)] = marshal.dumps(item)
+
+    def evict(self, max_size):
+        """
+        Remove oldest items until total size of cache fits into
+        `max_size` bytes.
+
+        Returns number of removed items.
+        """
+
+        # Tokyo Cabinet hash database does not have secondary indexes
+        # so we have to load all items to find the oldest ones
+        with self.lock:
+            records = []
+            for key, item in self.iter_records(self.db):
+                records.append((item.get('timestamp', 0),
+                                item.get('size', max_size + 1), key,
+                                item.get('body_hash'), item.get('body_size')))
+            records.sort(reverse=True)
+
+            total_size = 0
+            count = 0
+            seen_bodies = set()
+            for timestamp, size, key, body_hash, body_size in records:
+                # Size of the body shared by multiple items is counted once
+                if body_hash is not None:
+                    if body_hash in seen_bodies:
+                        size -= body_size
+                    seen_bodies.add(body_hash)
+                total_size += size
+                if total_size > max_size:
+                    del self.db[key]
+                    if body_hash is not None:
+                        self.release_body(body_hash)
+                    count += 1
+        return count
 
 def tc_open(path, mode='a+', compress=True, makedirs=True):
     if makedirs:
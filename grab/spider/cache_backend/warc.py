@@ -0,0 +1,245 @@
+"""
+Read-only cache backend which loads documents from WARC files.
+
+The `database` argument is the directory with *.warc.gz files, e.g. the
+directory where the spider saves WARC files (see `Spider.setup_warc`).
+
+The backend builds the index of response records and saves it into
+"index.cdx" file in the same directory. The index is rebuilt only if
+WARC files are changed after the index was built. Each line of the index
+contains URL, fetch time, response code, offset and length of the
+compressed record and the WARC file name. Lines are sorted by URL and
+the record is found with binary search in memory-mapped index file.
+
+CacheItem interface:
+'url': string,
+'response_url': string,
+'body': string,
+'head': string,
+'response_code': int,
+'cookies': None,
+'timestamp': int, # time when the document was fetched
+"""
+from __future__ import absolute_import
+import logging
+import mmap
+import os
+import re
+
+from grab.response import Response
+from grab.tools.warc import (iter_records, read_record, parse_date,
+                             parse_http_response)
+
+logger = logging.getLogger('grab.spider.cache_backend.warc')
+INDEX_FILE = 'index.cdx'
+RE_STATUS = re.compile(r'^HTTP/\S+\s+(\d+)')
+
+
+def build_key(url):
+    if isinstance(url, unicode):
+        url = url.encode('utf-8')
+    # Index fields are separated by space
+    return url.replace(' ', '%20')
+
+
+class CacheBackend(object):
+    def __init__(self, database, use_compression=True, spider=None):
+        self.spider = spider
+        self.path = database
+        self.index_path = os.path.join(database, INDEX_FILE)
+        if self.is_index_outdated():
+            self.build_index()
+        self.index = None
+        self.index_file = open(self.index_path, 'rb')
+        if os.path.getsize(self.index_path):
+            self.index = mmap.mmap(self.index_file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+
+    def get_warc_files(self):
+        return sorted(x for x in os.listdir(self.path)
+                      if x.endswith('.warc.gz') or x.endswith('.warc'))
+
+    def is_index_outdated(self):
+        if not os.path.exists(self.index_path):
+            return True
+        index_mtime = os.path.getmtime(self.index_path)
+        for fname in self.get_warc_files():
+            if os.path.getmtime(os.path.join(self.path, fname)) > index_mtime:
+                return True
+        return False
+
+    def build_index(self):
+        """
+        Read all WARC files and save the index of response records.
+        """
+
+        logger.debug('Building index of WARC files in %s' % self.path)
+        lines = []
+        for fname in self.get_warc_files():
+            path = os.path.join(self.path, fname)
+            for offset, length, headers, block in iter_records(path):
+                if headers.get('WARC-Type') != 'response':
+                    continue
+                match = RE_STATUS.match(block)
+                code = match.group(1) if match else '0'
+                timestamp = parse_date(headers['WARC-Date'])
+                lines.append('%s %d %s %d %d %s\n' % (
+                    build_key(headers['WARC-Target-URI']), timestamp, code,
+                    offset, length, fname))
+        # Records of the same URL are sorted by time
+        lines.sort(key=lambda x: (x.split(' ', 1)[0],
+                                  int(x.split(' ', 2)[1])))
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'wb') as out:
+            out.writelines(lines)
+        os.rename(tmp_path, self.index_path)
+
+    def find_index_line(self, key):
+        """
+        Find the line of the index for given URL key. If there are
+        multiple records of the URL then the most recent one is returned.
+        """
+
+        if self.index is None:
+            return None
+        index = self.index
+        # Binary search of the first line with the URL >= key
+        # `low` and `high` always point to the start of line
+        low, high = 0, len(index)
+        while low < high:
+            middle = (low + high) // 2
+            start = index.rfind('\n', 0, middle) + 1
+            end = index.find('\n', start)
+            if index[start:index.find(' ', start, end)] < key:
+                low = end + 1
+            else:
+                high = start
+        result = None
+        while low < len(index):
+            end = index.find('\n', low)
+            line = index[low:end]
+            if line.split(' ', 1)[0] != key:
+                break
+            result = line
+            low = end + 1
+        return result
+
+    def load_item(self, line):
+        url, timestamp, code, offset, length, fname = line.split(' ', 5)
+        headers, block = read_record(os.path.join(self.path, fname),
+                                     int(offset), int(length))
+        head, body = parse_http_response(block)
+        return {
+            'url': headers['WARC-Target-URI'],
+            'response_url': headers.get('WARC-Grab-Response-URL',
+                                        headers['WARC-Target-URI']),
+            'body': body,
+            'head': head,
+            'response_code': int(code),
+            'cookies': None,
+            'timestamp': int(timestamp),
+        }
+
+    def get_item(self, url):
+        """
+        Returned item should have specific interface. See module docstring.
+        """
+
+        line = self.find_index_line(build_key(url))
+        if line is None:
+            return None
+        return self.load_item(line)
+
+    def get_items(self, urls):
+        """
+        Load multiple items.
+
+        Returns dict which maps URL to the item. URLs which are not found
+        in the cache are not in the dict.
+        """
+
+        items = {}
+        for url in urls:
+            item = self.get_item(url)
+            if item is not None:
+                items[url] = item
+        return items
+
+    def iter_batches(self, start_key=None, batch_size=1000):
+        """
+        Iterate over all items in the order of the index.
+
+        Yields (key, items) pairs, `key` could be passed as `start_key`
+        argument to continue iteration after the last item of the batch.
+        If there are multiple records of the URL then only the most
+        recent one is returned.
+        """
+
+        if self.index is None:
+            return
+        index = self.index
+        position = start_key or 0
+        while position < len(index):
+            items = []
+            while position < len(index) and len(items) < batch_size:
+                end = index.find('\n', position)
+                line = index[position:end]
+                position = end + 1
+                # Lines of the same URL are sorted by time, the line
+                # is skipped if the next line has the same URL
+                key = line.split(' ', 1)[0] + ' '
+                if index[position:position + len(key)] == key:
+                    continue
+                items.append(self.load_item(line))
+            if items:
+                yield position, items
+
+    def count_items(self):
+        """
+        Return number of distinct URLs in the cache.
+        """
+
+        count = 0
+        last_key = None
+        with open(self.index_path) as inp:
+            for line in inp:
+                key = line.split(' ', 1)[0]
+                if key != last_key:
+                    count += 1
+                    last_key = key
+        return count
+
+    def load_response(self, grab, cache_item):
+        grab.fake_response(cache_item['body'])
+
+        def custom_prepare_response_func(transport, g):
+            response = Response()
+            response.head = cache_item['head']
+            response.body = cache_item['body']
+            response.code = cache_item['response_code']
+            response.time = 0
+            response.url = cache_item['response_url']
+            response.parse()
+            response.cookies = transport.extract_cookies()
+            return response
+
+        grab.process_request_result(custom_prepare_response_func)
+
+    def build_item(self, url, grab):
+        return None
+
+    def save_response(self, url, grab):
+        # The cache is read-only, new documents are saved into
+        # WARC files with `Spider.setup_warc`
+        pass
+
+    def save_items(self, items):
+        pass
+
+    def remove_cache_item(self, url):
+        # WARC files are not changed, the method exists for
+        # compatibility with other backends
+        logger.debug('WARC cache is read-only, item is not removed: %s' % url)
+
+    def evict(self, max_size):
+        return 0
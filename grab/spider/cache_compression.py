@@ -0,0 +1,239 @@
+"""
+Compression of cached documents with preset dictionaries.
+
+Pages of one site share most of their markup: headers, menus, footers,
+scripts. The compressor collects sample bodies for each host, builds
+a dictionary of the most common fragments and compresses further bodies
+of that host with the dictionary. The dictionary is stored in the cache
+database and each compressed body refers to it by `dict_id`.
+
+zlib module of python 2 does not support preset dictionaries (`zdict`
+argument appeared in python 3.3) so the dictionary is emulated: the
+deflate stream is primed with the dictionary data and flushed, then
+for each body the primed stream is copied and the body is compressed as
+continuation of the stream. Compressed body does not contain the
+dictionary, only back references to it.
+"""
+from __future__ import absolute_import
+from collections import deque
+from hashlib import sha1
+from urlparse import urlsplit
+import threading
+import zlib
+import re
+
+# Number of bodies of one host used to build its dictionary
+DICT_SAMPLE_NUMBER = 20
+# Only the beginning of the body is kept as the sample
+DICT_SAMPLE_SIZE = 32 * 1024
+# Max. number of hosts whose samples are collected at the same time and
+# max. total size of samples, samples of least recently seen hosts
+# are dropped when any limit is exceeded
+DICT_SAMPLE_HOSTS = 1000
+DICT_SAMPLE_MEMORY = 32 * 1024 * 1024
+# Max. size of dictionary, deflate can't refer to data which is more than
+# 32K bytes back, so larger dictionary is useless
+DICT_SIZE = 32 * 1024
+# Raw deflate stream without header and checksum
+WBITS = -15
+RE_FRAGMENT = re.compile(r'[^>\n]*[>\n]?')
+
+
+def build_dictionary(samples, size=DICT_SIZE):
+    """
+    Build the dictionary from the fragments which are found in
+    more than one sample.
+
+    Fragments are parts of document which end with a tag or a line.
+    Most useful fragments are placed at the end of the dictionary
+    because deflate encodes shorter distances with less bits.
+    """
+
+    counts = {}
+    for body in samples:
+        for fragment in set(RE_FRAGMENT.findall(body)):
+            if len(fragment) > 3:
+                counts[fragment] = counts.get(fragment, 0) + 1
+    fragments = [(count * len(fragment), fragment)
+                 for fragment, count in counts.iteritems() if count > 1]
+    fragments.sort(reverse=True)
+    result = []
+    total_size = 0
+    for score, fragment in fragments:
+        if total_size + len(fragment) > size:
+            continue
+        result.append(fragment)
+        total_size += len(fragment)
+    result.reverse()
+    return ''.join(result)
+
+
+class Dictionary(object):
+    """
+    Primed compression and decompression streams of the dictionary.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                           zlib.DEFLATED, WBITS)
+        primed = self.compressor.compress(data)
+        primed += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.decompressor = zlib.decompressobj(WBITS)
+        self.decompressor.decompress(primed)
+
+    def compress(self, body):
+        obj = self.compressor.copy()
+        return obj.compress(body) + obj.flush()
+
+    def decompress(self, data):
+        obj = self.decompressor.copy()
+        return obj.decompress(data) + obj.flush()
+
+    def decompressobj(self):
+        return self.decompressor.copy()
+
+
+class DictionaryCompressor(object):
+    """
+    Compress bodies with dictionaries trained for each host.
+
+    Bodies which are compressed before the dictionary of the host is built
+    are compressed with plain zlib, their `dict_id` is None.
+
+    The `storage` object should have methods:
+    * load_dictionary(dict_id) - return dictionary data or None
+    * find_dictionary(host) - return (dict_id, data) or None
+    * save_dictionary(dict_id, host, data)
+
+    Samples are kept for at most `sample_hosts` hosts and take at most
+    `sample_memory` bytes, on a broad crawl hosts which are rarely seen
+    lose their samples and start collecting them again.
+    """
+
+    def __init__(self, storage, sample_number=DICT_SAMPLE_NUMBER,
+                 dict_size=DICT_SIZE, sample_size=DICT_SAMPLE_SIZE,
+                 sample_hosts=DICT_SAMPLE_HOSTS,
+                 sample_memory=DICT_SAMPLE_MEMORY):
+        self.storage = storage
+        self.sample_number = sample_number
+        self.dict_size = dict_size
+        self.sample_size = sample_size
+        self.sample_hosts = sample_hosts
+        self.sample_memory = sample_memory
+        self.dictionaries = {}
+        self.host_dictionaries = {}
+        # Pending samples: {host: [body, ...]}
+        self.samples = {}
+        self.sample_bytes = 0
+        # Hosts in the order of last use: tick of the last sample of
+        # each host and queue of (tick, host) pairs, the pair is
+        # outdated if the host got another sample later
+        self.sample_ticks = {}
+        self.sample_queue = deque()
+        self.tick = 0
+        # Bodies are compressed in writer thread and decompressed
+        # in the main thread of the spider
+        self.lock = threading.Lock()
+
+    def get_dictionary(self, dict_id):
+        with self.lock:
+            try:
+                return self.dictionaries[dict_id]
+            except KeyError:
+                data = self.storage.load_dictionary(dict_id)
+                if data is None:
+                    raise KeyError('Unknown compression dictionary: %s'\
+                                   % dict_id)
+                dictionary = Dictionary(data)
+                self.dictionaries[dict_id] = dictionary
+                return dictionary
+
+    def get_host_dictionary(self, host):
+        """
+        Return (dict_id, Dictionary) pair for the host or (None, None)
+        if the dictionary is not built yet.
+        """
+
+        with self.lock:
+            if not host in self.host_dictionaries:
+                found = self.storage.find_dictionary(host)
+                if found is None:
+                    self.host_dictionaries[host] = None
+                else:
+                    dict_id, data = found
+                    self.dictionaries[dict_id] = Dictionary(data)
+                    self.host_dictionaries[host] = dict_id
+            dict_id = self.host_dictionaries[host]
+            if dict_id is None:
+                return None, None
+            else:
+                return dict_id, self.dictionaries[dict_id]
+
+    def add_sample(self, host, body):
+        sample = body[:self.sample_size]
+        with self.lock:
+            samples = self.samples.pop(host, [])
+            self.sample_ticks.pop(host, None)
+            samples.append(sample)
+            self.sample_bytes += len(sample)
+            if len(samples) < self.sample_number:
+                # The host is moved to the end of the queue
+                self.samples[host] = samples
+                self.tick += 1
+                self.sample_ticks[host] = self.tick
+                self.sample_queue.append((self.tick, host))
+                self.drop_stale_samples()
+                return
+            self.sample_bytes -= sum(len(x) for x in samples)
+        data = build_dictionary(samples, self.dict_size)
+        if data:
+            dict_id = sha1(data).hexdigest()
+            self.storage.save_dictionary(dict_id, host, data)
+            with self.lock:
+                self.dictionaries[dict_id] = Dictionary(data)
+                self.host_dictionaries[host] = dict_id
+
+    def drop_stale_samples(self):
+        while (len(self.samples) > self.sample_hosts or
+               self.sample_bytes > self.sample_memory):
+            tick, host = self.sample_queue.popleft()
+            if self.sample_ticks.get(host) == tick:
+                del self.sample_ticks[host]
+                samples = self.samples.pop(host)
+                self.sample_bytes -= sum(len(x) for x in samples)
+        if len(self.sample_queue) > 2 * len(self.samples) + 100:
+            self.sample_queue = deque(sorted(
+                (tick, host) for host, tick in self.sample_ticks.iteritems()))
+
+    def compress(self, url, body):
+        """
+        Compress the body of the document loaded from the `url`.
+
+        Returns (dict_id, data) pair.
+        """
+
+        host = urlsplit(url).hostname or ''
+        dict_id, dictionary = self.get_host_dictionary(host)
+        if dictionary is None:
+            self.add_sample(host, body)
+            return None, zlib.compress(body)
+        else:
+            return dict_id, dictionary.compress(body)
+
+    def decompress(self, dict_id, data):
+        if dict_id is None:
+            return zlib.decompress(data)
+        else:
+            return self.get_dictionary(dict_id).decompress(data)
+
+    def decompressobj(self, dict_id):
+        """
+        Return decompression object to decompress data which
+        is read by parts.
+        """
+
+        if dict_id is None:
+            return zlib.decompressobj()
+        else:
+            return self.get_dictionary(dict_id).decompressobj()
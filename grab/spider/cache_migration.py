@@ -0,0 +1,256 @@
+"""
+Copy all items from one cache backend into another.
+
+Library usage::
+
+    from grab.spider.cache_migration import open_cache, migrate_cache
+
+    source = open_cache('tokyo_cabinet', '/var/cache/crawl.tch')
+    destination = open_cache('mongo', 'crawl')
+    migrate_cache(source, destination, checkpoint_path='/tmp/crawl.json')
+
+Command line usage::
+
+    python -m grab.spider.cache_migration tokyo_cabinet:/var/cache/crawl.tch mongo:crawl
+
+Items are read from the source in batches. Batches are saved into the
+destination by multiple threads: compression (zlib releases GIL) and
+database queries of different batches run in parallel.
+
+If `checkpoint_path` is given then the key of the last saved batch is
+written into that file, and the next call with the same checkpoint
+continues from that batch. Batches are saved in arbitrary order, the
+checkpoint is moved only when all previous batches are saved. After
+the restart a few batches could be saved again, that is harmless because
+items are replaced by URL.
+"""
+from __future__ import absolute_import
+from optparse import OptionParser
+import threading
+import logging
+import Queue
+import json
+import os
+
+from grab.tools.progress import Progress
+
+logger = logging.getLogger('grab.spider.cache_migration')
+BATCH_SIZE = 1000
+THREAD_NUMBER = 4
+STOP = object()
+
+
+def open_cache(backend, database, use_compression=True, **kwargs):
+    """
+    Create instance of cache backend outside of spider.
+    """
+
+    mod = __import__('grab.spider.cache_backend.%s' % backend,
+                     globals(), locals(), ['foo'])
+    return mod.CacheBackend(database=database, use_compression=use_compression,
+                            spider=DummySpider(), **kwargs)
+
+
+class DummySpider(object):
+    """
+    Cache backends use timers of the spider, this object
+    provides no-op timers.
+    """
+
+    def save_timer(self, key):
+        return NullTimer()
+
+
+class NullTimer(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+class Checkpoint(object):
+    """
+    Track saved batches and store the key of the last batch
+    which is saved together with all previous batches.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.key = None
+        self.count = 0
+        self.done = {}
+        self.next_number = 0
+        if path and os.path.exists(path):
+            with open(path) as inp:
+                data = json.load(inp)
+            self.key = data['key']
+            self.count = data['count']
+
+    def add(self, number, key, count):
+        """
+        Mark the batch with given sequence number as saved.
+        """
+
+        self.done[number] = (key, count)
+        changed = False
+        while self.next_number in self.done:
+            key, count = self.done.pop(self.next_number)
+            self.key = key
+            self.count += count
+            self.next_number += 1
+            changed = True
+        if changed:
+            self.save()
+
+    def save(self):
+        if self.path:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as out:
+                json.dump({'key': self.key, 'count': self.count}, out)
+            os.rename(tmp_path, self.path)
+
+
+def save_worker(destination, task_queue, result_queue):
+    while True:
+        task = task_queue.get()
+        if task is STOP:
+            break
+        number, key, items = task
+        try:
+            destination.save_items(items)
+        except Exception, ex:
+            logger.error('Could not save batch of items', exc_info=ex)
+            result_queue.put((number, key, None))
+        else:
+            result_queue.put((number, key, len(items)))
+
+
+def migrate_cache(source, destination, batch_size=BATCH_SIZE,
+                  thread_number=THREAD_NUMBER, checkpoint_path=None):
+    """
+    Copy all items from `source` cache backend into `destination`.
+
+    Returns number of copied items (including items copied before
+    the checkpoint).
+    """
+
+    checkpoint = Checkpoint(checkpoint_path)
+    if checkpoint.key is not None:
+        logger.info('Continue from checkpoint, %d items are already copied'\
+                    % checkpoint.count)
+    total = source.count_items()
+    progress = Progress(step=batch_size, total=total, name='items',
+                        level=logging.INFO)
+    progress.count = checkpoint.count
+
+    task_queue = Queue.Queue(thread_number * 2)
+    result_queue = Queue.Queue()
+    workers = []
+    for x in xrange(thread_number):
+        th = threading.Thread(target=save_worker,
+                              args=[destination, task_queue, result_queue])
+        th.daemon = True
+        th.start()
+        workers.append(th)
+
+    errors = []
+
+    def process_result(number, key, count):
+        if count is None:
+            errors.append(number)
+        else:
+            checkpoint.add(number, key, count)
+            for x in xrange(count):
+                progress.tick()
+
+    try:
+        batches = source.iter_batches(start_key=checkpoint.key,
+                                      batch_size=batch_size)
+        for number, (key, items) in enumerate(batches):
+            while True:
+                try:
+                    process_result(*result_queue.get(False))
+                except Queue.Empty:
+                    break
+            if errors:
+                break
+            task_queue.put((number, key, items))
+    finally:
+        for th in workers:
+            task_queue.put(STOP)
+        for th in workers:
+            th.join()
+    while True:
+        try:
+            process_result(*result_queue.get(False))
+        except Queue.Empty:
+            break
+    if errors:
+        raise RuntimeError('Could not save %d batches, run migration again '\
+                           'to continue from the checkpoint' % len(errors))
+    return checkpoint.count
+
+
+def parse_cache_url(url):
+    """
+    Parse "backend:database" string.
+    """
+
+    if not ':' in url:
+        raise ValueError('Cache should be specified as backend:database')
+    return url.split(':', 1)
+
+
+def parse_options(values):
+    """
+    Convert list of "key=value" strings into dict.
+
+    Numeric values are converted to integers.
+    """
+
+    options = {}
+    for value in values or []:
+        key, value = value.split('=', 1)
+        if value.isdigit():
+            value = int(value)
+        options[key] = value
+    return options
+
+
+def main():
+    parser = OptionParser(usage='%prog [options] SOURCE DESTINATION\n\n'
+                          'SOURCE and DESTINATION are backend:database '
+                          'strings, e.g. mongo:crawl')
+    parser.add_option('-b', '--batch-size', type='int', default=BATCH_SIZE)
+    parser.add_option('-t', '--threads', type='int', default=THREAD_NUMBER)
+    parser.add_option('-c', '--checkpoint',
+                      help='File to save the progress of migration')
+    parser.add_option('--compression', default='on',
+                      help='Compression in destination: on, off or dict')
+    parser.add_option('--source-option', action='append',
+                      help='key=value option of source backend')
+    parser.add_option('--destination-option', action='append',
+                      help='key=value option of destination backend')
+    opts, args = parser.parse_args()
+    if len(args) != 2:
+        parser.error('Source and destination are required')
+    logging.basicConfig(level=logging.INFO)
+
+    backend, database = parse_cache_url(args[0])
+    source = open_cache(backend, database,
+                        **parse_options(opts.source_option))
+    use_compression = {'on': True, 'off': False}.get(opts.compression,
+                                                      opts.compression)
+    backend, database = parse_cache_url(args[1])
+    destination = open_cache(backend, database,
+                             use_compression=use_compression,
+                             **parse_options(opts.destination_option))
+    count = migrate_cache(source, destination, batch_size=opts.batch_size,
+                          thread_number=opts.threads,
+                          checkpoint_path=opts.checkpoint)
+    logger.info('Copied %d items' % count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Background writer which saves responses into the cache backend.
+
+Compression of the response body and the database query are performed
+in separate thread so they do not block the network loop of the spider.
+"""
+from __future__ import absolute_import
+import logging
+import threading
+import Queue
+
+logger = logging.getLogger('grab.spider.cache_writer')
+
+# Max. number of items waiting to be saved
+# If the queue is full then spider waits for free slot
+WRITE_QUEUE_SIZE = 1000
+# Max. number of items saved with one database query
+WRITE_BATCH_SIZE = 100
+STOP = object()
+
+
+class CacheWriter(threading.Thread):
+    def __init__(self, cache, queue_size=WRITE_QUEUE_SIZE,
+                 batch_size=WRITE_BATCH_SIZE, max_size=None,
+                 evict_interval=None):
+        """
+        Arguments:
+        * cache - the cache backend, it should have `save_items` method
+        * queue_size - max. number of items waiting to be saved
+        * batch_size - max. number of items saved at once
+        * max_size - if it is not None then oldest items are removed
+            with `evict` method of the cache to fit it into `max_size`
+            bytes after each `evict_interval` saved items
+        """
+
+        super(CacheWriter, self).__init__()
+        self.daemon = True
+        self.cache = cache
+        self.queue = Queue.Queue(queue_size)
+        self.batch_size = batch_size
+        self.max_size = max_size
+        self.evict_interval = evict_interval
+        self.saved_count = 0
+        self.error_count = 0
+        self.evicted_count = 0
+        self.last_evict_count = 0
+
+    def put(self, item):
+        """
+        Add the cache item to the write queue.
+
+        Blocks if the queue is full.
+        """
+
+        self.queue.put(item)
+
+    def run(self):
+        while True:
+            batch = []
+            stop = False
+            item = self.queue.get()
+            while True:
+                if item is STOP:
+                    stop = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get(False)
+                except Queue.Empty:
+                    break
+            if batch:
+                self.save_batch(batch)
+            if stop:
+                break
+
+    def save_batch(self, batch):
+        try:
+            self.cache.save_items(batch)
+        except Exception, ex:
+            self.error_count += len(batch)
+            logger.error('Could not save %d items into cache' % len(batch),
+                         exc_info=ex)
+        else:
+            self.saved_count += len(batch)
+            if self.max_size is not None and\
+                    self.saved_count - self.last_evict_count >=\
+                    self.evict_interval:
+                self.evict()
+
+    def evict(self):
+        self.last_evict_count = self.saved_count
+        try:
+            self.evicted_count += self.cache.evict(self.max_size)
+        except Exception, ex:
+            logger.error('Could not remove old items from cache', exc_info=ex)
+
+    def stop(self):
+        """
+        Save all items remaining in the queue and stop the thread.
+        """
+
+        self.queue.put(STOP)
+        self.join()
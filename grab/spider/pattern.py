@@ -1,11 +1,20 @@
 from __future__ import absolute_import
 import os.path
 import logging
+import tempfile
+import shutil
+from urlparse import urlsplit
+
+from lxml.etree import XMLSyntaxError
 
 from .task import Task
+from ..error import GrabError
 from ..tools.files import hashed_path
+from ..tools.sitemap import find_robots_sitemaps, open_sitemap, iter_sitemap
 
 logger = logging.getLogger('grab.spider.pattern')
+# Maximum level of nested sitemap indexes
+SITEMAP_MAX_DEPTH = 5
 
 class SpiderPattern(object):
     """
@@ -86,6 +95,96 @@ class SpiderPattern(object):
                 if limit is not None and count >= limit:
                     break
 
+    def iter_sitemap_tasks(self, task_name, url, since=None, **kwargs):
+        """
+        Generate tasks for pages listed in sitemaps.
+
+        Arguments:
+        * task_name - name of generated tasks
+        * url - URL of robots.txt file, sitemap or sitemap index,
+            sitemaps could be gzipped
+        * since - `datetime` in UTC timezone, pages and nested sitemaps
+            which were modified before that time are skipped
+        * kwargs - extra arguments for `Task` constructor
+
+        Designed to be used in `task_generator`: each sitemap is saved
+        into the temporary file and parsed on the fly, so the task is
+        created only when the spider needs new tasks and the full list
+        of URLs is never kept in memory. Sitemaps are downloaded in the
+        main thread of the spider.
+
+        Example::
+
+            def task_generator(self):
+                for task in self.iter_sitemap_tasks(
+                        'page', 'http://example.com/robots.txt'):
+                    yield task
+        """
+
+        for page_url in self.iter_sitemap_urls(url, since=since):
+            yield Task(task_name, url=page_url, **kwargs)
+
+    def iter_sitemap_urls(self, url, since=None):
+        """
+        Iterate over URLs of pages listed in sitemaps.
+
+        See `iter_sitemap_tasks` for description of arguments.
+        """
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            if urlsplit(url).path == '/robots.txt':
+                grab = self.create_grab_instance()
+                try:
+                    grab.go(url)
+                except GrabError, ex:
+                    logger.error('Could not load %s: %s' % (url, ex))
+                    return
+                sitemap_urls = find_robots_sitemaps(grab.response.body)
+            else:
+                sitemap_urls = [url]
+            for sitemap_url in sitemap_urls:
+                for page_url in self.iter_sitemap_file(sitemap_url, since,
+                                                       tmp_dir):
+                    yield page_url
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def iter_sitemap_file(self, url, since, tmp_dir, depth=0):
+        if depth > SITEMAP_MAX_DEPTH:
+            logger.error('Sitemap %s is nested too deep' % url)
+            return
+        grab = self.create_grab_instance()
+        # Files of parent sitemaps are still read
+        grab.setup(body_inmemory=False, body_storage_dir=tmp_dir,
+                   body_storage_filename='sitemap-%d' % depth)
+        try:
+            grab.go(url)
+        except GrabError, ex:
+            logger.error('Could not load sitemap %s: %s' % (url, ex))
+            return
+        if grab.response.code != 200:
+            logger.error('Could not load sitemap %s: HTTP code %d'
+                         % (url, grab.response.code))
+            return
+        self.inc_count('sitemap')
+
+        inp = open_sitemap(grab.response.body_path)
+        try:
+            for kind, loc, lastmod in iter_sitemap(inp):
+                if since and lastmod and lastmod < since:
+                    continue
+                if kind == 'sitemap':
+                    for page_url in self.iter_sitemap_file(loc, since, tmp_dir,
+                                                           depth + 1):
+                        yield page_url
+                else:
+                    yield loc
+        except (XMLSyntaxError, IOError), ex:
+            logger.error('Could not parse sitemap %s: %s' % (url, ex))
+        finally:
+            inp.close()
+
     # Deprecated methods
 
     def next_page_task(self, grab, task, xpath, **kwargs):
@@ -0,0 +1,205 @@
+"""
+Parallel processing of cached documents.
+
+When task handlers are changed, the spider could be run again with
+`only_cache=True` option to parse the documents which are already in
+the cache. That work is limited by CPU (decompression, parsing of
+response, building of DOM tree, handlers) and the usual spider does it
+in one process. The replay mode processes tasks in multiple processes::
+
+    bot = SomeSpider()
+    bot.setup_cache(backend='mongo', database='crawl')
+    bot.run_replay(process_number=4)
+
+The main process keeps the task queue of the spider (the frontier):
+it runs `initial_urls` and `task_generator`, takes tasks from the queue
+in chunks and sends them to worker processes. Each worker is a fork of
+the spider, it opens its own connection to the cache, loads documents of
+the chunk with one query and calls task handlers directly, without the
+network transport loop. New tasks yielded by handlers are sent back
+to the main process and are added into the task queue, so any task is
+processed by the first free worker.
+
+Data handlers and middlewares are called in the workers. Counters,
+timers and lists (see `Spider.add_item`) of the workers are merged into
+the spider object of the main process when the work is done; any other
+changes of the spider state made by handlers in the workers are not
+visible in the main process.
+"""
+from __future__ import absolute_import
+from multiprocessing import Process, Queue as ProcessQueue, cpu_count
+from collections import defaultdict
+import traceback
+import logging
+import Queue
+
+from .error import SpiderError, SpiderMisuseError
+from .task import NullTask
+from .transport.multicurl import MulticurlTransport
+
+logger = logging.getLogger('grab.spider.replay')
+# Number of tasks sent to the worker at once
+REPLAY_CHUNK_SIZE = 20
+RESULT_TIMEOUT = 1
+
+
+def replay_worker(spider, task_queue, result_queue):
+    """
+    Process chunks of tasks with documents from the cache.
+
+    Sends ('tasks', list) message for each processed chunk and
+    ('stats', dict) message when the work is done.
+    """
+
+    try:
+        # Database connections of the main process should not be
+        # shared with forked process
+        spider.cache = spider.create_cache_backend()
+        spider.transport = MulticurlTransport(1)
+        spider.counters = defaultdict(int)
+        spider.timers = {}
+        spider.items = {}
+        new_tasks = []
+        spider.add_task_handler = new_tasks.append
+
+        while True:
+            chunk = task_queue.get()
+            if chunk is None:
+                break
+            urls = [x.url for x in chunk if spider.is_task_prefetchable(x)]
+            with spider.save_timer('cache'):
+                with spider.save_timer('cache.prefetch'):
+                    items = spider.cache.get_items(urls)
+            spider.cache_prefetched = dict((x, items.get(x)) for x in urls)
+            for task in chunk:
+                spider.process_task_counters(task)
+                if spider.check_task_limits(task):
+                    hits = spider.counters['request-cache']
+                    spider.process_new_task(task)
+                    if spider.counters['request-cache'] == hits:
+                        spider.inc_count('replay-cache-miss')
+            result_queue.put(('tasks', new_tasks[:]))
+            del new_tasks[:]
+
+        result_queue.put(('stats', {'counters': dict(spider.counters),
+                                    'timers': spider.timers,
+                                    'items': spider.items}))
+    except Exception:
+        result_queue.put(('error', traceback.format_exc()))
+
+
+def load_chunk(spider, size):
+    """
+    Take up to `size` tasks from the task queue of the spider.
+    """
+
+    chunk = []
+    while len(chunk) < size:
+        spider.process_task_generator()
+        try:
+            task = spider.taskq.get(0)
+        except Queue.Empty:
+            break
+        if not isinstance(task, NullTask):
+            chunk.append(task)
+    return chunk
+
+
+def merge_stats(spider, stats):
+    for key, value in stats['counters'].iteritems():
+        spider.counters[key] += value
+    for key, value in stats['timers'].iteritems():
+        spider.timers[key] = spider.timers.get(key, 0) + value
+    for key, value in stats['items'].iteritems():
+        spider.items.setdefault(key, []).extend(value)
+
+
+def replay_cache(spider, process_number=None, chunk_size=REPLAY_CHUNK_SIZE):
+    """
+    Process all tasks of the spider with documents from the cache
+    in `process_number` processes (number of CPUs by default).
+    """
+
+    if not spider.cache_enabled:
+        raise SpiderMisuseError('Cache should be configured to replay it. '
+                                'Use `setup_cache` method.')
+    process_number = process_number or cpu_count()
+    spider.only_cache = True
+    spider.start_timer('total')
+    spider.setup_default_queue()
+    spider.prepare()
+    spider.init_task_generators()
+
+    task_queue = ProcessQueue()
+    result_queue = ProcessQueue()
+    workers = []
+    for x in xrange(process_number):
+        worker = Process(target=replay_worker,
+                         args=[spider, task_queue, result_queue])
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+
+    running = len(workers)
+    errors = []
+
+    def get_message():
+        while True:
+            try:
+                return result_queue.get(True, RESULT_TIMEOUT)
+            except Queue.Empty:
+                if not any(x.is_alive() for x in workers):
+                    raise SpiderError('Replay worker processes have died')
+
+    def process_message(message):
+        kind, data = message
+        if kind == 'tasks':
+            spider.inc_count('replay-chunk')
+            for task in data:
+                spider.add_task_handler(task)
+        elif kind == 'stats':
+            merge_stats(spider, data)
+        elif kind == 'error':
+            errors.append(data)
+
+    try:
+        # Number of chunks which are sent to workers and are not
+        # processed yet
+        pending = 0
+        while not errors:
+            # Keep the workers busy while the main process
+            # handles results of other chunks
+            while pending < process_number * 2:
+                chunk = load_chunk(spider, chunk_size)
+                if not chunk:
+                    break
+                task_queue.put(chunk)
+                pending += 1
+            if not pending:
+                break
+            message = get_message()
+            if message[0] == 'tasks':
+                pending -= 1
+            elif message[0] == 'error':
+                running -= 1
+            process_message(message)
+    finally:
+        for worker in workers:
+            task_queue.put(None)
+        while running:
+            try:
+                message = get_message()
+            except SpiderError:
+                break
+            if message[0] in ('stats', 'error'):
+                running -= 1
+            process_message(message)
+        for worker in workers:
+            worker.join()
+        spider.stop_timer('total')
+        spider.shutdown()
+
+    if errors:
+        logger.error(errors[0])
+        raise SpiderError('Replay worker failed: %s'
+                          % errors[0].strip().splitlines()[-1])
@@ -2,6 +2,7 @@ from __future__ import absolute_import
 import logging
 import time
 from grab.base import GLOBAL_STATE
+from grab.selector.query import QUERY_REGISTRY
 from grab.tools.encoding import smart_str
 import os
 from contextlib import contextmanager
@@ -62,6 +63,9 @@ class SpiderStat(object):
         else:
             out.append('Queue size: %d' % self.taskq.size())
         out.append('Threads: %d' % self.thread_number)
+        stats = QUERY_REGISTRY.stats()
+        out.append('Query cache: %d queries, hit ratio %.2f' % (
+            stats['size'], stats['ratio']))
         out.append('Timers:')
         out.append('  DOM: %.3f' % GLOBAL_STATE['dom_build_time'])
         out.append('  selector: %.03f' % GLOBAL_STATE['selector_time'])
@@ -1,6 +1,9 @@
+import codecs
 import re
 
 RE_SPECIAL_ENTITY = re.compile('&#(1[2-6][0-9]);')
+ALL_BYTES = ''.join(chr(x) for x in xrange(256))
+BYTE_SEARCHABLE_CACHE = {}
 
 def smart_str(value, encoding='utf-8'):
     """
@@ -34,4 +37,55 @@ def special_entity_handler(match):
 
 
 def fix_special_entities(body):
+    # Substring search is much faster than regexp
+    if not '&#1' in body:
+        return body
     return RE_SPECIAL_ENTITY.sub(special_entity_handler, body)
+
+
+def is_single_byte_charset(name):
+    """
+    Return True if each byte is decoded into one char and each char
+    which could be encoded in the charset is encoded into one byte.
+    """
+
+    if len(ALL_BYTES.decode(name, 'replace')) != 256:
+        return False
+    # All chars of Basic Multilingual Plane except surrogates
+    chars = u''.join(unichr(x) for x in xrange(0x10000)
+                     if not 0xd800 <= x < 0xe000)
+    data = chars.encode(name, 'ignore')
+    return len(data.decode(name)) == len(data)
+
+
+def is_byte_searchable(charset):
+    """
+    Return True if the text in the `charset` could be searched as
+    bytes: the encoded substring is found in the encoded text only
+    where the substring is found in the text.
+
+    It is true for UTF-8 and for charsets which encode each char into
+    one byte. It is false for UTF-16 and multi-byte charsets like
+    Shift_JIS where bytes of one char could be found inside another one,
+    and for stateful charsets like ISO-2022-JP where the encoded
+    substring starts with its own escape sequence.
+    """
+
+    try:
+        return BYTE_SEARCHABLE_CACHE[charset]
+    except KeyError:
+        pass
+    try:
+        name = codecs.lookup(charset).name
+    except LookupError:
+        result = False
+    else:
+        if name == 'utf-8':
+            result = True
+        else:
+            try:
+                result = is_single_byte_charset(name)
+            except Exception:
+                result = False
+    BYTE_SEARCHABLE_CACHE[charset] = result
+    return result
@@ -115,3 +115,56 @@ def escape(html):
                .replace('>', '&gt;')\
                .replace('"', '&quot;')\
                .replace("'", '&#39;')
+
+
+SIMPLIFY_TARGETS = ('script', 'style', 'comment')
+SIMPLIFY_REGEXPS = {}
+
+
+def build_block_pattern(tag, allow_empty=False):
+    """
+    Build regular expression which matches the element with its content.
+
+    Tag name is matched case insensitively with character classes
+    instead of `re.I` flag: with the flag the regular expression engine
+    could not quickly skip text to the next "<" character.
+    """
+
+    name = ''.join('[%s%s]' % (x.lower(), x.upper()) for x in tag)
+    pattern = r'<%s(?=[\s>/])[^>]*>.*?</%s\s*>' % (name, name)
+    if allow_empty:
+        pattern = r'<%s(?=[\s>/])[^>]*?/>|' % name + pattern
+    return pattern
+
+
+SIMPLIFY_PATTERNS = {
+    'comment': r'<!--.*?-->',
+    'script': build_block_pattern('script'),
+    'style': build_block_pattern('style'),
+    # Empty svg element could be self-closing
+    'svg': build_block_pattern('svg', allow_empty=True),
+}
+
+
+def simplify_html(html, targets=SIMPLIFY_TARGETS):
+    """
+    Remove blocks which are not needed to extract data from the document.
+
+    Arguments:
+    * html - byte or unicode string with HTML code
+    * targets - what should be removed: "script", "style",
+        "comment" and "svg"
+
+    All targets are searched with one regular expression, so for
+    example the script which is commented out is removed as a part of
+    the comment. Blocks which are not closed are left as is.
+    """
+
+    key = tuple(sorted(targets))
+    try:
+        regexp = SIMPLIFY_REGEXPS[key]
+    except KeyError:
+        regexp = re.compile('|'.join(SIMPLIFY_PATTERNS[x] for x in key),
+                            re.S)
+        SIMPLIFY_REGEXPS[key] = regexp
+    return regexp.sub('', html)
@@ -3,12 +3,20 @@ Functions to process content of lxml nodes.
 """
 import re
 
+from lxml.etree import XPath
+
 from .text import normalize_space as normalize_space_func, find_number
 from .encoding import smart_str, smart_unicode
 
 RE_TAG_START = re.compile(r'<[a-z]')
+SMART_TEXT_XPATH = XPath(
+    './descendant-or-self::*[name() != "script" and '
+    'name() != "style"]/text()[normalize-space()]')
+# Same query is used by text_content() method of lxml.html elements,
+# it also works for nodes of tree built with lxml.etree.fromstring
+TEXT_CONTENT_XPATH = XPath('string()')
 
-def get_node_text(node, smart=False, normalize_space=True):
+def get_node_text(node, smart=False, normalize_space=True, memo=None):
     """
     Extract text content of the `node` and all its descendants.
 
@@ -17,6 +25,9 @@ def get_node_text(node, smart=False, normalize_space=True):
 
     In non-smart mode this func just return text_content() of node
     with normalized spaces
+
+    If `memo` dict is given then the text is saved in it and is not
+    extracted again when the text of the same node is requested.
     """
 
     # If xpath return a attribute value, it value will be string not a node
@@ -25,19 +36,22 @@ def get_node_text(node, smart=False, normalize_space=True):
             node = normalize_space_func(node)
         return node
 
+    if memo is not None:
+        key = (node, smart, normalize_space)
+        try:
+            return memo[key]
+        except KeyError:
+            pass
+
     if smart:
-        value = ' '.join(node.xpath(
-            './descendant-or-self::*[name() != "script" and '\
-            'name() != "style"]/text()[normalize-space()]'))
+        value = ' '.join(SMART_TEXT_XPATH(node))
     else:
-        # If DOM tree was built with lxml.etree.fromstring
-        # then tree nodes do not have text_content() method
-        try:
-            value = node.text_content()
-        except AttributeError:
-            value = ''.join(node.xpath('.//text()'))
+        value = TEXT_CONTENT_XPATH(node)
     if normalize_space:
         value = normalize_space_func(value)
+
+    if memo is not None:
+        memo[key] = value
     return value
 
 def find_node_number(node, ignore_spaces=False, make_int=True):
@@ -71,6 +85,53 @@ def parse_html(html, encoding='utf-8'):
     return lxml.html.fromstring(html, parser=parser)
 
 
+def iterxml(source, tag):
+    """
+    Iterate over elements of XML document without building the full tree.
+
+    Arguments:
+    * source - path to the file or file-like object
+    * tag - name of the elements to yield (or list of names), the name
+        could be given with namespace like "{*}loc"
+
+    Each element is yielded when its end tag is parsed, so all its
+    children are available. Elements which precede the yielded one
+    are removed from the tree and the element is cleared when the next
+    one is requested, so the memory usage does not depend on the size
+    of the document. Do not keep references to yielded elements, save
+    extracted data instead. If yielded elements are nested into each
+    other then the content of the outer one is kept until its end tag.
+
+    Entities declared in the document are not expanded.
+    """
+    from lxml.etree import iterparse
+
+    # Number of yielded elements which are open at the moment,
+    # their content should be kept until their end tags
+    depth = 0
+    # External entities are not loaded: the document could be
+    # downloaded from the untrusted site
+    for event, elem in iterparse(source, events=('start', 'end'), tag=tag,
+                                 resolve_entities=False, no_network=True):
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth:
+            yield elem
+        else:
+            # Everything before the element is processed already
+            node = elem
+            parent = node.getparent()
+            while parent is not None:
+                while node.getprevious() is not None:
+                    del parent[0]
+                node = parent
+                parent = node.getparent()
+            yield elem
+            elem.clear()
+
+
 def render_html(node, encoding='utf-8', make_unicode=False):
     """
     Render Element node.
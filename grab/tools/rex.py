@@ -1,5 +1,8 @@
 from __future__ import absolute_import
+import heapq
 import re
+import sre_parse
+import sre_constants
 
 from ..error import DataNotFound
 from .text import normalize_space
@@ -85,3 +88,122 @@ def rex_text_list(body, rex, flags=0):
     for match in rex_list(body, rex, flags=flags):
         items.append(normalize_space(decode_entities(match.group(1))))
     return items
+
+
+
+def get_literal_prefix(regexp):
+    """
+    Return the literal text which every match of compiled regexp
+    starts with. Return empty string if there is no such text.
+    """
+
+    if regexp.flags & re.I:
+        return ''
+    if isinstance(regexp.pattern, unicode):
+        to_char = unichr
+    else:
+        to_char = chr
+    chars = []
+    for op, value in sre_parse.parse(regexp.pattern, regexp.flags).data:
+        if op != sre_constants.LITERAL:
+            break
+        chars.append(to_char(value))
+    return ''.join(chars)
+
+
+class RexScanner(object):
+    """
+    Set of named regular expressions which are searched in the text
+    with one call.
+
+    Arguments:
+    * patterns - dict or list of (name, regexp) pairs, the regexp could
+        be the string or compiled regular expression
+    * flags - flags which are used to compile string regexps
+
+    The scanner should be created once, e.g. on module level, and then
+    used for each document. The literal text which the regexp starts
+    with is found with fast substring search, so regexps of markers
+    which are absent in the document do not scan it.
+
+    Example::
+
+        >>> SCANNER = RexScanner({'captcha': r'captcha\.png',
+        ...                       'price': r'price: (\d+)'})
+        >>> SCANNER.scan(grab.response.unicode_body())
+        {'captcha': [], 'price': [<_sre.SRE_Match object at ...>]}
+    """
+
+    def __init__(self, patterns, flags=0):
+        if isinstance(patterns, dict):
+            patterns = sorted(patterns.items())
+        self.names = [name for name, regexp in patterns]
+        self.regexps = [normalize_regexp(regexp, flags)
+                        for name, regexp in patterns]
+        self.prefixes = [get_literal_prefix(x) for x in self.regexps]
+
+    def find_start(self, index, body):
+        """
+        Return position of the first possible match of the regexp or -1
+        if the regexp could not be found in the body.
+        """
+
+        prefix = self.prefixes[index]
+        if not prefix:
+            return 0
+        # Byte regexp matches unicode text char by char and vice versa
+        if isinstance(body, unicode):
+            if not isinstance(prefix, unicode):
+                prefix = prefix.decode('latin-1')
+        elif isinstance(prefix, unicode):
+            try:
+                prefix = prefix.encode('latin-1')
+            except UnicodeEncodeError:
+                return -1
+        return body.find(prefix)
+
+    def iter_regexp(self, index, body):
+        start = self.find_start(index, body)
+        if start != -1:
+            for match in self.regexps[index].finditer(body, start):
+                yield match.start(), index, match
+
+    def finditer(self, body):
+        """
+        Iterate over matches of all regexps in the order of position.
+
+        Yields (name, match) tuples.
+        """
+
+        iterators = [self.iter_regexp(x, body)
+                     for x in xrange(len(self.regexps))]
+        for start, index, match in heapq.merge(*iterators):
+            yield self.names[index], match
+
+    def scan(self, body):
+        """
+        Return dict with list of matches for each regexp.
+        """
+
+        result = {}
+        for index, name in enumerate(self.names):
+            start = self.find_start(index, body)
+            if start == -1:
+                result[name] = []
+            else:
+                result[name] = list(self.regexps[index].finditer(body, start))
+        return result
+
+    def search(self, body):
+        """
+        Return dict with first match of each found regexp.
+        """
+
+        result = {}
+        for index, name in enumerate(self.names):
+            start = self.find_start(index, body)
+            if start != -1:
+                match = self.regexps[index].search(body, start)
+                if match:
+                    result[name] = match
+        return result
@@ -0,0 +1,86 @@
+"""
+Functions to process sitemap files.
+
+See the protocol description at http://www.sitemaps.org/protocol.html
+"""
+from __future__ import absolute_import
+from datetime import datetime, timedelta
+import gzip
+import re
+
+from .lxml_tools import iterxml
+
+RE_LASTMOD = re.compile(r'''
+    ^(\d{4})(?:-(\d{2})(?:-(\d{2})
+    (?:T(\d{2}):(\d{2})(?::(\d{2})(?:\.\d+)?)?
+    (Z|[+-]\d{2}:\d{2})?)?)?)?$
+''', re.X)
+RE_ROBOTS_SITEMAP = re.compile(r'^\s*sitemap\s*:\s*(\S+)', re.I | re.M)
+GZIP_MAGIC = '\x1f\x8b'
+
+
+def parse_lastmod(value):
+    """
+    Convert the value of lastmod field into `datetime` object.
+
+    The value should be in W3C Datetime format, e.g. "2013-01-07" or
+    "2013-01-07T12:30:00+04:00". Returned datetime is in UTC timezone
+    and has no tzinfo. Returns None if the value could not be parsed.
+    """
+
+    match = RE_LASTMOD.match((value or '').strip())
+    if not match:
+        return None
+    year, month, day, hour, minute, second, zone = match.groups()
+    try:
+        date = datetime(int(year), int(month or 1), int(day or 1),
+                        int(hour or 0), int(minute or 0), int(second or 0))
+    except ValueError:
+        return None
+    if zone and zone != 'Z':
+        offset = timedelta(hours=int(zone[1:3]), minutes=int(zone[4:6]))
+        if zone[0] == '+':
+            date -= offset
+        else:
+            date += offset
+    return date
+
+
+def find_robots_sitemaps(body):
+    """
+    Return list of sitemap URLs from the content of robots.txt file.
+    """
+
+    return RE_ROBOTS_SITEMAP.findall(body)
+
+
+def open_sitemap(path):
+    """
+    Open the sitemap file, gzipped file is decompressed on the fly.
+    """
+
+    with open(path, 'rb') as inp:
+        magic = inp.read(2)
+    if magic == GZIP_MAGIC:
+        return gzip.open(path, 'rb')
+    else:
+        return open(path, 'rb')
+
+
+def iter_sitemap(source):
+    """
+    Iterate over entries of the sitemap or the sitemap index.
+
+    Arguments:
+    * source - path to the file or file-like object
+
+    Yields tuples (kind, loc, lastmod) where kind is "url" for
+    the page and "sitemap" for the nested sitemap, lastmod is
+    `datetime` object or None. The file is parsed in constant memory.
+    """
+
+    for elem in iterxml(source, ['{*}url', '{*}sitemap']):
+        loc = (elem.findtext('{*}loc') or '').strip()
+        if loc:
+            kind = 'sitemap' if elem.tag.endswith('sitemap') else 'url'
+            yield kind, loc, parse_lastmod(elem.findtext('{*}lastmod'))
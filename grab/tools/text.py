@@ -51,7 +51,9 @@ def normalize_space(text, replace=' '):
     Also drop leading and trailing space-chars.
     """
 
-    return RE_SPACE.sub(replace, text.strip()).strip()
+    # Splitting is done in one pass and, unlike the regexp with re.U
+    # flag, does not treat bytes of UTF-8 chars like \xa0 as spaces
+    return replace.join(text.split())
 
 
 def remove_bom(text):
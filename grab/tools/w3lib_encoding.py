@@ -13,15 +13,16 @@ _HEADER_ENCODING_RE = re.compile(r'charset=([\w-]+)', re.I)
 
 # regexp for parsing HTTP meta tags
 _TEMPLATE = r'''%s\s*=\s*["']?\s*%s\s*["']?'''
-_HTTPEQUIV_RE = _TEMPLATE % ('http-equiv', 'Content-Type')
-_CONTENT_RE = _TEMPLATE % ('content', r'(?P<mime>[^;]+);\s*charset=(?P<charset>[\w-]+)')
-_CONTENT2_RE = _TEMPLATE % ('charset', r'(?P<charset2>[\w-]+)')
+# Charset is taken from any meta tag which mentions it: <meta charset>
+# or content attribute of the meta tag, the http-equiv attribute
+# is optional and the attributes could go in any order
+_META_CHARSET_RE = r'''meta\s[^>]*?charset\s*=\s*["']?\s*(?P<charset>[\w-]+)'''
 _XML_ENCODING_RE = _TEMPLATE % ('encoding', r'(?P<xmlcharset>[\w-]+)')
 
 # check for meta tags, or xml decl. and stop search if a body tag is encountered
 _BODY_ENCODING_RE = re.compile(
-    r'<\s*(?:meta(?:(?:\s+%s|\s+%s){2}|\s+%s)|\?xml\s[^>]+%s|body)' % \
-        (_HTTPEQUIV_RE, _CONTENT_RE, _CONTENT2_RE, _XML_ENCODING_RE), re.I)
+    r'<\s*(?:%s|\?xml\s[^>]+%s|body)' % \
+        (_META_CHARSET_RE, _XML_ENCODING_RE), re.I)
 
 # Default encoding translation
 # this maps cannonicalized encodings to target encodings
@@ -66,18 +67,28 @@ def http_content_type_encoding(content_type):
             return resolve_encoding(match.group(1))
 
 
-def html_body_declared_encoding(html_body_str):
-    """encoding specified in meta tags in the html body, or None if no 
-    suitable encoding was found
+def find_declared_encoding(html_body_str):
+    """Return the name of encoding specified in meta tags (either
+    http-equiv or charset meta tag) or XML declaration of the html body
+    as it is written in the document, or None.
+
+    The first 4096 bytes are scanned with one regular expression, the
+    search stops at the body tag.
     """
     # html5 suggests the first 1024 bytes are sufficient, we allow for more
     chunk = html_body_str[:4096]
     match = _BODY_ENCODING_RE.search(chunk)
     if match:
-        encoding = match.group('charset') or match.group('charset2') \
-                or match.group('xmlcharset')
-        if encoding:
-            return resolve_encoding(encoding)
+        return match.group('charset') or match.group('xmlcharset')
+
+
+def html_body_declared_encoding(html_body_str):
+    """encoding specified in meta tags in the html body, or None if no 
+    suitable encoding was found
+    """
+    encoding = find_declared_encoding(html_body_str)
+    if encoding:
+        return resolve_encoding(encoding)
 
 
 def _c18n_encoding(encoding):
@@ -0,0 +1,219 @@
+"""
+Reading and writing of WARC files.
+
+Each record is written as separate gzip member, so the record could be
+read by seeking to its offset in the compressed file.
+
+Specification: http://bibnum.bnf.fr/WARC/WARC_ISO_28500_version1_latestdraft.pdf
+"""
+from __future__ import absolute_import
+from uuid import uuid4
+import calendar
+import zlib
+import gzip
+import time
+import os
+
+from grab.tools.encoding import smart_str
+
+# Max. size of one WARC file, new file is created when the size is exceeded
+WARC_MAX_SIZE = 1024 * 1024 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def format_date(timestamp):
+    return time.strftime(DATE_FORMAT, time.gmtime(timestamp))
+
+
+def parse_date(value):
+    return calendar.timegm(time.strptime(value, DATE_FORMAT))
+
+
+def last_http_head(head):
+    """
+    Return the head of the last response from the head which could
+    contain heads of multiple responses (if redirects were processed
+    automatically).
+    """
+
+    blocks = [x for x in head.split('\r\n\r\n') if x.strip()]
+    if blocks:
+        return blocks[-1] + '\r\n\r\n'
+    else:
+        return ''
+
+
+class WarcWriter(object):
+    """
+    Write records into rotating WARC files.
+
+    Files are named <prefix>-<time>-<number>.warc.gz and saved
+    into the `path` directory.
+    """
+
+    def __init__(self, path, prefix='grab', max_size=WARC_MAX_SIZE):
+        self.path = path
+        self.prefix = prefix
+        self.max_size = max_size
+        self.file = None
+        self.file_number = 0
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def open_file(self):
+        self.file_number += 1
+        fname = '%s-%s-%05d.warc.gz' % (
+            self.prefix, time.strftime('%Y%m%d%H%M%S'), self.file_number)
+        self.file = open(os.path.join(self.path, fname), 'wb')
+        from grab import __version__
+        info = 'software: grab/%s\r\nformat: WARC File Format 1.0\r\n'\
+               % __version__
+        self.write_record('warcinfo', info, 'application/warc-fields',
+                          extra_headers=[('WARC-Filename', fname)])
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def write_record(self, warc_type, block, content_type, url=None,
+                     extra_headers=None, timestamp=None):
+        """
+        Write the record into current WARC file.
+
+        Returns ID of the record.
+        """
+
+        if self.file is None:
+            self.open_file()
+        record_id = '<urn:uuid:%s>' % uuid4()
+        headers = [
+            ('WARC-Type', warc_type),
+            ('WARC-Record-ID', record_id),
+            ('WARC-Date', format_date(timestamp or time.time())),
+        ]
+        if url is not None:
+            headers.append(('WARC-Target-URI', url))
+        headers.extend(extra_headers or [])
+        headers.append(('Content-Type', content_type))
+        block = smart_str(block)
+        headers.append(('Content-Length', str(len(block))))
+        # Unicode header would turn the whole record into unicode and
+        # the binary block could not be decoded
+        data = 'WARC/1.0\r\n%s\r\n%s\r\n\r\n' % (
+            ''.join('%s: %s\r\n' % (smart_str(key), smart_str(value))
+                    for key, value in headers), block)
+        gzip_file = gzip.GzipFile(fileobj=self.file, mode='wb')
+        gzip_file.write(data)
+        gzip_file.close()
+        if self.file.tell() > self.max_size:
+            self.close()
+        return record_id
+
+    def write_response(self, url, grab, timestamp=None):
+        """
+        Write response and request records of the network request
+        performed by `grab` instance.
+
+        Only the head of the last response is saved if the
+        redirects were followed.
+        """
+
+        timestamp = timestamp or time.time()
+        extra_headers = []
+        if grab.response.url and grab.response.url != url:
+            extra_headers.append(('WARC-Grab-Response-URL', grab.response.url))
+        block = last_http_head(grab.response.head) + grab.response.body
+        response_id = self.write_record(
+            'response', block, 'application/http; msgtype=response',
+            url=url, extra_headers=extra_headers, timestamp=timestamp)
+        if grab.request_head:
+            block = grab.request_head + (grab.request_body or '')
+            self.write_record(
+                'request', block, 'application/http; msgtype=request',
+                url=url, extra_headers=[('WARC-Concurrent-To', response_id)],
+                timestamp=timestamp)
+
+
+def parse_record(data):
+    """
+    Parse uncompressed WARC record.
+
+    Returns (headers, block) pair, `headers` is a dict.
+    """
+
+    head, block = data.split('\r\n\r\n', 1)
+    headers = {}
+    for line in head.split('\r\n')[1:]:
+        key, value = line.split(':', 1)
+        headers[key.strip()] = value.strip()
+    length = int(headers.get('Content-Length', len(block)))
+    return headers, block[:length]
+
+
+def parse_http_response(block):
+    """
+    Split the block of response record into HTTP head and body.
+    """
+
+    if '\r\n\r\n' in block:
+        head, body = block.split('\r\n\r\n', 1)
+        return head + '\r\n\r\n', body
+    else:
+        return block, ''
+
+
+def iter_members(fileobj):
+    """
+    Iterate over gzip members of the file.
+
+    Yields (offset, length, data) tuples.
+    """
+
+    offset = 0
+    fileobj.seek(0)
+    pending = ''
+    while True:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        parts = []
+        consumed = 0
+        while True:
+            chunk = pending or fileobj.read(READ_CHUNK_SIZE)
+            pending = ''
+            if not chunk:
+                break
+            parts.append(decompressor.decompress(chunk))
+            consumed += len(chunk)
+            if decompressor.unused_data:
+                pending = decompressor.unused_data
+                consumed -= len(pending)
+                break
+        if not consumed:
+            break
+        yield offset, consumed, ''.join(parts)
+        offset += consumed
+
+
+def iter_records(path):
+    """
+    Iterate over records of WARC file.
+
+    Yields (offset, length, headers, block) tuples.
+    """
+
+    with open(path, 'rb') as inp:
+        for offset, length, data in iter_members(inp):
+            headers, block = parse_record(data)
+            yield offset, length, headers, block
+
+
+def read_record(path, offset, length):
+    """
+    Read the record which is located at `offset` in the WARC file.
+    """
+
+    with open(path, 'rb') as inp:
+        inp.seek(offset)
+        data = zlib.decompress(inp.read(length), 16 + zlib.MAX_WBITS)
+    return parse_record(data)
@@ -27,6 +27,7 @@ GRAB_TEST_LIST = (
     # *** grab.tools
     'test.text_tools',
     'test.tools_html',
+    'test.tools_rex',
     'test.lxml_tools',
     'test.tools_account',
     'test.tools_control',
@@ -53,6 +54,13 @@ SPIDER_TEST_LIST = (
     'test.spider_task',
     'test.spider_proxy',
     'test.spider_queue',
+    'test.spider_cache_writer',
+    'test.spider_cache_compression',
+    'test.spider_cache_migration',
+    'test.spider_warc',
+    'test.spider_replay',
+    'test.spider_cache_segment',
+    'test.spider_sitemap',
 )
 
 GRAB_EXTRA_TEST_LIST = ()
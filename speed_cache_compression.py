@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Compare size and speed of plain zlib compression of cached documents
+with compression by dictionaries trained for each host.
+
+Usage: speed_cache_compression.py CORPUS_DIR
+
+CORPUS_DIR should contain subdirectory for each host with saved pages
+of that host, e.g. CORPUS_DIR/example.com/1.html
+"""
+from grab.spider.cache_compression import DictionaryCompressor
+import zlib
+import time
+import sys
+import os
+
+
+class MemoryStorage(object):
+    def __init__(self):
+        self.dictionaries = {}
+        self.hosts = {}
+
+    def load_dictionary(self, dict_id):
+        return self.dictionaries.get(dict_id)
+
+    def find_dictionary(self, host):
+        dict_id = self.hosts.get(host)
+        if dict_id is None:
+            return None
+        return dict_id, self.dictionaries[dict_id]
+
+    def save_dictionary(self, dict_id, host, data):
+        self.dictionaries[dict_id] = data
+        self.hosts[host] = dict_id
+
+
+def load_corpus(path):
+    corpus = []
+    for host in sorted(os.listdir(path)):
+        host_dir = os.path.join(path, host)
+        if not os.path.isdir(host_dir):
+            continue
+        for fname in sorted(os.listdir(host_dir)):
+            with open(os.path.join(host_dir, fname)) as inp:
+                corpus.append(('http://%s/%s' % (host, fname), inp.read()))
+    return corpus
+
+
+def bench_zlib(corpus):
+    start = time.time()
+    result = [zlib.compress(body) for url, body in corpus]
+    compress_time = time.time() - start
+    start = time.time()
+    for data in result:
+        zlib.decompress(data)
+    decompress_time = time.time() - start
+    return sum(len(x) for x in result), compress_time, decompress_time
+
+
+def bench_dict(corpus):
+    storage = MemoryStorage()
+    comp = DictionaryCompressor(storage)
+    start = time.time()
+    result = [comp.compress(url, body) for url, body in corpus]
+    compress_time = time.time() - start
+    start = time.time()
+    for dict_id, data in result:
+        comp.decompress(dict_id, data)
+    decompress_time = time.time() - start
+    size = sum(len(x[1]) for x in result)
+    dict_size = sum(len(x) for x in storage.dictionaries.values())
+    return size + dict_size, compress_time, decompress_time
+
+
+def main():
+    corpus = load_corpus(sys.argv[1])
+    raw_size = sum(len(x[1]) for x in corpus)
+    hosts = set(x[0].split('/')[2] for x in corpus)
+    print 'Documents: %d, hosts: %d, size: %d' % (len(corpus), len(hosts),
+                                                  raw_size)
+    for name, func in (('zlib', bench_zlib), ('dict', bench_dict)):
+        size, compress_time, decompress_time = func(corpus)
+        print '%s: size %d (%.1f%%), compress %.2f sec., '\
+              'decompress %.2f sec.' % (
+                name, size, size * 100.0 / raw_size,
+                compress_time, decompress_time)
+
+if __name__ == '__main__':
+    main()
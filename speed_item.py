@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Measure the speed of extraction of items from the listing page.
+
+Compare lazy items which resolve each field on access with eager
+items which are extracted with compiled queries (`Meta.eager` option).
+"""
+from random import randint, seed
+import time
+
+from lxml.html import fromstring
+
+from grab.selector import Selector
+from grab.item import Item, IntegerField, StringField
+
+ROW_NUMBER = 10000
+KEYS = ['id', 'title', 'url', 'price', 'vendor']
+
+
+class Row(Item):
+    id = IntegerField('./@data-id')
+    title = StringField('./a')
+    url = StringField('./a/@href')
+    price = IntegerField('./span[@class="price"]')
+    vendor = StringField('./span[@class="vendor"]', default=None)
+
+    class Meta:
+        find_selector = '//div[@class="row"]'
+
+
+class EagerRow(Row):
+    class Meta:
+        find_selector = '//div[@class="row"]'
+        eager = True
+
+
+def build_page():
+    rows = ''.join(
+        '<div class="row" data-id="%d"><a href="/item/%d">Item %d</a>'
+        '<span class="price">%d</span><span class="vendor">V%d</span></div>'
+        % (x, x, x, randint(0, 1000), randint(0, 100))
+        for x in xrange(ROW_NUMBER))
+    return '<html><body>%s</body></html>' % rows
+
+
+def main():
+    seed(1)
+    root = Selector(fromstring(build_page()))
+    for name, cls in (('lazy', Row), ('eager', EagerRow)):
+        start = time.time()
+        rows = [x.get_dict(KEYS) for x in cls.find(root)]
+        total = time.time() - start
+        assert len(rows) == ROW_NUMBER
+        print '%s: %.3f sec., %.1f usec. per row' % (
+            name, total, total * 1000000 / ROW_NUMBER)
+    start = time.time()
+    EagerRow.find_one(root)
+    print 'eager find_one: %.1f msec.' % ((time.time() - start) * 1000)
+
+if __name__ == '__main__':
+    main()
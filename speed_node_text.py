@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Measure the speed of text extraction from the nodes.
+
+Compare `get_node_text` in smart and non-smart modes with the previous
+implementation which built XPath query for each call and normalized
+spaces with the regexp.
+"""
+from random import choice, seed
+import re
+import time
+
+from lxml.html import fromstring
+
+from grab.tools.lxml_tools import get_node_text
+
+NODE_NUMBER = 5000
+REPEAT = 10
+WORDS = [u'пчела', u'муха', u'bee', u'fly', u'кот', u'cat']
+RE_SPACE = re.compile(r'\s+', re.U)
+
+
+def build_page():
+    seed(1)
+    items = u''.join(u'<div class="item">\n  <b>%s</b> <i>%s</i>\n'
+                     u'  <script>var x = 1;</script> %s\n</div>' % (
+                         choice(WORDS), choice(WORDS),
+                         u' '.join(choice(WORDS) for x in xrange(10)))
+                     for x in xrange(NODE_NUMBER))
+    return u'<html><body>%s</body></html>' % items
+
+
+def get_node_text_old(node, smart=False, normalize_space=True):
+    """
+    Previous implementation of `get_node_text`.
+    """
+
+    if smart:
+        value = ' '.join(node.xpath(
+            './descendant-or-self::*[name() != "script" and '
+            'name() != "style"]/text()[normalize-space()]'))
+    else:
+        value = node.text_content()
+    if normalize_space:
+        value = RE_SPACE.sub(' ', value.strip()).strip()
+    return value
+
+
+def main():
+    nodes = fromstring(build_page()).xpath('//div[@class="item"]')
+    memo = {}
+    for smart in (False, True):
+        assert ([get_node_text_old(x, smart=smart) for x in nodes]
+                == [get_node_text(x, smart=smart) for x in nodes])
+        for name, func in (
+                ('old', lambda x: get_node_text_old(x, smart=smart)),
+                ('new', lambda x: get_node_text(x, smart=smart)),
+                ('new, memo', lambda x: get_node_text(x, smart=smart,
+                                                      memo=memo)),
+                ):
+            start = time.time()
+            for x in xrange(REPEAT):
+                for node in nodes:
+                    func(node)
+            total = time.time() - start
+            print 'smart=%s, %s: %.2f usec. per node' % (
+                smart, name, total * 1000000 / (REPEAT * len(nodes)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Measure the speed of `Response.parse` on typical response heads.
+
+Compare lazy parsing of headers with building of `email.message.Message`
+object which was used before.
+"""
+from grab.response import Response
+from random import choice, randint, seed
+import email
+import time
+
+HEAD_NUMBER = 5000
+SERVERS = ['nginx/1.2.1', 'Apache/2.2.22 (Debian)', 'cloudflare-nginx']
+CONTENT_TYPES = ['text/html', 'text/html; charset=utf-8',
+                 'text/html; charset=windows-1251', 'application/json']
+
+
+def build_head():
+    lines = [
+        'HTTP/1.1 200 OK',
+        'Server: %s' % choice(SERVERS),
+        'Date: Mon, 07 Jan 2013 12:%02d:%02d GMT' % (randint(0, 59),
+                                                      randint(0, 59)),
+        'Content-Type: %s' % choice(CONTENT_TYPES),
+        'Transfer-Encoding: chunked',
+        'Connection: keep-alive',
+        'Vary: Accept-Encoding',
+        'X-Powered-By: PHP/5.4.%d' % randint(0, 10),
+        'Expires: Thu, 19 Nov 1981 08:52:00 GMT',
+        'Cache-Control: no-store, no-cache, must-revalidate',
+        'Pragma: no-cache',
+    ]
+    for x in xrange(randint(0, 4)):
+        lines.append('Set-Cookie: c%d=%d; path=/; domain=.example.com'\
+                     % (x, randint(0, 1000000)))
+    head = '\r\n'.join(lines) + '\r\n\r\n'
+    if randint(0, 4) == 0:
+        # Redirect which was processed automatically
+        head = 'HTTP/1.1 302 Found\r\nServer: nginx\r\n'\
+               'Location: http://example.com/\r\n\r\n' + head
+    return head
+
+
+def parse_email(response):
+    """
+    Previous implementation of `Response.parse`.
+    """
+
+    valid_lines = []
+    for line in response.head.split('\n'):
+        line = line.rstrip('\r')
+        if line:
+            if line.startswith('HTTP'):
+                response.status = line
+                valid_lines = []
+            else:
+                if ':' in line:
+                    valid_lines.append(line)
+    response.headers = email.message_from_string('\n'.join(valid_lines))
+    response.detect_charset()
+
+
+def bench(heads, func):
+    responses = []
+    for head in heads:
+        response = Response()
+        response.head = head
+        response.body = '<html><body>Hello world</body></html>'
+        responses.append(response)
+    start = time.time()
+    for response in responses:
+        func(response)
+    return time.time() - start
+
+
+def main():
+    seed(1)
+    heads = [build_head() for x in xrange(HEAD_NUMBER)]
+    for name, func in (('email', parse_email),
+                       ('lazy', lambda x: x.parse())):
+        total = bench(heads, func)
+        print '%s: %.3f sec., %.1f usec. per response' % (
+            name, total, total * 1000000 / len(heads))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Measure the speed of search of many regular expressions in the page.
+
+Compare separate search of each regular expression in the decoded
+body with `RexScanner` in unicode and byte modes.
+"""
+from random import choice, randint, seed
+import re
+import time
+
+from grab import Grab
+from grab.tools.rex import RexScanner
+
+PAGE_NUMBER = 20
+WORDS = [u'пчела', u'муха', u'bee', u'fly', u'кот', u'cat']
+PATTERNS = {
+    'captcha': r'captcha\.png',
+    'ban': r'You are banned',
+    'cloudflare': r'cf-browser-verification',
+    'error': r'Internal Server Error',
+    'title': r'<title>([^<]+)</title>',
+    'price': r'price: (\d+)',
+}
+SCANNER = RexScanner(PATTERNS)
+
+
+def build_page():
+    items = u''.join(u'<div class="item"><a href="/%d">%s</a> price: %d</div>'
+                     % (randint(0, 1000000), choice(WORDS), randint(0, 1000))
+                     for x in xrange(10000))
+    return (u'<html><head><title>Items</title></head><body>%s</body></html>'
+            % items).encode('utf-8')
+
+
+def search_separate(grab):
+    body = grab.response.unicode_body()
+    return dict((name, list(re.compile(regexp).finditer(body)))
+                for name, regexp in PATTERNS.items())
+
+
+def search_scanner(grab):
+    return grab.rex_scan(SCANNER)
+
+
+def search_scanner_byte(grab):
+    return grab.rex_scan(SCANNER, byte=True)
+
+
+def main():
+    seed(1)
+    body = build_page()
+    print 'Page size: %.1f MB' % (len(body) / 1024.0 / 1024)
+    for name, func in (('separate', search_separate),
+                       ('scanner', search_scanner),
+                       ('scanner, byte', search_scanner_byte)):
+        total = 0
+        for x in xrange(PAGE_NUMBER):
+            grab = Grab()
+            grab.fake_response(body)
+            start = time.time()
+            func(grab)
+            total += time.time() - start
+        print '%s: %.2f msec. per page' % (name, total * 1000 / PAGE_NUMBER)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Measure the speed of extraction of many fields from the page.
+
+Compare `grab.doc.select(...).text()` call for each field with
+the compiled extraction schema.
+"""
+from random import randint, seed
+import time
+
+from lxml.html import fromstring
+
+from grab.selector import Selector
+from grab.selector.schema import Schema, Group
+
+PAGE_NUMBER = 200
+FIELD_NUMBER = 30
+OFFER_NUMBER = 20
+
+
+def build_page():
+    fields = ''.join('<div class="f%d"><b>Field</b> value %d</div>'
+                     % (x, randint(0, 1000)) for x in xrange(FIELD_NUMBER))
+    offers = ''.join('<div class="offer"><a href="/o%d">Offer %d</a>'
+                     '<span class="price">%d</span></div>'
+                     % (x, x, randint(0, 1000)) for x in xrange(OFFER_NUMBER))
+    return '<html><body>%s%s</body></html>' % (fields, offers)
+
+
+def extract_select(tree):
+    doc = Selector(tree)
+    result = {}
+    for x in xrange(FIELD_NUMBER):
+        result['f%d' % x] = doc.select('//div[@class="f%d"]' % x).text()
+    offers = []
+    for sel in doc.select('//div[@class="offer"]'):
+        offers.append({
+            'name': sel.select('./a').text(),
+            'url': sel.select('./a/@href').text(),
+            'price': int(sel.select('./span[@class="price"]').text()),
+        })
+    result['offers'] = offers
+    return result
+
+
+SCHEMA = Schema(dict(
+    [('f%d' % x, '//div[@class="f%d"]' % x) for x in xrange(FIELD_NUMBER)]
+    + [('offers', Group('//div[@class="offer"]', {
+        'name': './a',
+        'url': './a/@href',
+        'price': ('./span[@class="price"]', int),
+    }))]))
+
+
+def extract_schema(tree):
+    return SCHEMA.extract(tree)
+
+
+def main():
+    seed(1)
+    trees = [fromstring(build_page()) for x in xrange(PAGE_NUMBER)]
+    assert extract_select(trees[0]) == extract_schema(trees[0])
+    for name, func in (('select', extract_select),
+                       ('schema', extract_schema)):
+        start = time.time()
+        for tree in trees:
+            func(tree)
+        total = time.time() - start
+        print '%s: %.3f sec., %.2f msec. per page' % (
+            name, total, total * 1000 / len(trees))
+
+if __name__ == '__main__':
+    main()
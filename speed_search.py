@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Measure the speed of the search of ban and captcha markers in the page.
+
+Compare the search of unicode anchors in the decoded body, which was
+used before, with the search of encoded anchors in the byte body.
+"""
+from random import choice, randint, seed
+import time
+
+from grab import Grab, DataNotFound
+
+PAGE_NUMBER = 20
+WORDS = [u'пчела', u'муха', u'bee', u'fly', u'кот', u'cat']
+MARKERS = [u'captcha', u'You are banned', u'Доступ запрещён',
+           u'cf-browser-verification', u'unusual traffic']
+
+
+def build_page(charset):
+    items = u''.join(u'<div class="item"><a href="/%d">%s</a> %s</div>'
+                     % (randint(0, 1000000), choice(WORDS),
+                        u' '.join(choice(WORDS) for x in xrange(10)))
+                     for x in xrange(10000))
+    return (u'<html><head><meta charset="%s"></head><body>%s</body></html>'
+            % (charset, items)).encode(charset)
+
+
+def search_unicode(grab):
+    body = grab.response.unicode_body()
+    return any(x in body for x in MARKERS)
+
+
+def search_bytes(grab):
+    try:
+        grab.assert_substrings(MARKERS)
+    except DataNotFound:
+        return False
+    else:
+        return True
+
+
+def main():
+    seed(1)
+    for charset in ('utf-8', 'cp1251'):
+        body = build_page(charset)
+        print '%s page size: %.1f MB' % (charset, len(body) / 1024.0 / 1024)
+        for name, func in (('unicode body', search_unicode),
+                           ('byte body', search_bytes)):
+            total = 0
+            for x in xrange(PAGE_NUMBER):
+                grab = Grab()
+                grab.fake_response(body)
+                start = time.time()
+                assert not func(grab)
+                total += time.time() - start
+            print '%s: %.2f msec. per page' % (name,
+                                               total * 1000 / PAGE_NUMBER)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Measure the speed of queries which return many nodes.
+
+Compare the number of created selectors and the time of `exists`,
+`text` and chained `select` calls on the large result set.
+"""
+import time
+
+from lxml.html import fromstring
+
+from grab.selector import Selector
+
+ROW_NUMBER = 10000
+REPEAT = 20
+
+
+def build_page():
+    rows = ''.join('<tr><td class="name">Row %d</td>'
+                   '<td><a href="/row/%d">link</a></td></tr>' % (x, x)
+                   for x in xrange(ROW_NUMBER))
+    return '<html><body><table>%s</table></body></html>' % rows
+
+
+def main():
+    doc = Selector(fromstring(build_page()))
+    for name, func in (
+            ('exists', lambda: doc.select('//tr').exists()),
+            ('text', lambda: doc.select('//td').text()),
+            ('chained select', lambda: doc.select('//tr')
+                                          .select('./td/a/@href').count()),
+            ):
+        start = time.time()
+        for x in xrange(REPEAT):
+            func()
+        total = time.time() - start
+        print '%s: %.2f msec. per call' % (name, total * 1000 / REPEAT)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Measure time and memory which are used to build DOM tree of large documents.
+
+Compare building of the tree from the byte body with the reusable parser
+and building of the tree from the unicode body which was used before.
+Also measure the effect of `simplify_html` option on the page with many
+scripts, styles and comments. Each method is measured in separate process
+to get its peak memory usage.
+"""
+from multiprocessing import Process, Queue
+from random import choice, randint, seed
+import resource
+import time
+
+from lxml.html import fromstring
+
+from grab import Grab
+from grab.response import RE_XML_DECLARATION
+
+PAGE_NUMBER = 20
+PAGE_SIZE = 2 * 1024 * 1024
+WORDS = [u'пчела', u'муха', u'bee', u'fly', u'кот', u'cat']
+SCRIPT = u'''<script type="text/javascript">
+var config = {"items": [%s], "enabled": true};
+for (var i = 0; i < config.items.length; i++) { render(config.items[i]); }
+</script><!-- item widget --><style>.item-%d { color: #%06x; }</style>'''
+
+
+def build_page(scripts=False):
+    seed(1)
+    items = []
+    size = 0
+    while size < PAGE_SIZE:
+        item = u'<div class="item" id="i%d"><a href="/%d">%s</a><p>%s</p></div>' % (
+            randint(0, 1000000), randint(0, 1000000), choice(WORDS),
+            u' '.join(choice(WORDS) for x in xrange(20)))
+        if scripts:
+            item += SCRIPT % (u', '.join(str(randint(0, 1000))
+                                         for x in xrange(30)),
+                              randint(0, 1000), randint(0, 0xffffff))
+        items.append(item)
+        size += len(item.encode('utf-8'))
+    return (u'<?xml version="1.0" encoding="utf-8"?><html><head>'
+            u'<meta charset="utf-8"></head><body>%s</body></html>'
+            % u''.join(items)).encode('utf-8')
+
+
+def build_tree_unicode(grab):
+    """
+    Previous implementation of `build_html_tree`.
+    """
+
+    body = grab.response.unicode_body(
+        fix_special_entities=grab.config['fix_special_entities']).strip()
+    if grab.config['lowercased_tree']:
+        body = body.lower()
+    if grab.config['strip_null_bytes']:
+        body = body.replace(chr(0), '')
+    body = RE_XML_DECLARATION.sub('', body)
+    return fromstring(body)
+
+
+def build_tree_bytes(grab):
+    return grab.tree
+
+
+def build_tree_simplified(grab):
+    grab.setup(simplify_html=True)
+    return grab.tree
+
+
+def bench(func, body, result):
+    start_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    total = 0
+    for x in xrange(PAGE_NUMBER):
+        grab = Grab()
+        grab.fake_response(body)
+        start = time.time()
+        tree = func(grab)
+        total += time.time() - start
+        assert len(tree.xpath('//div')) > 0
+        del tree, grab
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result.put((total, memory - start_memory))
+
+
+def run(name, func, body):
+    result = Queue()
+    proc = Process(target=bench, args=[func, body, result])
+    proc.start()
+    total, memory = result.get()
+    proc.join()
+    print '%s: %.3f sec. per page, peak memory growth %.1f MB' % (
+        name, total / PAGE_NUMBER, memory / 1024.0)
+
+
+def main():
+    body = build_page()
+    print 'Page size: %.1f MB' % (len(body) / 1024.0 / 1024)
+    run('unicode', build_tree_unicode, body)
+    run('bytes', build_tree_bytes, body)
+
+    body = build_page(scripts=True)
+    print 'Page with scripts, size: %.1f MB' % (len(body) / 1024.0 / 1024)
+    run('bytes', build_tree_bytes, body)
+    run('bytes, simplify_html', build_tree_simplified, body)
+
+if __name__ == '__main__':
+    main()
@@ -7,8 +7,9 @@ root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 sys.path.insert(0, root)
 
 from grab import Grab, DataNotFound
+from grab.error import GrabMisuseError
 from grab.item import (Item, IntegerField, StringField, DateTimeField, func_field,
-                       FuncField)
+                       FuncField, ItemListField)
 from test.util import GRAB_TRANSPORT
 from grab.tools.lxml_tools import get_node_text
 
@@ -93,3 +94,101 @@ class TestItems(TestCase):
         self.assertEquals('abc', player.comment_cdata)
 
         self.assertRaises(DataNotFound, lambda: player.data_not_found)
+
+    def test_text_memo(self):
+        class PricedRow(Row):
+            price_text = StringField('./i')
+
+        grab = Grab(transport=GRAB_TRANSPORT)
+        grab.fake_response(LISTING)
+        row = PricedRow.find_one(grab.doc)
+        self.assertEqual(10, row.price)
+        self.assertEqual('10', row.price_text)
+        self.assertEqual(1, len(row._text_memo))
+
+
+LISTING = """
+<html><body>
+    <div class="row" data-id="1"><a href="/1">One</a><i>10</i>
+        <span class="tag">a</span><span class="tag">b</span></div>
+    <div class="row" data-id="2"><a href="/2">Two</a><i></i></div>
+    <div class="row" data-id="3"><a href="/3">Three</a><i>30</i></div>
+</body></html>
+"""
+
+
+class Tag(Item):
+    name = StringField('.')
+
+
+class Row(Item):
+    id = IntegerField('./@data-id')
+    title = StringField('./a', processor=lambda x: x.upper())
+    price = IntegerField('./i', empty_default=None)
+    url = StringField('./a/@href')
+    missing = StringField('./b', default='none')
+    tags = ItemListField('./span[@class="tag"]', Tag)
+
+    class Meta:
+        find_selector = '//div[@class="row"]'
+
+
+class EagerRow(Row):
+    class Meta:
+        find_selector = '//div[@class="row"]'
+        eager = True
+
+
+class TestEagerItems(TestCase):
+    def setUp(self):
+        self.grab = Grab(transport=GRAB_TRANSPORT)
+        self.grab.fake_response(LISTING)
+
+    def test_eager_find(self):
+        keys = ['id', 'title', 'price', 'url', 'missing']
+        lazy_rows = list(Row.find(self.grab.doc))
+        rows = list(EagerRow.find(self.grab.doc))
+        self.assertEqual([x.get_dict(keys) for x in lazy_rows],
+                         [x.get_dict(keys) for x in rows])
+        self.assertEqual(None, rows[1].price)
+        self.assertEqual(2, rows[2]._position)
+        self.assertEqual(['a', 'b'], [x.name for x in rows[0].tags])
+        self.assertTrue(isinstance(rows[0], EagerRow))
+        self.assertFalse(hasattr(rows[0], '_cache'))
+
+    def test_parse(self):
+        class ParsedTag(Tag):
+            def _parse(self, url=None, **kwargs):
+                self.node_class = self._tree.get('class')
+
+        class ParsedRow(EagerRow):
+            tags = ItemListField('./span[@class="tag"]', ParsedTag)
+
+            def _parse(self, url=None, **kwargs):
+                self.url = url + self.url
+                self.link = self._selector.select('./a').text()
+                self.grab = self._grab
+
+        rows = list(ParsedRow.find(self.grab.doc, url='http://h.com'))
+        self.assertEqual('http://h.com/1', rows[0].url)
+        self.assertEqual('One', rows[0].link)
+        self.assertEqual(None, rows[0].grab)
+        self.assertEqual(['tag', 'tag'], [x.node_class for x in rows[0].tags])
+
+    def test_find_one(self):
+        self.assertEqual(1, EagerRow.find_one(self.grab.doc).id)
+        self.assertEqual(1, Row.find_one(self.grab.doc).id)
+
+        class NoRow(Row):
+            class Meta:
+                find_selector = '//table'
+        self.assertRaises(DataNotFound, NoRow.find_one, self.grab.doc)
+
+    def test_func_field(self):
+        class FuncRow(Item):
+            title = FuncField(lambda sel: sel.select('./a').text())
+
+            class Meta:
+                find_selector = '//div[@class="row"]'
+                eager = True
+        self.assertRaises(GrabMisuseError, list, FuncRow.find(self.grab.doc))
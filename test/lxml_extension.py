@@ -1,5 +1,7 @@
 # coding: utf-8
 from unittest import TestCase
+import tempfile
+import os
 from grab import Grab, DataNotFound
 
 from .util import GRAB_TRANSPORT
@@ -181,3 +183,103 @@ class LXMLExtensionTest(TestCase):
         g = Grab()
         g.go(SERVER.BASE_URL)
         g.xpath_exists('//anytag')
+
+    def test_tree_from_bytes(self):
+        g = Grab(transport=GRAB_TRANSPORT)
+        g.fake_response(HTML, charset='cp1251')
+        self.assertEqual(u'пчела', g.doc.select('//div[@id="bee"]/div').text())
+        # Unicode body is not built to get the DOM tree
+        self.assertEqual(None, g.response._unicode_body)
+
+        # Broken bytes are ignored like in the unicode body
+        g = Grab(transport=GRAB_TRANSPORT)
+        g.fake_response('<p>\xd0\xb0\xff\xd0\xb1</p>', charset='utf-8')
+        self.assertEqual(u'аб', g.doc.select('//p').text())
+
+        # Charset which is not compatible with ASCII
+        g = Grab(transport=GRAB_TRANSPORT)
+        g.fake_response(u'<p>пчела</p>'.encode('utf-16'), charset='utf-16')
+        self.assertEqual(u'пчела', g.doc.select('//p').text())
+
+        g = Grab(transport=GRAB_TRANSPORT)
+        g.fake_response('\xef\xbb\xbf<?xml version="1.0" encoding="cp1251"?>'
+                        '<p>\xd0\xb0\x00</p>')
+        self.assertEqual(u'а', g.doc.select('//p').text())
+
+    def test_tree_maxsize(self):
+        body = u'<html><body><h1>пчела</h1>%s<h2>муха</h2></body></html>'\
+               % (u'<p>мёд</p>' * 1000)
+        g = Grab(transport=GRAB_TRANSPORT)
+        g.setup(tree_maxsize=1000)
+        g.fake_response(body.encode('utf-8'), charset='utf-8')
+        self.assertEqual(u'пчела', g.doc.select('//h1').text())
+        self.assertFalse(g.doc.select('//h2').exists())
+        self.assertTrue(0 < g.doc.select('//p').count() < 1000)
+        self.assertEqual(u'мёд', g.doc.select('//p').text())
+        # Last element could be cut in the middle of the text
+        self.assertTrue(u'мёд'.startswith(g.doc.select('//p')[-1].text()))
+
+        g = Grab(transport=GRAB_TRANSPORT)
+        g.setup(tree_maxsize=1000)
+        g.fake_response(body.encode('gbk'), charset='gbk')
+        self.assertEqual(u'пчела', g.doc.select('//h1').text())
+        self.assertFalse(g.doc.select('//h2').exists())
+
+    def test_simplify_html(self):
+        g = Grab(transport=GRAB_TRANSPORT)
+        g.setup(simplify_html=True)
+        g.fake_response(HTML, charset='cp1251')
+        self.assertFalse(g.doc.select('//script').exists())
+        self.assertFalse(g.doc.select('//style').exists())
+        self.assertEqual(u'пчела', g.doc.select('//div[@id="bee"]').text())
+        self.assertTrue('mozilla' in g.response.body)
+
+    def test_iterxml(self):
+        xml = '<?xml version="1.0" encoding="UTF-8"?>'\
+              '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'\
+              '%s</urlset>' % ''.join(
+                  '<url><loc>http://h.com/%d</loc></url>' % x
+                  for x in xrange(100))
+        g = Grab(transport=GRAB_TRANSPORT)
+        g.fake_response(xml)
+        urls = []
+        for elem in g.iterxml('{*}url'):
+            # Processed elements are removed from the tree
+            self.assertEqual(None, elem.getprevious())
+            urls.append(elem.findtext('{*}loc'))
+        self.assertEqual(['http://h.com/%d' % x for x in xrange(100)], urls)
+
+        # Content of outer element is kept until its end
+        g = Grab(transport=GRAB_TRANSPORT)
+        g.fake_response(xml)
+        urls = [x.findtext('{*}loc') for x in g.iterxml(['{*}url', '{*}loc'])
+                if x.tag.endswith('url')]
+        self.assertEqual(['http://h.com/%d' % x for x in xrange(100)], urls)
+
+        # Body saved into the file
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(xml)
+            g = Grab(transport=GRAB_TRANSPORT)
+            g.fake_response('', body_path=path)
+            self.assertEqual(100, len([x.text for x in g.iterxml('{*}loc')]))
+        finally:
+            os.unlink(path)
+
+    def test_iterxml_external_entity(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write('secret')
+            xml = '<?xml version="1.0"?>'\
+                  '<!DOCTYPE urlset [<!ENTITY xxe SYSTEM "file://%s">]>'\
+                  '<urlset><url><loc>http://h.com/&xxe;</loc></url>'\
+                  '</urlset>' % path
+            g = Grab(transport=GRAB_TRANSPORT)
+            g.fake_response(xml)
+            urls = [x.findtext('loc') for x in g.iterxml('url')]
+            self.assertEqual(1, len(urls))
+            self.assertFalse('secret' in (urls[0] or ''))
+        finally:
+            os.unlink(path)
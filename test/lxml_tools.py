@@ -41,6 +41,22 @@ class LXMLToolsTest(TestCase):
         elem = self.lxml_tree.xpath('//div[@id="fly"]')[0]
         self.assertEqual(get_node_text(elem), u'му ха')
 
+    def test_get_node_text_etree(self):
+        from lxml.etree import fromstring as etree_fromstring
+        tree = etree_fromstring('<div><b>be</b>e <i>fly</i></div>')
+        self.assertEqual(get_node_text(tree), u'bee fly')
+        self.assertEqual(get_node_text(tree, smart=True), u'be e fly')
+
+    def test_get_node_text_memo(self):
+        elem = self.lxml_tree.xpath('//div[@id="fly"]')[0]
+        memo = {}
+        self.assertEqual(get_node_text(elem, memo=memo), u'му ха')
+        elem.text = 'changed'
+        self.assertEqual(get_node_text(elem, memo=memo), u'му ха')
+        self.assertEqual(get_node_text(elem, smart=True, memo=memo),
+                         u'changed му ха')
+        self.assertEqual(2, len(memo))
+
     def test_find_node_number(self):
         node = self.lxml_tree.xpath('//li[@id="num-1"]')[0]
         self.assertEqual(100, find_node_number(node))
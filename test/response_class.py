@@ -2,6 +2,7 @@
 from __future__ import absolute_import
 from unittest import TestCase
 from grab import Grab, DataNotFound, GrabMisuseError
+from grab.response import Response, CharsetMemo
 import os.path
 
 from .util import TEST_DIR, TMP_DIR, GRAB_TRANSPORT
@@ -65,3 +66,83 @@ class TestResponse(TestCase):
         ubody = g.response.unicode_body()
         self.assertTrue(u'тест' in ubody)
         self.assertTrue('<?xml' in ubody)
+
+    def test_headers(self):
+        response = Response()
+        response.head = ('HTTP/1.1 301 Moved Permanently\r\n'
+                         'Location: /foo\r\n\r\n'
+                         'HTTP/1.1 200 OK\r\n'
+                         'Content-Type: text/html; charset=cp1251\r\n'
+                         'Set-Cookie: a=1\r\n'
+                         'set-cookie: b=2\r\n'
+                         'X-Long: foo\r\n'
+                         ' bar\r\n\r\n')
+        response.body = ''
+        response.parse()
+        self.assertEqual('HTTP/1.1 200 OK', response.status)
+        self.assertEqual('cp1251', response.charset)
+        # Content-Type is found without parsing of headers
+        self.assertEqual(None, response.headers._items)
+        self.assertEqual('text/html; charset=cp1251',
+                         response.headers['content-type'])
+        self.assertEqual(None, response.headers['Location'])
+        self.assertFalse('Location' in response.headers)
+        self.assertEqual('a=1', response.headers['Set-Cookie'])
+        self.assertEqual(['a=1', 'b=2'], response.headers.getheaders('Set-Cookie'))
+        self.assertEqual('foo bar', response.headers.get('X-Long'))
+        self.assertEqual(4, len(response.headers))
+
+    def test_charset_detection(self):
+        def detect(body, head='HTTP/1.1 200 OK\r\n\r\n', memo=None):
+            response = Response()
+            response.head = head
+            response.body = body
+            response.url = 'http://h.com/'
+            response.parse()
+            if memo is not None:
+                response.detect_charset(memo=memo)
+            return response.charset
+
+        self.assertEqual('cp1251', detect('<meta charset="windows-1251">'))
+        self.assertEqual('cp1251', detect(
+            '<meta http-equiv="Content-Type" '
+            'content="text/html; charset=windows-1251">'))
+        self.assertEqual('koi8-r', detect(
+            '<?xml version="1.0" encoding="koi8-r"?><root></root>'))
+        self.assertEqual('utf-8', detect('\xef\xbb\xbf<meta charset="cp1251">'))
+        self.assertEqual('cp1251', detect(
+            '<html></html>', 'HTTP/1.1 200 OK\r\n'
+            'Content-Type: text/html; charset="cp1251"\r\n\r\n'))
+        self.assertEqual('utf-8', detect('<meta charset="unknown-charset">'))
+        self.assertEqual('utf-8', detect('<html></html>'))
+        # Other attributes before http-equiv
+        self.assertEqual('cp1251', detect(
+            '<meta name="x" http-equiv="Content-Type" '
+            'content="text/html; charset=windows-1251">'))
+        # No http-equiv attribute
+        self.assertEqual('cp1251', detect(
+            '<meta content="text/html; charset=windows-1251">'))
+
+        memo = CharsetMemo(threshold=2)
+        detect('<meta charset="koi8-r">', memo=memo)
+        self.assertEqual(None, memo.get('h.com'))
+        detect('<meta charset="koi8-r">', memo=memo)
+        self.assertEqual('koi8-r', memo.get('h.com'))
+        # The body is not scanned anymore
+        self.assertEqual('koi8-r', detect('<meta charset="cp1251">', memo=memo))
+        # Content-Type header overrides the memo and updates it
+        self.assertEqual('cp1251', detect(
+            '<html></html>', 'HTTP/1.1 200 OK\r\n'
+            'Content-Type: text/html; charset=cp1251\r\n\r\n', memo=memo))
+        self.assertEqual(None, memo.get('h.com'))
+        self.assertEqual('cp1251', detect('<meta charset="cp1251">', memo=memo))
+
+    def test_lazy_charset(self):
+        response = Response()
+        response.head = ''
+        response.body = '\xef\xbb\xbf<html>\xd1\x82\xd0\xb5\xd1\x81\xd1\x82</html>'
+        response.parse()
+        self.assertEqual(None, response._charset)
+        self.assertEqual(u'<html>\u0442\u0435\u0441\u0442</html>',
+                         response.unicode_body())
+        self.assertEqual('utf-8', response.charset)
@@ -7,6 +7,9 @@ root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 sys.path.insert(0, root)
 
 from grab.selector import Selector, TextSelector
+from grab.selector.query import QueryRegistry
+from grab.selector.schema import Schema, Group, Value
+from grab.error import DataNotFound
 from lxml.html import fromstring
 
 HTML = """
@@ -97,3 +100,119 @@ class TestSelectorList(TestCase):
 
         sel = Selector(self.tree).select('//li[5]')
         self.assertEquals(False, sel.exists())
+
+    def test_lazy_wrapping(self):
+        sel = Selector(self.tree).select('//li')
+        self.assertEquals(6, len(sel.nodes))
+        self.assertTrue(isinstance(sel[0], Selector))
+        self.assertEquals(['one', 'two'], [x.text() for x in sel[:2]])
+        self.assertEquals(6, len(list(sel)))
+        self.assertEquals(sel.nodes, [x.node for x in sel.items])
+        self.assertRaises(AttributeError, setattr, sel[0], 'foo', 1)
+
+    def test_select_combined(self):
+        root = Selector(self.tree)
+        sel = root.select('//ul').select('./li[1]')
+        self.assertEquals('(//ul)/./li[1]', sel.query_exp)
+        self.assertEquals(['one', 'yet one'], sel.text_list())
+        sel = root.select('//ul').select('./li').select('@class')
+        self.assertEquals(['li-1', 'li-2'], sel.text_list())
+        self.assertEquals(['6'], root.select('//ul').select('li/@id').text_list())
+
+    def test_select_not_combined(self):
+        root = Selector(self.tree)
+        sel = root.select('//ul').select('./li[1] | ./li[@class="li-2"]')
+        self.assertEquals(['one', 'yet one', 'yet two'], sel.text_list())
+        sel = root.select('//ul').select('//h1')
+        self.assertEquals(['test', 'test'], sel.text_list())
+        self.assertEquals(0, root.select('//table').select('./tr').count())
+
+    def test_select_nested_not_combined(self):
+        root = Selector(fromstring(
+            '<div class="x"><div class="x"><a>1</a></div><a>2</a></div>'))
+        sel = root.select('//div[@class="x"]')
+        self.assertEquals(['1', '2', '1'], sel.select('.//a').text_list())
+        self.assertEquals(['1', '2', '1'], sel.select('.//a[1]').text_list())
+        # Child nodes are returned in order of the list nodes
+        self.assertEquals(['2', '1'], sel.select('./a').text_list())
+        self.assertEquals('./a', sel.select('./a').query_exp)
+
+
+class TestQueryRegistry(TestCase):
+    def setUp(self):
+        self.tree = fromstring(HTML)
+
+    def test_lru(self):
+        registry = QueryRegistry(maxsize=2)
+        obj = registry.xpath('//li')
+        self.assertEqual(6, len(obj(self.tree)))
+        self.assertTrue(obj is registry.xpath('//li'))
+        registry.css('li.li-1')
+        # Recently used query is not removed
+        registry.xpath('//li')
+        registry.xpath('//h1')
+        self.assertTrue(obj is registry.xpath('//li'))
+        self.assertEqual(2, registry.stats()['size'])
+        self.assertEqual(3, registry.stats()['hits'])
+        self.assertEqual(3, registry.stats()['misses'])
+
+        # Queue of used keys does not grow when queries are reused
+        for x in xrange(1000):
+            registry.xpath('//li')
+            registry.xpath('//h1')
+        self.assertTrue(len(registry.queue) < 200)
+        registry.xpath('//li')
+        registry.xpath('//a')
+        self.assertEqual([('xpath', '//a'), ('xpath', '//li')],
+                         sorted(registry.cache.keys()))
+
+    def test_css(self):
+        registry = QueryRegistry()
+        self.assertEqual('yet one',
+                         registry.css('#second-list .li-1')(self.tree)[0].text)
+        self.assertTrue(registry.css('li') is registry.css('li'))
+        self.assertFalse(registry.css('li') is registry.css('li',
+                                                            translator='xml'))
+
+
+class TestSchema(TestCase):
+    def setUp(self):
+        self.tree = fromstring(HTML)
+
+    def test_extract(self):
+        schema = Schema({
+            'title': '//h1',
+            'number': ('//li[@id="6"]', lambda x: int(x.split()[1])),
+            'items': Value('//ul[1]/li', multiple=True),
+            'count': 'count(//li)',
+            'missing': Value('//table', default=None),
+            'lists': Group('//ul', {
+                'id': Value('@id', default=None),
+                'first': './li[1]',
+                'second': Value('.//li[@class="li-2"]', default=None),
+                'header': '//h1',
+            }),
+        })
+        self.assertEqual({
+            'title': 'test',
+            'number': 4,
+            'items': ['one', 'two', 'three', 'z 4 foo'],
+            'count': 6.0,
+            'missing': None,
+            'lists': [{'id': None, 'first': 'one', 'second': None,
+                       'header': 'test'},
+                      {'id': 'second-list', 'first': 'yet one',
+                       'second': 'yet two', 'header': 'test'}],
+        }, schema.extract(self.tree))
+        self.assertRaises(DataNotFound,
+                          Schema({'table': '//table'}).extract, self.tree)
+
+    def test_extract_tuple(self):
+        schema = Schema([
+            ('title', '//h1'),
+            ('lists', Group('//ul', [
+                ('class', Value('./li[1]/@class', default=None))])),
+        ])
+        self.assertEqual(('title', 'lists'), schema.names)
+        self.assertEqual(('test', [(None,), ('li-1',)]),
+                         schema.extract_tuple(Selector(self.tree)))
@@ -28,6 +28,11 @@ class SimpleSpider(Spider):
         pass
 
 
+class PageSpider(Spider):
+    def task_page(self, grab, task):
+        pass
+
+
 class TestSpiderCache(TestCase):
     def setUp(self):
         SERVER.reset()
@@ -75,3 +80,247 @@ class TestSpiderCache(TestCase):
         bot.setup_queue()
         bot.add_task(Task('foo', SERVER.BASE_URL))
         bot.run()
+
+
+    def run_page_spider(self, **kwargs):
+        bot = PageSpider()
+        bot.setup_cache(backend='mongo', database='spider_test', **kwargs)
+        bot.setup_queue()
+        bot.add_task(Task('page', SERVER.BASE_URL))
+        bot.run()
+        return bot
+
+    def test_cache_ttl(self):
+        db.cache.remove({})
+        self.run_page_spider(ttl=3600)
+        bot = self.run_page_spider(ttl=3600)
+        self.assertEqual(1, bot.counters['request-cache'])
+
+        db.cache.update({}, {'$set': {'timestamp': 0}}, multi=True)
+        bot = self.run_page_spider(ttl=3600)
+        self.assertEqual(1, bot.counters['request-cache-expired'])
+        self.assertEqual(1, bot.counters['request-network'])
+
+    def test_cache_task_ttl(self):
+        db.cache.remove({})
+        self.run_page_spider()
+        db.cache.update({}, {'$set': {'timestamp': 0}}, multi=True)
+
+        bot = self.run_page_spider(ttl=3600, task_ttl={'page': None})
+        self.assertEqual(1, bot.counters['request-cache'])
+
+        bot = self.run_page_spider(url_ttl=[('localhost', 3600)])
+        self.assertEqual(1, bot.counters['request-cache-expired'])
+
+    def test_cache_evict(self):
+        db.cache.remove({})
+        self.run_page_spider()
+        self.assertEqual(1, db.cache.count())
+        self.run_page_spider(max_size=0)
+        self.assertEqual(0, db.cache.count())
+
+    def test_cache_async_write(self):
+        db.cache.remove({})
+        bot = SimpleSpider()
+        bot.setup_cache(backend='mongo', database='spider_test',
+                        async_write=True)
+        bot.setup_queue()
+        bot.add_task(Task('foo', SERVER.BASE_URL))
+        bot.run()
+        # Two URLs: with and without trailing slash
+        self.assertEqual(2, db.cache.count())
+        self.assertEqual(None, bot.cache_writer)
+
+    def test_cache_prefetch(self):
+        class PrefetchSpider(Spider):
+            def task_generator(self):
+                for x in xrange(10):
+                    yield Task('page', url=SERVER.BASE_URL + '/?x=%d' % x)
+
+            def task_page(self, grab, task):
+                pass
+
+        db.cache.remove({})
+        for x in xrange(2):
+            bot = PrefetchSpider()
+            bot.setup_cache(backend='mongo', database='spider_test',
+                            prefetch=5)
+            bot.run()
+        self.assertEqual(0, bot.counters['request-network'])
+        self.assertEqual(10, bot.counters['request-cache'])
+        self.assertEqual(2, bot.counters['cache-prefetch'])
+        self.assertEqual(10, bot.counters['cache-prefetch-hit'])
+
+    def test_cache_dedup(self):
+        class DedupSpider(Spider):
+            def task_generator(self):
+                for x in xrange(4):
+                    yield Task('page', url=SERVER.BASE_URL + '/?x=%d' % x)
+
+            def task_page(self, grab, task):
+                pass
+
+        db.cache.remove({})
+        db.cache_body.remove({})
+        bot = DedupSpider()
+        bot.setup_cache(backend='mongo', database='spider_test')
+        bot.run()
+        # All pages have same body
+        self.assertEqual(4, db.cache.count())
+        self.assertEqual(1, db.cache_body.count())
+        self.assertEqual(4, db.cache_body.find_one()['refs'])
+        self.assertEqual(4.0, bot.cache.get_dedup_stats()['ratio'])
+
+        bot.cache.remove_cache_item(SERVER.BASE_URL + '/?x=0')
+        self.assertEqual(3, db.cache_body.find_one()['refs'])
+        bot.cache.evict(0)
+        self.assertEqual(0, db.cache.count())
+        self.assertEqual(0, db.cache_body.count())
+
+    def test_cache_dictionary_compression(self):
+        class PageListSpider(Spider):
+            def task_generator(self):
+                for x in xrange(25):
+                    yield Task('page', url=SERVER.BASE_URL + '/?x=%d' % x)
+
+            def task_page(self, grab, task):
+                pass
+
+        db.cache.remove({})
+        db.cache_body.remove({})
+        db.cache_dict.remove({})
+        # Each page should have unique body
+        SERVER.RESPONSE['get_callback'] = lambda handler: handler.write(
+            build_html() + handler.request.uri)
+        bot = PageListSpider()
+        bot.setup_cache(backend='mongo', database='spider_test',
+                        use_compression='dict')
+        bot.run()
+        self.assertEqual(1, db.cache_dict.count())
+        self.assertEqual(5, db.cache_body.find({'dict_id': {'$ne': None}})\
+                              .count())
+
+        bot = PageListSpider()
+        bot.setup_cache(backend='mongo', database='spider_test',
+                        use_compression='dict')
+        bot.run()
+        self.assertEqual(25, bot.counters['request-cache'])
+
+    def test_cache_large_body(self):
+        from grab.spider.cache_backend import mongo
+
+        old_chunk_size = mongo.CHUNK_SIZE
+        mongo.CHUNK_SIZE = 100
+        try:
+            body = ''.join('<p>%d</p>' % x for x in xrange(1000))
+            SERVER.RESPONSE['get'] = body
+            for use_compression in (False, True):
+                db.cache.remove({})
+                db.cache_body.remove({})
+                db.cache_chunk.remove({})
+                self.run_page_spider(use_compression=use_compression)
+                bot = self.run_page_spider(use_compression=use_compression)
+                self.assertEqual(1, bot.counters['request-cache'])
+                self.assertTrue(db.cache_chunk.count() > 1)
+                item = bot.cache.get_item(SERVER.BASE_URL)
+                self.assertEqual(None, item['body'])
+
+                class CheckSpider(PageSpider):
+                    def task_page(self, grab, task):
+                        self.body = grab.response.body
+
+                bot = CheckSpider()
+                bot.setup_cache(backend='mongo', database='spider_test',
+                                use_compression=use_compression)
+                bot.setup_queue()
+                bot.add_task(Task('page', SERVER.BASE_URL))
+                bot.run()
+                self.assertEqual(body, bot.body)
+
+            bot.cache.remove_cache_item(SERVER.BASE_URL)
+            self.assertEqual(0, db.cache_body.count())
+            self.assertEqual(0, db.cache_chunk.count())
+        finally:
+            mongo.CHUNK_SIZE = old_chunk_size
+
+
+class MysqlCacheUpgradeTestCase(TestCase):
+    def test_upgrade(self):
+        import MySQLdb
+        from grab.spider.cache_backend.mysql import CacheBackend
+
+        conn = MySQLdb.connect(user='web', passwd='web-**', db='spider_test')
+        cursor = conn.cursor()
+        for table in ('cache', 'cache_body', 'cache_dict'):
+            cursor.execute('drop table if exists %s' % table)
+        # Table which is created by previous versions of grab
+        cursor.execute('''
+            create table cache (
+                id binary(20) not null,
+                data mediumblob not null,
+                primary key (id)
+            ) engine = innodb
+        ''')
+        for x in xrange(2):
+            CacheBackend(database='spider_test', user='web', passwd='web-**')
+        cursor.execute('show columns from cache_body')
+        self.assertTrue('dict_id' in [x[0] for x in cursor])
+        cursor.execute('show tables')
+        self.assertTrue('cache_dict' in [x[0] for x in cursor])
+        conn.close()
+
+
+class ConnectionPoolTestCase(TestCase):
+    def test_pool_size(self):
+        from grab.spider.cache_backend.mysql import ConnectionPool
+
+        class Connection(object):
+            def cursor(self):
+                return self
+
+            def rollback(self):
+                pass
+
+        pool = ConnectionPool(Connection, size=2)
+        with pool.cursor() as cursor1:
+            with pool.cursor() as cursor2:
+                self.assertNotEqual(cursor1, cursor2)
+        with pool.cursor() as cursor3:
+            self.assertTrue(cursor3 in (cursor1, cursor2))
+        self.assertEqual(2, pool.created)
+
+        try:
+            with pool.cursor() as cursor:
+                raise ValueError
+        except ValueError:
+            pass
+        # Connection is returned to the pool after rollback
+        self.assertEqual(2, pool.free.qsize())
+
+    def test_rollback_error(self):
+        from grab.spider.cache_backend.mysql import ConnectionPool
+
+        class Connection(object):
+            closed = False
+
+            def cursor(self):
+                return self
+
+            def rollback(self):
+                raise RuntimeError('Connection lost')
+
+            def close(self):
+                self.closed = True
+
+        pool = ConnectionPool(Connection, size=1)
+        try:
+            with pool.cursor() as cursor:
+                raise ValueError
+        except ValueError:
+            pass
+        # Connection is closed, the original error is raised
+        self.assertTrue(cursor.closed)
+        self.assertEqual(0, pool.created)
+        self.assertEqual(0, pool.free.qsize())
+        with pool.cursor() as cursor2:
+            self.assertNotEqual(cursor, cursor2)
@@ -0,0 +1,83 @@
+from unittest import TestCase
+
+from grab.spider.cache_compression import (DictionaryCompressor,
+                                           build_dictionary)
+
+def build_page(x):
+    return """<html><head><title>Page %d</title>
+    <link rel="stylesheet" href="/static/main.css"></head>
+    <body><div class="menu"><a href="/">Home</a><a href="/about">About</a>
+    </div><p>Content %d</p></body></html>""" % (x, x * 7)
+
+
+class DictStorage(object):
+    def __init__(self):
+        self.dictionaries = {}
+
+    def load_dictionary(self, dict_id):
+        return self.dictionaries.get(dict_id, (None, None))[1]
+
+    def find_dictionary(self, host):
+        for dict_id, (dict_host, data) in self.dictionaries.items():
+            if dict_host == host:
+                return dict_id, data
+        return None
+
+    def save_dictionary(self, dict_id, host, data):
+        self.dictionaries[dict_id] = (host, data)
+
+
+class CacheCompressionTestCase(TestCase):
+    def test_build_dictionary(self):
+        data = build_dictionary([build_page(x) for x in xrange(3)])
+        self.assertTrue('<a href="/about">' in data)
+        self.assertFalse('Page 1' in data)
+        self.assertTrue(len(build_dictionary([build_page(1)] * 2, 10)) <= 10)
+
+    def test_compress(self):
+        storage = DictStorage()
+        comp = DictionaryCompressor(storage, sample_number=3)
+        result = [comp.compress('http://h.com/%d' % x, build_page(x))
+                  for x in xrange(5)]
+        # First bodies are compressed before the dictionary is built
+        self.assertEqual([None] * 3, [x[0] for x in result[:3]])
+        self.assertEqual(1, len(storage.dictionaries))
+        dict_id = storage.dictionaries.keys()[0]
+        self.assertEqual([dict_id] * 2, [x[0] for x in result[3:]])
+
+        # Dictionary is loaded from the storage
+        comp = DictionaryCompressor(storage)
+        for x, (dict_id, data) in enumerate(result):
+            self.assertEqual(build_page(x), comp.decompress(dict_id, data))
+        dict_id, data = comp.compress('http://h.com/', build_page(10))
+        self.assertEqual(result[3][0], dict_id)
+        self.assertEqual(None, comp.compress('http://other.com/', 'x')[0])
+
+    def test_sample_limits(self):
+        storage = DictStorage()
+        comp = DictionaryCompressor(storage, sample_number=3, sample_size=100,
+                                    sample_hosts=2, sample_memory=250)
+        for x in xrange(5):
+            comp.compress('http://h%d.com/' % x, build_page(x))
+        # Only two most recently seen hosts are sampled
+        self.assertEqual(['h3.com', 'h4.com'], sorted(comp.samples.keys()))
+        self.assertEqual([100], [len(x) for x in comp.samples['h4.com']])
+        self.assertEqual(200, comp.sample_bytes)
+
+        # Memory limit drops samples of the least recently seen host
+        comp.compress('http://h4.com/1', build_page(1))
+        self.assertEqual(['h4.com'], comp.samples.keys())
+        self.assertEqual(200, comp.sample_bytes)
+
+        # Samples of the host are released when its dictionary is built
+        comp.compress('http://h4.com/2', build_page(2))
+        self.assertEqual(0, len(comp.samples))
+        self.assertEqual(0, comp.sample_bytes)
+        self.assertEqual(1, len(storage.dictionaries))
+
+        # Host which got new sample is not dropped
+        comp = DictionaryCompressor(storage, sample_number=3, sample_size=100,
+                                    sample_hosts=2)
+        for host in ('a.com', 'b.com', 'a.com', 'c.com'):
+            comp.compress('http://%s/' % host, build_page(0))
+        self.assertEqual(['a.com', 'c.com'], sorted(comp.samples.keys()))
@@ -0,0 +1,72 @@
+from unittest import TestCase
+import tempfile
+import os
+
+from grab.spider.cache_migration import migrate_cache, parse_options
+
+class SourceCache(object):
+    def __init__(self, count):
+        self.items = [{'url': 'http://h.com/%d' % x, 'body': str(x)}
+                      for x in xrange(count)]
+
+    def count_items(self):
+        return len(self.items)
+
+    def iter_batches(self, start_key=None, batch_size=1000):
+        position = start_key or 0
+        while position < len(self.items):
+            batch = self.items[position:position + batch_size]
+            position += len(batch)
+            yield position, batch
+
+
+class DestinationCache(object):
+    def __init__(self, fail_batches=()):
+        self.items = {}
+        self.fail_batches = set(fail_batches)
+
+    def save_items(self, items):
+        if items[0]['body'] in self.fail_batches:
+            raise Exception('Database is down')
+        for item in items:
+            self.items[item['url']] = item
+
+
+class CacheMigrationTestCase(TestCase):
+    def test_migrate(self):
+        source = SourceCache(95)
+        destination = DestinationCache()
+        count = migrate_cache(source, destination, batch_size=10,
+                              thread_number=3)
+        self.assertEqual(95, count)
+        self.assertEqual(source.items,
+                         sorted(destination.items.values(),
+                                key=lambda x: int(x['body'])))
+
+    def test_checkpoint(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        os.unlink(path)
+        try:
+            source = SourceCache(95)
+            # Batch which starts with 50th item could not be saved
+            destination = DestinationCache(fail_batches=['50'])
+            self.assertRaises(RuntimeError, migrate_cache, source,
+                              destination, batch_size=10, thread_number=1,
+                              checkpoint_path=path)
+            self.assertFalse('http://h.com/50' in destination.items)
+
+            destination = DestinationCache()
+            count = migrate_cache(source, destination, batch_size=10,
+                                  checkpoint_path=path)
+            self.assertEqual(95, count)
+            # Items before the checkpoint are not copied again
+            self.assertEqual(45, len(destination.items))
+            self.assertTrue('http://h.com/50' in destination.items)
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def test_parse_options(self):
+        self.assertEqual({'user': 'web', 'port': 3306},
+                         parse_options(['user=web', 'port=3306']))
@@ -0,0 +1,192 @@
+from unittest import TestCase
+import tempfile
+import shutil
+import os
+
+from grab.spider import Spider, Task
+from grab.spider.cache_backend.segment import CacheBackend
+from .tornado_util import SERVER
+
+
+def build_item(number, body=None):
+    return {
+        'url': 'http://h.com/%d' % number,
+        'response_url': 'http://h.com/%d' % number,
+        'body': body or '<html>page #%d</html>' % number,
+        'head': 'HTTP/1.1 200 OK\r\n\r\n',
+        'response_code': 200,
+        'cookies': None,
+        'timestamp': 1000 + number,
+    }
+
+
+class SimpleSpider(Spider):
+    def task_page(self, grab, task):
+        self.SAVED_ITEM = grab.response.body
+
+
+class CountSpider(Spider):
+    def prepare(self):
+        self.counts = []
+
+    def task_page(self, grab, task):
+        self.counts.append(self.cache.count_items())
+
+
+class SegmentCacheTestCase(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def open_cache(self, **kwargs):
+        kwargs.setdefault('background_compaction', False)
+        return CacheBackend(database=self.path, **kwargs)
+
+    def test_save_and_load(self):
+        cache = self.open_cache()
+        cache.save_items([build_item(x) for x in xrange(100)])
+        cache.save_items([build_item(5, 'new body')])
+        cache.remove_cache_item('http://h.com/6')
+        self.assertEqual('new body', cache.get_item('http://h.com/5')['body'])
+        self.assertEqual(None, cache.get_item('http://h.com/6'))
+        self.assertEqual(99, cache.count_items())
+        items = cache.get_items(['http://h.com/1', 'http://h.com/6'])
+        self.assertEqual(['http://h.com/1'], items.keys())
+
+        # Part of changes is saved into the index
+        cache.flush()
+        cache.save_items([build_item(7, 'new body')])
+        cache.remove_cache_item('http://h.com/8')
+        cache.close()
+
+        cache = self.open_cache()
+        self.assertEqual(98, cache.count_items())
+        self.assertEqual('new body', cache.get_item('http://h.com/5')['body'])
+        self.assertEqual('new body', cache.get_item('http://h.com/7')['body'])
+        self.assertEqual(None, cache.get_item('http://h.com/8'))
+        self.assertEqual('<html>page #9</html>',
+                         cache.get_item('http://h.com/9')['body'])
+        items = [x for key, batch in cache.iter_batches(batch_size=30)
+                 for x in batch]
+        self.assertEqual(98, len(items))
+
+    def test_recovery(self):
+        cache = self.open_cache()
+        cache.save_items([build_item(x) for x in xrange(10)])
+        cache.flush()
+        cache.save_items([build_item(x) for x in xrange(10, 20)])
+        # Process is killed while the record is written
+        path = cache.segment_path(cache.active_segment)
+        cache.writer.write('broken record')
+        cache.writer.flush()
+        size = os.path.getsize(path)
+
+        cache = self.open_cache()
+        self.assertEqual(20, cache.count_items())
+        self.assertEqual('<html>page #15</html>',
+                         cache.get_item('http://h.com/15')['body'])
+        self.assertTrue(os.path.getsize(path) < size)
+
+    def test_index_files(self):
+        cache = self.open_cache()
+        for x in xrange(50):
+            cache.save_items([build_item(x)])
+            if x % 2:
+                cache.remove_cache_item('http://h.com/%d' % (x - 1))
+            cache.flush()
+        # Small index files are merged, so there are only a few of them
+        self.assertTrue(len(cache.index_files) < 10)
+        self.assertEqual(25, cache.count_items())
+        self.assertEqual(None, cache.get_item('http://h.com/10'))
+        self.assertTrue(cache.get_item('http://h.com/11') is not None)
+        # Only entries of live items are stored in the oldest file
+        self.assertTrue(cache.index_files[0].count <= 50)
+        number = cache.index_files[0].number
+        cache.close()
+
+        # Merged files are left if the process was killed
+        # during the merge
+        shutil.copy(cache.index_path(number), cache.index_path(number - 1))
+        cache = self.open_cache()
+        self.assertFalse(os.path.exists(cache.index_path(number - 1)))
+        self.assertEqual(25, cache.count_items())
+        self.assertEqual(None, cache.get_item('http://h.com/10'))
+        batches = list(cache.iter_batches(batch_size=10))
+        self.assertEqual([10, 10, 5], [len(x) for key, x in batches])
+        urls = [x['url'] for x in batches[2][1]]
+        batches = list(cache.iter_batches(start_key=batches[1][0],
+                                          batch_size=10))
+        self.assertEqual(urls, [item['url'] for key, batch in batches
+                                for item in batch])
+
+    def test_compaction(self):
+        cache = self.open_cache(segment_size=1000, use_compression=False)
+        cache.save_items([build_item(x) for x in xrange(50)])
+        segment_number = len(cache.segments)
+        for x in xrange(40):
+            cache.remove_cache_item('http://h.com/%d' % x)
+        self.assertTrue(cache.compact() > 0)
+        self.assertTrue(len(cache.segments) < segment_number)
+        self.assertEqual(10, cache.count_items())
+        for x in xrange(40, 50):
+            self.assertEqual(build_item(x)['body'],
+                             cache.get_item('http://h.com/%d' % x)['body'])
+        cache.close()
+
+        cache = self.open_cache()
+        self.assertEqual(10, cache.count_items())
+        self.assertEqual(build_item(45)['body'],
+                         cache.get_item('http://h.com/45')['body'])
+
+    def test_evict(self):
+        cache = self.open_cache()
+        cache.save_items([build_item(x) for x in xrange(10)])
+        size = len(build_item(0)['body']) + len(build_item(0)['head'])
+        self.assertEqual(7, cache.evict(size * 3))
+        self.assertEqual(3, cache.count_items())
+        self.assertEqual(None, cache.get_item('http://h.com/6'))
+        self.assertTrue(cache.get_item('http://h.com/7') is not None)
+
+    def test_dictionary_compression(self):
+        cache = self.open_cache(use_compression='dict')
+        body = '<html><div class="menu">%s</div>%%d</html>' % ('menu item' * 50)
+        cache.save_items([build_item(x, body % x) for x in xrange(50)])
+        cache.close()
+        cache = self.open_cache(use_compression='dict')
+        self.assertEqual(body % 45, cache.get_item('http://h.com/45')['body'])
+
+    def test_spider(self):
+        SERVER.reset()
+        SERVER.RESPONSE['get'] = 'Hello cache!'
+        bot = SimpleSpider()
+        bot.setup_cache(backend='segment', database=self.path)
+        bot.setup_queue()
+        bot.add_task(Task('page', SERVER.BASE_URL))
+        bot.run()
+        bot.cache.close()
+
+        SERVER.RESPONSE['get'] = 'Changed'
+        bot = SimpleSpider()
+        bot.setup_cache(backend='segment', database=self.path)
+        bot.setup_queue()
+        bot.add_task(Task('page', SERVER.BASE_URL))
+        bot.run()
+        self.assertEqual('Hello cache!', bot.SAVED_ITEM)
+        self.assertEqual(1, bot.counters['request-cache'])
+        bot.cache.close()
+
+    def test_spider_evict(self):
+        SERVER.reset()
+        bot = CountSpider()
+        bot.setup_cache(backend='segment', database=self.path, max_size=0,
+                        evict_interval=1)
+        bot.setup_queue()
+        for x in xrange(2):
+            bot.add_task(Task('page', SERVER.BASE_URL + '?%d' % x))
+        bot.run()
+        # Items are removed during the work of the spider
+        self.assertEqual([0, 0], bot.counts)
+        self.assertEqual(2, bot.counters['cache-evicted'])
+        bot.cache.close()
@@ -0,0 +1,66 @@
+from unittest import TestCase
+import time
+
+from grab.spider.cache_writer import CacheWriter
+
+class ListCache(object):
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.batches = []
+
+    def save_items(self, items):
+        time.sleep(self.delay)
+        self.batches.append(items)
+
+    def evict(self, max_size):
+        self.batches = self.batches[-max_size:]
+        return 1
+
+
+class BrokenCache(object):
+    def save_items(self, items):
+        raise Exception('Database is down')
+
+
+class TestCacheWriter(TestCase):
+    def test_flush_on_stop(self):
+        cache = ListCache(delay=0.01)
+        writer = CacheWriter(cache, batch_size=10)
+        writer.start()
+        for x in xrange(55):
+            writer.put({'url': x})
+        writer.stop()
+        urls = [x['url'] for batch in cache.batches for x in batch]
+        self.assertEqual(range(55), urls)
+        self.assertEqual(55, writer.saved_count)
+        self.assertTrue(all(len(x) <= 10 for x in cache.batches))
+
+    def test_batching(self):
+        cache = ListCache()
+        writer = CacheWriter(cache, batch_size=100)
+        for x in xrange(50):
+            writer.put({'url': x})
+        # All items are already in the queue when thread starts
+        writer.start()
+        writer.stop()
+        self.assertEqual(1, len(cache.batches))
+
+    def test_evict(self):
+        cache = ListCache()
+        writer = CacheWriter(cache, batch_size=10, max_size=2,
+                             evict_interval=25)
+        for x in xrange(55):
+            writer.put({'url': x})
+        writer.start()
+        writer.stop()
+        # Cache is evicted after 30 and 55 saved items
+        self.assertEqual(2, writer.evicted_count)
+        self.assertEqual([40, 50], [x[0]['url'] for x in cache.batches])
+
+    def test_error(self):
+        writer = CacheWriter(BrokenCache())
+        writer.start()
+        writer.put({'url': 1})
+        writer.stop()
+        self.assertEqual(1, writer.error_count)
+        self.assertEqual(0, writer.saved_count)
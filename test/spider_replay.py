@@ -0,0 +1,77 @@
+from unittest import TestCase
+import tempfile
+import shutil
+
+from grab.spider import Spider, Task
+from grab.spider.error import SpiderError
+from grab.tools.warc import WarcWriter
+
+
+class FakeResponse(object):
+    def __init__(self, url, body):
+        self.url = url
+        self.head = 'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n'
+        self.body = body
+
+
+class FakeGrab(object):
+    def __init__(self, url, body):
+        self.response = FakeResponse(url, body)
+        self.request_head = None
+
+
+class ReplaySpider(Spider):
+    initial_urls = ['http://h.com/0']
+
+    def task_initial(self, grab, task):
+        for elem in grab.doc.select('//a'):
+            yield Task('page', url=elem.attr('href'))
+
+    def task_page(self, grab, task):
+        self.add_item('titles', grab.doc.select('//title').text())
+
+
+class BrokenSpider(Spider):
+    initial_urls = ['http://h.com/0']
+
+    def task_initial(self, grab, task):
+        raise Exception('Parser is broken')
+
+
+class ReplayTestCase(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        writer = WarcWriter(self.path)
+        links = ''.join('<a href="/%d">link</a>' % x for x in xrange(1, 51))
+        writer.write_response('http://h.com/0', FakeGrab(
+            'http://h.com/0', '<html><body>%s</body></html>' % links))
+        # Last page is not in the cache
+        for x in xrange(1, 50):
+            url = 'http://h.com/%d' % x
+            writer.write_response(url, FakeGrab(
+                url, '<html><title>page %d</title></html>' % x))
+        writer.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_replay(self):
+        bot = ReplaySpider()
+        bot.base_url = 'http://h.com/'
+        bot.setup_cache(backend='warc', database=self.path)
+        bot.run_replay(process_number=3)
+        self.assertEqual(sorted('page %d' % x for x in xrange(1, 50)),
+                         sorted(bot.items['titles']))
+        self.assertEqual(50, bot.counters['request-cache'])
+        self.assertEqual(1, bot.counters['replay-cache-miss'])
+        self.assertEqual(49, bot.counters['task-page-ok'])
+
+    def test_handler_error(self):
+        bot = BrokenSpider()
+        bot.setup_cache(backend='warc', database=self.path)
+        bot.run_replay(process_number=2)
+        self.assertEqual(1, bot.counters['error-exception'])
+
+    def test_cache_required(self):
+        bot = ReplaySpider()
+        self.assertRaises(SpiderError, bot.run_replay)
@@ -0,0 +1,110 @@
+from unittest import TestCase
+from datetime import datetime
+from StringIO import StringIO
+import gzip
+
+from grab.spider import Spider
+from grab.tools.sitemap import (parse_lastmod, find_robots_sitemaps,
+                                iter_sitemap)
+from .tornado_util import SERVER
+
+URLSET = '<?xml version="1.0" encoding="UTF-8"?>'\
+         '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'\
+         '%s</urlset>'
+INDEX = '<?xml version="1.0" encoding="UTF-8"?>'\
+        '<sitemapindex '\
+        'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'\
+        '%s</sitemapindex>'
+
+
+def build_urlset(urls):
+    return URLSET % ''.join('<url><loc>%s</loc><lastmod>%s</lastmod></url>'
+                            % x for x in urls)
+
+
+def compress(data):
+    out = StringIO()
+    gz = gzip.GzipFile(fileobj=out, mode='wb')
+    gz.write(data)
+    gz.close()
+    return out.getvalue()
+
+
+class SimpleSpider(Spider):
+    def task_page(self, grab, task):
+        pass
+
+
+class SitemapTestCase(TestCase):
+    def setUp(self):
+        SERVER.reset()
+        base = SERVER.BASE_URL
+        self.files = {
+            '/robots.txt': 'User-agent: *\nDisallow: /admin\n'
+                           'Sitemap: %s/index.xml\n' % base,
+            '/index.xml': INDEX % (
+                '<sitemap><loc>%s/s1.xml.gz</loc></sitemap>'
+                '<sitemap><loc>%s/s2.xml</loc>'
+                '<lastmod>2012-01-01</lastmod></sitemap>'
+                '<sitemap><loc>%s/missing.xml</loc></sitemap>'
+                % (base, base, base)),
+            '/s1.xml.gz': compress(build_urlset(
+                ('%s/%d' % (base, x), '2013-01-%02dT10:00:00+04:00' % (x + 1))
+                for x in xrange(10))),
+            '/s2.xml': build_urlset([('%s/old' % base, '2012-01-01')]),
+        }
+
+        def handler(request_handler):
+            path = request_handler.request.path
+            if path in self.files:
+                request_handler.write(self.files[path])
+            elif path.endswith('.xml'):
+                request_handler.set_status(404)
+            else:
+                request_handler.write('page')
+        SERVER.RESPONSE['get_callback'] = handler
+
+    def test_parse_lastmod(self):
+        self.assertEqual(datetime(2013, 1, 1), parse_lastmod('2013'))
+        self.assertEqual(datetime(2013, 1, 7), parse_lastmod('2013-01-07'))
+        self.assertEqual(datetime(2013, 1, 7, 8, 30),
+                         parse_lastmod('2013-01-07T12:30+04:00'))
+        self.assertEqual(datetime(2013, 1, 7, 12, 30, 15),
+                         parse_lastmod(' 2013-01-07T12:30:15.45Z '))
+        self.assertEqual(None, parse_lastmod('07.01.2013'))
+        self.assertEqual(None, parse_lastmod(None))
+
+    def test_iter_sitemap(self):
+        self.assertEqual(['http://h.com/sitemap.xml'], find_robots_sitemaps(
+            'User-agent: *\nsitemap:  http://h.com/sitemap.xml\n'))
+        entries = list(iter_sitemap(StringIO(self.files['/index.xml'])))
+        self.assertEqual(3, len(entries))
+        self.assertEqual(('sitemap', '%s/s2.xml' % SERVER.BASE_URL,
+                          datetime(2012, 1, 1)), entries[1])
+
+    def test_sitemap_tasks(self):
+        bot = SimpleSpider()
+        tasks = list(bot.iter_sitemap_tasks(
+            'page', SERVER.BASE_URL + '/robots.txt', foo='bar'))
+        self.assertEqual(11, len(tasks))
+        self.assertEqual('%s/0' % SERVER.BASE_URL, tasks[0].url)
+        self.assertEqual('bar', tasks[0].foo)
+        self.assertEqual(3, bot.counters['sitemap'])
+
+        # Filter pages by lastmod
+        urls = list(bot.iter_sitemap_urls(SERVER.BASE_URL + '/index.xml',
+                                          since=datetime(2013, 1, 5)))
+        self.assertEqual(['%s/%d' % (SERVER.BASE_URL, x)
+                          for x in xrange(4, 10)], urls)
+
+    def test_task_generator(self):
+        class SitemapSpider(SimpleSpider):
+            def task_generator(self):
+                for task in self.iter_sitemap_tasks(
+                        'page', SERVER.BASE_URL + '/index.xml'):
+                    yield task
+
+        bot = SitemapSpider()
+        bot.setup_queue()
+        bot.run()
+        self.assertEqual(11, bot.counters['task-page-ok'])
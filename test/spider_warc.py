@@ -0,0 +1,118 @@
+from unittest import TestCase
+import tempfile
+import shutil
+import os
+
+from grab.spider import Spider, Task
+from grab.tools.warc import WarcWriter, iter_records
+from grab.spider.cache_backend.warc import CacheBackend
+from .tornado_util import SERVER
+
+
+class SimpleSpider(Spider):
+    def prepare(self):
+        self.bodies = []
+
+    def task_page(self, grab, task):
+        self.bodies.append(grab.response.body)
+
+
+class FakeResponse(object):
+    def __init__(self, url, body):
+        self.url = url
+        self.head = 'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n'
+        self.body = body
+
+
+class FakeGrab(object):
+    def __init__(self, url, body):
+        self.response = FakeResponse(url, body)
+        self.request_head = 'GET / HTTP/1.1\r\nHost: h.com\r\n\r\n'
+        self.request_body = None
+
+
+class WarcTestCase(TestCase):
+    def setUp(self):
+        SERVER.reset()
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_write_and_read(self):
+        writer = WarcWriter(self.path, max_size=1000)
+        for x in xrange(10):
+            url = 'http://h.com/%d' % x
+            writer.write_response(url, FakeGrab(url, 'body-%d' % x * 50))
+        # Updated version of the document
+        writer.write_response('http://h.com/1', FakeGrab('http://h.com/1',
+                                                         'new body'),
+                              timestamp=2000000000)
+        writer.close()
+        files = sorted(os.listdir(self.path))
+        self.assertTrue(len(files) > 1)
+        types = [x[2]['WARC-Type'] for fname in files
+                 for x in iter_records(os.path.join(self.path, fname))]
+        self.assertEqual(11, types.count('response'))
+        self.assertEqual(11, types.count('request'))
+
+        cache = CacheBackend(database=self.path)
+        self.assertEqual(10, cache.count_items())
+        item = cache.get_item('http://h.com/5')
+        self.assertEqual('body-5' * 50, item['body'])
+        self.assertEqual(200, item['response_code'])
+        self.assertEqual('new body', cache.get_item('http://h.com/1')['body'])
+        self.assertEqual(None, cache.get_item('http://h.com/50'))
+        # Only the most recent record of the URL is returned
+        items = [x for key, batch in cache.iter_batches(batch_size=3)
+                 for x in batch]
+        self.assertEqual(10, len(items))
+        self.assertEqual(['new body'], [x['body'] for x in items
+                                        if x['url'] == 'http://h.com/1'])
+        cache.remove_cache_item('http://h.com/1')
+        self.assertEqual('new body', cache.get_item('http://h.com/1')['body'])
+
+    def test_unicode_url(self):
+        url = u'http://h.com/\u043f'
+        writer = WarcWriter(self.path)
+        writer.write_response(url, FakeGrab(url, '\xd0\xbf\xd1\x80'))
+        writer.close()
+        cache = CacheBackend(database=self.path)
+        item = cache.get_item(url)
+        self.assertEqual('\xd0\xbf\xd1\x80', item['body'])
+        self.assertEqual(url.encode('utf-8'), item['url'])
+
+    def test_spider_write_error(self):
+        class BrokenWriter(object):
+            def write_response(self, url, grab):
+                raise IOError('No space left on device')
+
+            def close(self):
+                pass
+
+        SERVER.RESPONSE['get'] = 'Hello WARC!'
+        bot = SimpleSpider()
+        bot.warc_writer = BrokenWriter()
+        bot.setup_queue()
+        bot.add_task(Task('page', SERVER.BASE_URL))
+        bot.run()
+        self.assertEqual(['Hello WARC!'], bot.bodies)
+        self.assertEqual(1, bot.counters['warc-error'])
+
+    def test_spider(self):
+        SERVER.RESPONSE['get'] = 'Hello WARC!'
+        bot = SimpleSpider()
+        bot.setup_warc(self.path)
+        bot.setup_queue()
+        bot.add_task(Task('page', SERVER.BASE_URL))
+        bot.run()
+        self.assertEqual(['Hello WARC!'], bot.bodies)
+
+        SERVER.RESPONSE['get'] = 'Changed'
+        bot = SimpleSpider(only_cache=True)
+        bot.setup_cache(backend='warc', database=self.path)
+        bot.setup_queue()
+        bot.add_task(Task('page', SERVER.BASE_URL))
+        bot.run()
+        self.assertEqual(['Hello WARC!'], bot.bodies)
+        self.assertEqual(1, bot.counters['request-cache'])
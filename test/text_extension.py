@@ -49,6 +49,26 @@ class TextExtensionTest(TestCase):
         self.assertTrue(self.g.search(u'фыва'))
         self.assertFalse(self.g.search(u'фыва2'))
 
+    def test_search_without_decoding(self):
+        self.assertTrue(self.g.search(u'пче</strong>'))
+        self.assertFalse(self.g.search(u'€'))
+        self.assertEqual(None, self.g.response._unicode_body)
+
+        # Entities are fixed in the unicode body
+        self.g.fake_response('<b>&#150;</b>', charset='cp1251')
+        self.assertTrue(self.g.search(u'&#8211;'))
+
+        # UTF-16 body is decoded
+        self.g.fake_response(u'<b>фыва</b>'.encode('utf-16'), charset='utf-16')
+        self.assertTrue(self.g.search(u'фыва'))
+
+    def test_search_stateful_charset(self):
+        # Encoded substring has its own escape sequences
+        self.g.fake_response(u'<b>日本語</b>'.encode('iso-2022-jp'),
+                             charset='iso-2022-jp')
+        self.assertTrue(self.g.search(u'本語'))
+        self.assertFalse(self.g.search(u'B'))
+
     def test_search_usage_errors(self):
         self.assertRaises(GrabMisuseError,
             lambda: self.g.search(u'фыва', byte=True))
@@ -76,6 +96,18 @@ class TextExtensionTest(TestCase):
         rex = re.compile(u'(фыва2)', re.U)
         self.assertRaises(DataNotFound, lambda: self.g.rex(rex))
 
+    def test_rex_scan(self):
+        hits = self.g.rex_scan({'bee': u'<em id="bee-em">([^<]+)',
+                                'li': re.compile(u'<li id="num-(\\d)">', re.U),
+                                'none': u'фыва2'})
+        self.assertEqual(u'ла', hits['bee'][0].group(1))
+        self.assertEqual(['1', '2'], [x.group(1) for x in hits['li']])
+        self.assertEqual([], hits['none'])
+
+        hits = self.g.rex_scan({'title': u'<title>(фыва)'.encode('cp1251')},
+                               byte=True)
+        self.assertEqual(u'фыва'.encode('cp1251'), hits['title'][0].group(1))
+
     def test_assert_substring(self):
         self.g.assert_substring(u'фыва')
         self.g.assert_substring(u'фыва'.encode('cp1251'), byte=True)
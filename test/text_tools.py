@@ -29,3 +29,4 @@ class TextExtensionTest(TestCase):
         self.assertEqual(u'тр и гла за', normalize_space(u' тр и гла' + '\t' + '\n' + u' за '))
         self.assertEqual(u'тр_и_гла_за', normalize_space(u' тр и гла' + '\t' + '\n' + u' за ', replace='_'))
         self.assertEqual(u'трABCиABCглаABCза', normalize_space(u' тр и гла' + '\t' + '\n' + u' за ', replace='ABC'))
+        self.assertEqual(u'ха х'.encode('utf-8'), normalize_space(u' ха \n х'.encode('utf-8')))
@@ -1,6 +1,6 @@
 # coding: utf-8
 from unittest import TestCase
-from grab.tools.html import find_refresh_url
+from grab.tools.html import find_refresh_url, simplify_html
 
 class HtmlToolsTestCase(TestCase):
 
@@ -24,3 +24,19 @@ class HtmlToolsTestCase(TestCase):
             <meta http-equiv="refresh" content="5; url=http://example.com/">
         """)
         self.assertEqual('http://example.com/', url)
+
+    def test_simplify_html(self):
+        html = """<html><head><STYLE type="text/css">p {}</STYLE></head>
+            <body><!-- <script>x = 1;</script> --><p>foo</p>
+            <script>if (a < b) document.write("</p><div>");</script>
+            <scripts>bar</scripts><svg width="10"><path d="M0"/></svg>
+            <svg/><!-- not closed"""
+        self.assertEqual("""<html><head></head>
+            <body><p>foo</p>
+            
+            <scripts>bar</scripts><svg width="10"><path d="M0"/></svg>
+            <svg/><!-- not closed""", simplify_html(html))
+        self.assertEqual(u'<p>foo</p><scripts>bar</scripts>',
+                         simplify_html(u'<p>foo</p><svg/><svg>1</svg>'
+                                       u'<scripts>bar</scripts>',
+                                       targets=['svg', 'script']))
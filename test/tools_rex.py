@@ -0,0 +1,60 @@
+# coding: utf-8
+from unittest import TestCase
+import re
+
+from grab.tools.rex import RexScanner, get_literal_prefix
+
+BODY = u"""
+<title>Каталог</title>
+<div class="price">price: 100</div>
+<div class="price">price: 200</div>
+<img src="/captcha.png">
+"""
+
+
+class RexScannerTestCase(TestCase):
+    def setUp(self):
+        self.scanner = RexScanner({
+            'title': u'<title>([^<]+)',
+            'price': re.compile(r'price: (?P<value>\d+)'),
+            'captcha': r'captcha\.png',
+            'ban': 'You are banned',
+            'number': r'\d+',
+        })
+
+    def test_scan(self):
+        hits = self.scanner.scan(BODY)
+        self.assertEqual(u'Каталог', hits['title'][0].group(1))
+        self.assertEqual(['100', '200'],
+                         [x.group('value') for x in hits['price']])
+        self.assertEqual(1, len(hits['captcha']))
+        self.assertEqual([], hits['ban'])
+        # Matches of different regexps could overlap
+        self.assertEqual(['100', '200'], [x.group(0) for x in hits['number']])
+
+    def test_finditer(self):
+        names = [name for name, match in self.scanner.finditer(BODY)]
+        self.assertEqual(['title', 'price', 'number', 'price', 'number',
+                          'captcha'], names)
+
+    def test_search(self):
+        hits = self.scanner.search(BODY)
+        self.assertEqual(['captcha', 'number', 'price', 'title'],
+                         sorted(hits.keys()))
+        self.assertEqual('100', hits['price'].group(1))
+
+    def test_byte_body(self):
+        hits = self.scanner.scan(BODY.encode('utf-8'))
+        self.assertEqual(2, len(hits['price']))
+        # Unicode regexp does not match encoded text
+        scanner = RexScanner([('title', u'<title>Каталог')])
+        self.assertEqual([], scanner.scan(BODY.encode('utf-8'))['title'])
+        scanner = RexScanner([('title', u'<title>([^<]+)'.encode('utf-8'))])
+        self.assertEqual(u'Каталог'.encode('utf-8'),
+                         scanner.scan(BODY.encode('utf-8'))['title'][0].group(1))
+
+    def test_literal_prefix(self):
+        self.assertEqual('price: ', get_literal_prefix(re.compile(r'price: \d')))
+        self.assertEqual(u'фы', get_literal_prefix(re.compile(u'фы(ва)?')))
+        self.assertEqual('', get_literal_prefix(re.compile(r'price', re.I)))
+        self.assertEqual('', get_literal_prefix(re.compile(r'\d+')))